@@ -1,17 +1,81 @@
+import itertools
+import json
 import logging
 import re
+import sys
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Iterable, Iterator, TextIO, cast
 
 import click
 import click_logging
-import enchant  # type: ignore
 
 from malcolm3utils import __version__, __version_message__
+from malcolm3utils.utils.parallel import ordered_map
 
 logger = logging.getLogger(__name__)
 click_logging.basic_config(logger)
-d = enchant.Dict("en_US")
+
+DEFAULT_WORD_CACHE_SIZE = 100000
+
+
+class WordCache:
+    """
+    Bounded least recently used memo of enchant dictionary checks.
+
+    The en_US dictionary is only loaded the first time a word
+    is checked that is not already in the cache.
+
+    Words checked since the last call to pop_new_words are tracked
+    so that the checks made by worker processes can be merged back
+    into the main process before the cache is saved.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_WORD_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.words: OrderedDict[str, bool] = OrderedDict()
+        self.new_words: dict[str, bool] = {}
+        self._dictionary: Any = None
+
+    def check(self, word: str) -> bool:
+        result = self.words.get(word)
+        if result is not None:
+            self.words.move_to_end(word)
+            return result
+        if self._dictionary is None:
+            import enchant  # type: ignore
+
+            logger.debug("loading the en_US dictionary")
+            self._dictionary = enchant.Dict("en_US")
+        result = bool(self._dictionary.check(word))
+        self.new_words[word] = result
+        self.update({word: result})
+        return result
+
+    def update(self, words: dict[str, bool]) -> None:
+        self.words.update(words)
+        while len(self.words) > self.maxsize:
+            self.words.popitem(last=False)
+
+    def pop_new_words(self) -> dict[str, bool]:
+        new_words = self.new_words
+        self.new_words = {}
+        return new_words
+
+    def load(self, path: Path) -> None:
+        if path.exists():
+            logger.debug("loading word cache %s", path)
+            with path.open() as fh:
+                self.update(json.load(fh))
+
+    def save(self, path: Path) -> None:
+        logger.debug("saving word cache %s", path)
+        with path.open("w") as fh:
+            json.dump(self.words, fh)
+
+
+word_cache = WordCache()
 
 
 @click.command(
@@ -24,18 +88,56 @@ d = enchant.Dict("en_US")
     below the tool bar, i.e. from the title through to your CCLI license number.
     Paste this into a text file and run this command using that file as the input_file.
 
-    The output is written to that file with the extension changed to chordpro.
+    The output is written to that file with the extension changed to chordpro,
+    in the same directory as the input file unless --output-dir is specified.
+    If the input_file is '-' then stdin is converted and written to stdout.
+
+    Use --jobs to convert a large number of files in parallel.
+    When converting more than one file a summary is written to stderr.
+
+    Use --word-cache to keep the dictionary checks of lyric words
+    between runs, which speeds up large batch conversions.
+
+    Use --split to convert input files containing many songs one after
+    the other. Each song runs from its 'SongSelect logo' line through to
+    its 'CCLI License #' line and is written to a separate file with
+    the song number appended to the name, e.g. songs-001.chordpro
+    (or song-001.chordpro when reading from stdin).
 
     This script attempts to 'fix' everything, but inevitably there will be
     things it gets wrong, so plan on checking the output for correctness.
     No guarantees are given or implied.
     """,
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="number of files (or songs with --split) to convert in parallel",
+)
+@click.option(
+    "--split",
+    is_flag=True,
+    help="split input files containing multiple songs into one output file per song",
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    help="directory to write the output files to",
+)
+@click.option(
+    "--word-cache",
+    "word_cache_file",
+    type=click.Path(dir_okay=False),
+    help="file to load dictionary checks from and save them to",
+)
 @click.version_option(__version__, message=__version_message__)
 @click_logging.simple_verbosity_option(logger)
 @click.argument(
     "input_files",
-    type=click.Path(exists=True),
+    type=click.Path(exists=True, allow_dash=True),
     nargs=-1,
     metavar="input_file",
     required=True,
@@ -43,48 +145,265 @@ d = enchant.Dict("en_US")
 def cli(
     *_: Any,
     input_files: Iterable[click.Path] = (),
+    jobs: int = 1,
+    output_dir: str | None = None,
+    word_cache_file: str | None = None,
+    split: bool = False,
 ) -> None:
-    for input_file in input_files:
-        try:
-            process(Path(str(input_file)))
-        except ValueError as e:
-            msg = f"Exception '{e}' encountered processing {input_file}: skipping file."
-            click.secho(msg, fg="red")
+    start_time = time.perf_counter()
+    word_cache_path = None
+    if word_cache_file is not None:
+        word_cache_path = Path(word_cache_file)
+        word_cache.load(word_cache_path)
+    output_path = None
+    if output_dir is not None:
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+    work_items: Iterable[tuple[str, Path | list[str], Path | None]]
+    if split:
+        unit = "song"
+        work_items = _song_work_items(input_files, output_path)
+    else:
+        unit = "file"
+        work_items = ((str(x), Path(str(x)), output_path) for x in input_files)
+        if any(str(x) == "-" for x in input_files):
+            # worker processes can not read from stdin
+            jobs = 1
+    n_succeeded = 0
+    n_failed = 0
+    for label, error, new_words in ordered_map(
+        _convert_work_item,
+        work_items,
+        jobs=jobs,
+        initializer=_init_worker,
+        initargs=(dict(word_cache.words),),
+    ):
+        word_cache.update(new_words)
+        if error is None:
+            n_succeeded += 1
+        else:
+            n_failed += 1
+            msg = (
+                f"Exception '{error}' encountered processing {label}: skipping {unit}."
+            )
+            click.secho(msg, fg="red", err=label == "-")
+    if n_succeeded + n_failed > 1:
+        elapsed = time.perf_counter() - start_time
+        msg = f"Converted {n_succeeded} {unit}s ({n_failed} failed) in {elapsed:.2f} seconds"
+        click.echo(msg, err=True)
+    if word_cache_path is not None:
+        word_cache.save(word_cache_path)
+
+
+def _init_worker(words: dict[str, bool]) -> None:  # pragma: no cover
+    global word_cache
+    word_cache = WordCache()
+    word_cache.update(words)
+
+
+def _song_work_items(
+    input_files: Iterable[click.Path], output_dir: Path | None
+) -> Iterator[tuple[str, list[str], Path]]:
+    for x in input_files:
+        input_file = Path(str(x))
+        if str(input_file) == "-":
+            yield from _song_work_items_from(sys.stdin, "-", Path("song"), output_dir)
+        else:
+            with input_file.open(mode="r") as fh:
+                yield from _song_work_items_from(
+                    fh, str(input_file), input_file.with_suffix(""), output_dir
+                )
+
+
+def _song_work_items_from(
+    fh: Iterable[str], input_name: str, output_stem: Path, output_dir: Path | None
+) -> Iterator[tuple[str, list[str], Path]]:
+    if output_dir is not None:
+        output_stem = output_dir / output_stem.name
+    for isong, lines in enumerate(split_songs(read_lines(fh)), start=1):
+        output_file = Path(f"{output_stem}-{isong:03d}.chordpro")
+        yield f"song {isong} of {input_name}", lines, output_file
+
+
+def _convert_work_item(
+    args: tuple[str, Path | list[str], Path | None],
+) -> tuple[str, str | None, dict[str, bool]]:
+    label, source, output = args
+    error = None
+    try:
+        if isinstance(source, Path):
+            process(source, output)
+        else:
+            _write_output_file(convert(source), cast(Path, output))
+    except (OSError, ValueError) as e:
+        error = str(e)
+    return label, error, word_cache.pop_new_words()
 
 
 comment_regex = re.compile(r"Intro|Verse|Verse \d+|Chorus|Chorus \d+|Bridge")
-chord_regex = re.compile(
-    r"([A-G](?:b|#)?m?(?:2|4|7|sus2|sus4|maj7)?(?:/[A-G](?:b|#)?)?)(\w*)"
-)
 
+CHORD_ROOTS = ["A", "B", "C", "D", "E", "F", "G"]
+CHORD_ACCIDENTALS = ["", "b", "#"]
+CHORD_QUALITIES = ["", "m"]
+CHORD_EXTENSIONS = ["", "2", "4", "7", "sus2", "sus4", "maj7"]
 
-def chord_replace(matchobj: re.Match) -> str:
-    chord = matchobj.group(1)
-    word = matchobj.group(2)
-    if word == "" or d.check(word):
-        return f"[{chord}]{word}"
-    return f"{chord}{word}"
 
+def _chord_spellings() -> Iterator[str]:
+    roots = [r + a for r in CHORD_ROOTS for a in CHORD_ACCIDENTALS]
+    basses = ["", *[f"/{x}" for x in roots]]
+    for root, quality, extension, bass in itertools.product(
+        roots, CHORD_QUALITIES, CHORD_EXTENSIONS, basses
+    ):
+        yield f"{root}{quality}{extension}{bass}"
 
-def process(input_file: Path) -> None:  # noqa: C901
+
+VALID_CHORDS = frozenset(_chord_spellings())
+MAX_CHORD_LENGTH = max(len(x) for x in VALID_CHORDS)
+
+# a bar marker, or a chord candidate: a root followed by the longest run of
+# characters that could be part of a chord (including a bass note) or a word
+lyric_token_regex = re.compile(r"\||[A-G]#?\w*(?:/[A-G]#?\w*)?")
+word_regex = re.compile(r"\w*")
+
+
+def process(input_file: Path, output_dir: Path | None = None) -> None:
+    """
+    Convert the CCLI chord text input_file to a chordpro file.
+
+    If input_file is '-' then stdin is converted and written to stdout.
+
+    :param input_file: CCLI chord text file to convert
+    :param output_dir: directory for the chordpro file (default=directory of input_file)
+    """
     logger.debug("Processing %s", input_file)
+    if str(input_file) == "-":
+        write_lines(convert(read_lines(sys.stdin)), sys.stdout)
+        return
+
+    output_file = input_file.with_suffix(".chordpro")
+    if output_dir is not None:
+        output_file = output_dir / output_file.name
     with input_file.open(mode="r") as fh:
-        input_lines = [line.strip() for line in fh.readlines()]
+        _write_output_file(convert(read_lines(fh)), output_file)
+
+
+def _write_output_file(output_lines: Iterator[str], output_file: Path) -> None:
+    # converting the first line validates the whole song,
+    # so the output file is not created if the input is bad
+    first_line = next(output_lines)
+    logger.debug("...writing the output file %s", output_file)
+    with open(output_file, "w") as output_fh:
+        write_lines(itertools.chain([first_line], output_lines), output_fh)
 
-    logger.debug("...read %d lines", len(input_lines))
-    output_lines = []
+
+def split_songs(lines: Iterable[str]) -> Iterator[list[str]]:
+    """
+    Split the lines of a CCLI chord text containing many songs into the lines of each song.
+
+    A song starts with a line containing 'SongSelect logo' and ends with a line
+    starting with 'CCLI License #'. Lines outside of a song are skipped.
+    A song that starts before the previous one has ended is still returned
+    so that convert can report the problem with it.
+
+    :param lines: stripped lines of the CCLI chord text
+    :return: iterator over the lines of each song
+    """
+    song_lines: list[str] | None = None
+    for line in lines:
+        if "SongSelect logo" in line:
+            if song_lines is not None:
+                yield song_lines
+            song_lines = [line]
+        elif song_lines is not None:
+            song_lines.append(line)
+            if line.startswith("CCLI License # "):
+                yield song_lines
+                song_lines = None
+    if song_lines is not None:
+        yield song_lines
+
+
+def read_lines(fh: Iterable[str]) -> Iterator[str]:
+    """
+    Line source for convert: yields each line stripped of surrounding whitespace.
+    """
+    for line in fh:
+        yield line.strip()
+
+
+def write_lines(lines: Iterable[str], fh: TextIO) -> None:
+    """
+    Writer for convert: writes the lines separated by newlines.
+    """
+    separator = ""
+    for line in lines:
+        fh.write(separator)
+        fh.write(line)
+        separator = "\n"
+
+
+def convert(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Convert the lines of a CCLI chord text to chordpro lines.
+
+    The input is consumed a line at a time, up to and including the
+    'CCLI License #' line. As the CCLI song and license numbers are
+    written before the lyrics, the converted lyric lines are held
+    until they have been found, so nothing is yielded until the
+    whole song has been validated.
+
+    :param lines: stripped lines of the CCLI chord text
+    :return: iterator over the chordpro lines
+    :raises ValueError: if the CCLI chord text is not in the expected format
+    """
+    line_iter = iter(lines)
+    header_lines = _convert_header(line_iter)
+
+    logger.debug("...processing the rest of the file")
+    lyric_lines = []
+    ccli_song = None
+    ccli_license = None
+    for line in line_iter:
+        if ccli_song is None:
+            if line.startswith("CCLI Song # "):
+                logger.debug("...found the ccli-song line")
+                ccli_song = line.replace("CCLI Song # ", "")
+            else:
+                lyric_lines.append(convert_lyric_line(line))
+        elif line.startswith("CCLI License # "):
+            logger.debug("...found the ccli-license line")
+            ccli_license = line.replace("CCLI License # ", "")
+            break
+
+    logger.debug("...checkig that ccli-song line is present")
+    if ccli_song is None:
+        msg = "Could not locate 'CCLI Song #' line"
+        raise ValueError(msg)
+
+    logger.debug("...checkig that ccli-license line is present")
+    if ccli_license is None:
+        msg = "Could not locate 'CCLI License #' line"
+        raise ValueError(msg)
+
+    yield from header_lines
+    yield f"{{meta: ccli song {ccli_song}}}"
+    yield f"{{meta: ccli license {ccli_license}}}"
+    yield from lyric_lines
+
+
+def _convert_header(line_iter: Iterator[str]) -> list[str]:
+    header_lines = []
 
     logger.debug("...processing title line")
-    line = input_lines[0]
+    line = next(line_iter, "")
     if "SongSelect logo" not in line:
         msg = "First line does not contain 'SongSelect logo'"
         raise ValueError(msg)
     line = line.replace("SongSelect logo", "")
-    line = f"{{title: {line}}}"
-    output_lines.append(line)
+    header_lines.append(f"{{title: {line}}}")
 
     logger.debug("...processing artists line")
-    line = input_lines[1]
+    line = next(line_iter, "")
     artists = line.split(" | ")
     if len(artists) > 1:
         artists[-1] = f"and {artists[-1]}"
@@ -92,75 +411,62 @@ def process(input_file: Path) -> None:  # noqa: C901
         sep = ", "
     else:
         sep = " "
-    line = f"{{artist: {sep.join(artists)}}}"
-    output_lines.append(line)
+    header_lines.append(f"{{artist: {sep.join(artists)}}}")
 
     logger.debug("...processing based-on line")
-    line = input_lines[2]
+    line = next(line_iter, "")
     if "based on" not in line:
         msg = "Third line does not contain 'based on'"
         raise ValueError(msg)
     line = line.strip("()")
-    line = f"{{meta: {line}}}"
-    output_lines.append(line)
+    header_lines.append(f"{{meta: {line}}}")
 
     logger.debug("...processing key line")
-    line = input_lines[3]
+    line = next(line_iter, "")
     if not line.startswith("Key"):
         msg = "Fourth line does not start with 'Key'"
         raise ValueError(msg)
     for k, v in [y.split(" - ") for y in line.split(" | ")]:
-        output_lines.append(f"{{{k.lower()}: {v}}}")
+        header_lines.append(f"{{{k.lower()}: {v}}}")
 
     logger.debug("...adding chordcolor line")
-    output_lines.append("{chordcolor: blue}")
-
-    logger.debug("...adding ccli-song line")
-    ccli_song_line = len(output_lines)
-    output_lines.append("{meta: ccli song ")
-
-    logger.debug("...adding ccli-license line")
-    ccli_license_line = len(output_lines)
-    output_lines.append("{meta: ccli license ")
+    header_lines.append("{chordcolor: blue}")
+    return header_lines
 
-    found_ccli_song_line = False
-    found_ccli_license_line = False
-    logger.debug("...processing the rest of the file")
-    for line in input_lines[4:]:
-        if line.startswith("CCLI Song # "):
-            logger.debug("...found the ccli-song line")
-            found_ccli_song_line = True
-            line = line.replace("CCLI Song # ", "")
-            output_lines[ccli_song_line] += line
-            output_lines[ccli_song_line] += "}"
-        if not found_ccli_song_line:
-            logger.debug("...processing lyrics line")
-            if comment_regex.fullmatch(line):
-                logger.debug("......comment line")
-                output_lines.append(f"{{comment: {line}}}")
-            else:
-                logger.debug("......regular lyric line")
-                output_lines.append(
-                    chord_regex.sub(chord_replace, line).replace("|", "[|]")
-                )
-        elif line.startswith("CCLI License # "):
-            logger.debug("...found the ccli-license line")
-            found_ccli_license_line = True
-            line = line.replace("CCLI License # ", "")
-            output_lines[ccli_license_line] += line
-            output_lines[ccli_license_line] += "}"
 
-    logger.debug("...checkig that ccli-song line is present")
-    if not found_ccli_song_line:
-        msg = "Could not locate 'CCLI Song #' line"
-        raise ValueError(msg)
+def convert_lyric_line(line: str) -> str:
+    """
+    Convert a lyric line, which is either a comment such as 'Verse 1'
+    or a line of lyrics with embedded chords.
+    """
+    if comment_regex.fullmatch(line):
+        logger.debug("......comment line")
+        return f"{{comment: {line}}}"
+    logger.debug("......regular lyric line")
+    output_parts = []
+    pos = 0
+    while (matchobj := lyric_token_regex.search(line, pos)) is not None:
+        start = matchobj.start()
+        output_parts.append(line[pos:start])
+        token = matchobj.group()
+        if token == "|":
+            output_parts.append("[|]")
+            pos = matchobj.end()
+            continue
+        chord = _longest_chord(token)
+        word = word_regex.match(token, len(chord)).group()  # type: ignore[union-attr]
+        if word == "" or word_cache.check(word):
+            output_parts.append(f"[{chord}]{word}")
+        else:
+            output_parts.append(f"{chord}{word}")
+        # anything left of the token (e.g. the '/B' of 'Gfoo/B') is scanned again
+        pos = start + len(chord) + len(word)
+    output_parts.append(line[pos:])
+    return "".join(output_parts)
 
-    logger.debug("...checkig that ccli-license line is present")
-    if not found_ccli_license_line:
-        msg = "Could not locate 'CCLI License #' line"
-        raise ValueError(msg)
 
-    logger.debug("...writing the output file")
-    output_file = input_file.with_suffix(".chordpro")
-    with open(output_file, "w") as fh:
-        fh.write("\n".join(output_lines))
+def _longest_chord(token: str) -> str:
+    for end in range(min(len(token), MAX_CHORD_LENGTH), 1, -1):
+        if token[:end] in VALID_CHORDS:
+            return token[:end]
+    return token[0]
@@ -0,0 +1,121 @@
+# Thin client shims for the CSV tools, these are imported on every
+# invocation so should only import modules that are quick to import.
+import json
+import os
+import socket
+import struct
+import sys
+from importlib import import_module
+from typing import Any, Sequence
+
+SOCKET_ENV = "MALCOLM3UTILS_SOCKET"
+
+# modules providing the cli of each tool that can be run by the server
+TOOLS = {
+    "getcol": "malcolm3utils.scripts.getcol",
+    "csv-filter": "malcolm3utils.scripts.csv_filter",
+    "csv-merge": "malcolm3utils.scripts.csv_merge",
+    "csv-diff": "malcolm3utils.scripts.csv_diff",
+}
+
+# a request is the length of the JSON encoded request followed by the request,
+# sent along with the stdin, stdout and stderr file descriptors,
+# and is answered with the exit code once the tool has finished
+REQUEST_LENGTH = struct.Struct("!I")
+EXIT_CODE = struct.Struct("!i")
+MAX_REQUEST_LENGTH = 16 * 1024 * 1024
+
+
+def run_tool(tool: str) -> None:
+    """
+    Run the tool and exit with its exit code.
+
+    If the MALCOLM3UTILS_SOCKET environment variable names the socket of a
+    running ``malcolm3utils serve`` process, the tool is run by that server,
+    which already has its dependencies imported, with this process's
+    arguments, working directory, environment, stdin, stdout and stderr.
+    Otherwise the tool is imported and run in this process as usual.
+
+    :param tool: name of the tool in TOOLS
+    """
+    socket_path = os.environ.get(SOCKET_ENV)
+    if socket_path:
+        exit_code = forward(socket_path, tool, sys.argv[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
+    import_module(TOOLS[tool]).cli(prog_name=tool)
+
+
+def forward(
+    socket_path: str,
+    tool: str,
+    argv: Sequence[str],
+    fds: Sequence[int] = (0, 1, 2),
+) -> int | None:
+    """
+    Run the tool in the server listening on socket_path.
+
+    :param socket_path: path of the server's Unix socket
+    :param tool: name of the tool in TOOLS
+    :param argv: arguments for the tool
+    :param fds: file descriptors to use as the tool's stdin, stdout and stderr
+    :return: exit code of the tool, or None if no server is listening
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return None
+        send_request(sock, {"tool": tool, "argv": list(argv)}, fds)
+        return receive_exit_code(sock)
+
+
+def send_request(
+    sock: socket.socket, request: dict[str, Any], fds: Sequence[int]
+) -> None:
+    """
+    Send a request along with the working directory and environment of this process.
+
+    :param sock: socket connected to the server
+    :param request: the tool and its arguments
+    :param fds: file descriptors to use as the tool's stdin, stdout and stderr
+    """
+    request = dict(request, cwd=os.getcwd(), env=dict(os.environ))
+    encoded = json.dumps(request).encode()
+    data = REQUEST_LENGTH.pack(len(encoded)) + encoded
+    sent = socket.send_fds(sock, [data], list(fds))
+    if sent < len(data):
+        # the server may already have run the tool and closed the connection
+        # once it has everything, so nothing more should be sent after that
+        sock.sendall(data[sent:])
+
+
+def receive_exit_code(sock: socket.socket) -> int:
+    data = b""
+    while len(data) < EXIT_CODE.size:
+        try:
+            received = sock.recv(EXIT_CODE.size - len(data))
+        except ConnectionError:
+            received = b""
+        if not received:
+            print("malcolm3utils server closed the connection", file=sys.stderr)
+            return 1
+        data += received
+    (exit_code,) = EXIT_CODE.unpack(data)
+    return int(exit_code)
+
+
+def getcol() -> None:
+    run_tool("getcol")
+
+
+def csv_filter() -> None:
+    run_tool("csv-filter")
+
+
+def csv_merge() -> None:
+    run_tool("csv-merge")
+
+
+def csv_diff() -> None:
+    run_tool("csv-diff")
@@ -1,11 +1,14 @@
-import csv
 import logging
-from pathlib import Path
 
 import click
 import click_logging
 
-from malcolm3utils.utils.csvio import DEFAULT_DELIMITER, csv_options
+from malcolm3utils.utils.csvio import (
+    DEFAULT_DELIMITER,
+    csv_options,
+    open_csv_output,
+    open_csv_reader,
+)
 
 from .. import __version__, __version_message__
 
@@ -45,36 +48,35 @@ def cli(
 ) -> None:
     if output_delimiter is None:
         output_delimiter = delimiter
-    firct_csv_path = Path(str(first_csv_file))
-    second_csv_path = Path(str(second_csv_file))
-    with firct_csv_path.open(mode="r") as first_csv_fh:
-        with second_csv_path.open(mode="r") as second_csv_fh:
-
-            reader1 = csv.DictReader(first_csv_fh, delimiter=delimiter)
-            reader2 = csv.DictReader(second_csv_fh, delimiter=delimiter)
+    with (
+        open_csv_reader(
+            str(first_csv_file), delimiter=delimiter, as_rows=True
+        ) as reader1,
+        open_csv_reader(
+            str(second_csv_file), delimiter=delimiter, as_rows=True
+        ) as reader2,
+        open_csv_output() as out,
+    ):
+        fieldnames1 = set(reader1.fieldnames or [])
+        fieldnames2 = set(reader2.fieldnames or [])
+        only_in_1 = fieldnames1 - fieldnames2
+        if only_in_1:
+            out.write(f"Columns only in {first_csv_file}:\n")
+            for key in only_in_1:
+                out.write(f"\t{key}\n")
+        only_in_2 = fieldnames2 - fieldnames1
+        if only_in_2:
+            out.write(f"Columns only in {second_csv_file}:\n")
+            for key in only_in_2:
+                out.write(f"\t{key}\n")
+        common_fields = fieldnames1 & fieldnames2
+        fieldnames = [x for x in list(reader1.fieldnames or []) if x in common_fields]
 
-            fieldnames1 = set(reader1.fieldnames or [])
-            fieldnames2 = set(reader2.fieldnames or [])
-            only_in_1 = fieldnames1 - fieldnames2
-            if only_in_1:
-                print(f"Columns only in {first_csv_file}:")
-                for key in only_in_1:
-                    print(f"\t{key}")
-            only_in_2 = fieldnames2 - fieldnames1
-            if only_in_2:
-                print(f"Columns only in {second_csv_file}:")
-                for key in only_in_2:
-                    print(f"\t{key}")
-            common_fields = fieldnames1 & fieldnames2
-            fieldnames = [
-                x for x in list(reader1.fieldnames or []) if x in common_fields
+        for i, (data1, data2) in enumerate(zip(reader1, reader2)):
+            diffs = [
+                f'"{k}":"{data1[k]}"|"{data2[k]}"'
+                for k in fieldnames
+                if data1[k] != data2[k]
             ]
-
-            for i, (data1, data2) in enumerate(zip(reader1, reader2)):
-                diffs = [
-                    f'"{k}":"{data1[k]}"|"{data2[k]}"'
-                    for k in fieldnames
-                    if data1[k] != data2[k]
-                ]
-                if diffs:
-                    print(f"Row {i + 1}:: {output_delimiter.join(diffs)}")
+            if diffs:
+                out.write(f"Row {i + 1}:: {output_delimiter.join(diffs)}\n")
@@ -1,15 +1,38 @@
+import csv
+import functools
+import io
 import logging
-import sys
-from csv import DictReader, DictWriter
-from io import TextIOWrapper
-from typing import Any, TextIO, Tuple
+import random
+from contextlib import ExitStack, closing, contextmanager
+from itertools import chain, islice
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Generator,
+    Iterable,
+    Iterator,
+    Tuple,
+)
 
 import click
 import click_logging
 
 from malcolm3utils import __version__, __version_message__
-from malcolm3utils.utils.csvio import csv_options
-from malcolm3utils.utils.filter_parser import create_filter
+from malcolm3utils.utils.csvindex import CsvIndex
+from malcolm3utils.utils.csvio import (
+    DEFAULT_ENCODING,
+    CsvChunkReader,
+    CsvRowReader,
+    csv_options,
+    open_csv_chunks,
+    open_csv_output,
+    open_csv_reader,
+    parse_column_spec,
+    read_csv_header,
+    resolve_column_spec,
+)
+from malcolm3utils.utils.parallel import ordered_map
 
 logger = logging.getLogger()
 
@@ -32,18 +55,44 @@ logger = logging.getLogger()
     \b
     Available operators are:
     +, -, *, /, %, //, ==, !=, <, <=, >, >=, not, and, or
+    in and not in, e.g. S in ('a', 'b', 3) checks S is one of the values
+    ~ matches a field against a regular expression, e.g. S ~ '^[ab]'
     String literals can be specified using single quotes.
     Field names with spaces should be surrounded by double quotes.
 
-    If no csv_files are specified, read from stdin.
+    If no csv_files are specified, or a csv_file is '-', read from stdin.
 
     If no --output specified, write to stdout.
 
+    With --columns only the given columns are written, using the same
+    column_spec as getcol (a comma separated list of column headers,
+    column indexes (one-based) or column ranges such as 4-6),
+    with the indexes referring to the columns of all the files.
+
     Input files do not all have to have the same columns.
-    The output will have all columns.
-    To achieve this all csv_files are opened at program initiation.
-    This may cause problems with your system's open file limit if
-    you are attempting to filter a large number of files at once.
+    The output has the columns of all the files, or just those selected
+    with --columns, left empty for the rows of files without them.
+    To achieve this the header of every csv_file is read first,
+    and then each csv_file is opened in turn as it is filtered,
+    so any number of files can be filtered at once.
+
+    If a csv_file has an index built by csv-index --key-column, and
+    the expression requires that column to equal one of some values
+    (e.g. "id == 42" or "id in ('a', 'b') and age > 4"), only the rows
+    with those values are read from it rather than the whole file.
+
+    With --jobs greater than 1 each file is split into chunks of
+    whole rows which are filtered in parallel by that many worker
+    processes, with the output rows kept in their original order.
+
+    \b
+    To look at just some of the matching rows:
+    --limit N      stop reading the inputs once N rows have been written
+    --sample P     write each matching row with probability P
+    --sample-n N   write N matching rows chosen at random, in their
+                   original order (this has to read all the inputs)
+    --count        print the number of matching rows instead of the rows
+    --seed makes the sampling repeatable.
     """,
 )
 @click.argument(
@@ -53,7 +102,7 @@ logger = logging.getLogger()
 )
 @click.argument(
     "csv_files",
-    type=click.Path(exists=True),
+    type=click.Path(exists=True, allow_dash=True),
     nargs=-1,
     metavar="csv_file",
     required=False,
@@ -67,63 +116,375 @@ logger = logging.getLogger()
 @click.option(
     "--output",
     type=click.Path(exists=False),
-    help="output file name",
+    help="output file name (compressed if it ends in .gz, .bz2, .xz or .zst)",
+)
+@click.option(
+    "-c",
+    "--columns",
+    "column_spec",
+    metavar="COLUMN_SPEC",
+    help="columns to write (default=all)",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="number of worker processes to filter with",
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=0),
+    help="stop once this many rows have been written",
+)
+@click.option(
+    "--sample",
+    type=click.FloatRange(min=0, max=1),
+    help="probability of writing each matching row",
+)
+@click.option(
+    "--sample-n",
+    type=click.IntRange(min=0),
+    help="number of matching rows to choose at random",
+)
+@click.option(
+    "--seed",
+    type=int,
+    help="seed for the random sampling",
+)
+@click.option(
+    "--count",
+    is_flag=True,
+    help="print the number of matching rows instead of the rows",
 )
 @csv_options()
 @click.version_option(__version__, message=__version_message__)
 @click_logging.simple_verbosity_option(logger)
-def cli(  # noqa: C901
+def cli(
     filter_expression: str,
     csv_files: Tuple[click.Path, ...] = (),
     keep: bool = True,
     output: click.Path | None = None,
     delimiter: str = ",",
     output_delimiter: str | None = None,
+    column_spec: str | None = None,
+    jobs: int = 1,
+    limit: int | None = None,
+    sample: float | None = None,
+    sample_n: int | None = None,
+    seed: int | None = None,
+    count: bool = False,
 ) -> None:
 
+    _check_options(output, sample, sample_n, count)
     if output_delimiter is None:
         output_delimiter = delimiter
-    filter_function = create_filter(filter_expression)
-    input_fhs = []
-    readers = []
-    fieldnames = []
-    output_fh = None
-    try:
-        if output is None:  # pragma: no cover
-            output_fh = sys.stdout
+    from malcolm3utils.utils.filter_parser import (
+        create_filter,
+        equality_lookups,
+        parse_filter,
+    )
+
+    filter_tree = parse_filter(filter_expression)
+    filter_function = create_filter(filter_tree)
+    input_files = [str(x) for x in csv_files] or ["-"]
+    # rows that are discarded can not be looked up in an index,
+    # and the expression is only analysed once an input is found to have one
+    find_lookups = (
+        functools.cache(functools.partial(equality_lookups, filter_tree))
+        if keep
+        else None
+    )
+    open_reader = _input_opener(jobs, delimiter, find_lookups)
+    with ExitStack() as stack:
+        # stdin can only be read once, so is left open after reading its header
+        stdin_reader = None
+        if "-" in input_files:
+            stdin_reader = stack.enter_context(open_reader("-"))
+        fieldnames = _select_columns(
+            column_spec,
+            _union_fieldnames(_iter_headers(input_files, stdin_reader, delimiter)),
+        )
+        # closed explicitly so an input that is not read to the end is closed
+        readers = stack.enter_context(
+            closing(_iter_readers(input_files, open_reader, stdin_reader))
+        )
+        # the rows are only needed in this process to limit, sample or count them
+        whole_output = (limit, sample, sample_n) == (None, None, None) and not count
+
+        rows: Iterable[list[str]]
+        if jobs > 1:
+            chunks = _iter_chunks(
+                readers,
+                (filter_expression, keep),
+                (fieldnames, delimiter, output_delimiter),
+            )
+            if whole_output:
+                writer = stack.enter_context(_open_output(output, output_delimiter))
+                writer.writerow(fieldnames)
+                for text in ordered_map(_filter_chunk, chunks, jobs=jobs):
+                    writer.write(text)
+                return
+            results = stack.enter_context(
+                closing(ordered_map(_filter_chunk_rows, chunks, jobs=jobs))
+            )
+            rows = chain.from_iterable(results)
         else:
-            output_fh = open(str(output), "w")
-
-        if csv_files:
-            for csv_file in csv_files:
-                input_fh: TextIOWrapper[Any] | TextIO | Any = open(str(csv_file))
-                input_fhs.append(input_fh)
-                reader = DictReader(input_fh, delimiter=delimiter)
-                if reader.fieldnames is not None:
-                    fieldnames.extend(
-                        [x for x in reader.fieldnames if x not in fieldnames]
-                    )
-                readers.append(reader)
-        else:  # pragma: no cover
-            input_fh = sys.stdin
-            input_fhs.append(input_fh)
-            reader = DictReader(input_fh)
-            if reader.fieldnames is not None:
-                fieldnames.extend(reader.fieldnames)
-            readers.append(reader)
-
-        writer = DictWriter(
-            output_fh, fieldnames=fieldnames, delimiter=output_delimiter
+            rows = _filter_rows(readers, filter_function, keep, fieldnames)
+
+        rows = _sample_rows(rows, sample, sample_n, random.Random(seed))
+        if limit is not None:
+            rows = islice(rows, limit)
+        if count:
+            click.echo(sum(1 for _ in rows))
+            return
+        writer = stack.enter_context(_open_output(output, output_delimiter))
+        writer.writerow(fieldnames)
+        writer.writerows(rows)
+
+
+def _check_options(
+    output: click.Path | None,
+    sample: float | None,
+    sample_n: int | None,
+    count: bool,
+) -> None:
+    if sample is not None and sample_n is not None:
+        raise click.UsageError("--sample and --sample-n can not be used together")
+    if count and output is not None:
+        raise click.UsageError("--count and --output can not be used together")
+
+
+def _open_output(output: click.Path | None, delimiter: str) -> ContextManager[Any]:
+    return open_csv_output("-" if output is None else str(output), delimiter=delimiter)
+
+
+def _iter_chunks(
+    readers: Iterable[Any],
+    filter_args: tuple[str, bool],
+    output_args: tuple[list[str], str, str],
+) -> Iterator[tuple[str, bool, list[str], list[str], str, str, bytes]]:
+    # the arguments for _filter_chunk for each chunk of each file
+    for reader in readers:
+        if reader.fieldnames is not None:
+            for chunk in reader:
+                yield (*filter_args, reader.fieldnames, *output_args, chunk)
+
+
+def _filter_rows(
+    readers: Iterable[Any],
+    filter_function: Callable[[Any], bool],
+    keep: bool,
+    fieldnames: list[str],
+) -> Iterator[list[str]]:
+    for reader in readers:
+        project = reader.projector(fieldnames)
+        yield from (project(row) for row in reader if filter_function(row) == keep)
+
+
+def _sample_rows(
+    rows: Iterable[list[str]],
+    sample: float | None,
+    sample_n: int | None,
+    rng: random.Random,
+) -> Iterable[list[str]]:
+    """
+    Choose rows at random.
+
+    :param rows: the rows to choose from
+    :param sample: probability of choosing each row, or None
+    :param sample_n: number of rows to choose, or None
+    :param rng: random number generator to choose with
+    :return: the chosen rows in their original order, or all the rows
+        if neither sample or sample_n is given
+    """
+    if sample is not None:
+        return (row for row in rows if rng.random() < sample)
+    if sample_n is not None:
+        return _reservoir_sample(rows, sample_n, rng)
+    return rows
+
+
+def _reservoir_sample(
+    rows: Iterable[list[str]], n: int, rng: random.Random
+) -> list[list[str]]:
+    # reservoir sampling (Algorithm R), keeping the index of each row
+    # so that the chosen rows can be put back in their original order
+    reservoir: list[tuple[int, list[str]]] = []
+    for i, row in enumerate(rows):
+        if i < n:
+            reservoir.append((i, row))
+        else:
+            j = rng.randrange(i + 1)
+            if j < n:
+                reservoir[j] = (i, row)
+    reservoir.sort(key=lambda x: x[0])
+    return [row for _, row in reservoir]
+
+
+def _union_fieldnames(headers: Iterable[list[str] | None]) -> list[str]:
+    fieldnames: list[str] = []
+    for header in headers:
+        fieldnames.extend([x for x in header or [] if x not in fieldnames])
+    return fieldnames
+
+
+def _select_columns(column_spec: str | None, fieldnames: list[str]) -> list[str]:
+    if column_spec is None:
+        return fieldnames
+    indexes = resolve_column_spec(parse_column_spec(column_spec), fieldnames)
+    return [fieldnames[i] for i in indexes if 0 <= i < len(fieldnames)]
+
+
+def _iter_headers(
+    input_files: list[str], stdin_reader: Any, delimiter: str
+) -> Iterator[list[str] | None]:
+    for input_file in input_files:
+        if input_file == "-":
+            yield stdin_reader.fieldnames
+        else:
+            yield read_csv_header(input_file, delimiter=delimiter)
+
+
+def _input_opener(
+    jobs: int,
+    delimiter: str,
+    find_lookups: Callable[[], dict[str, frozenset[Any]]] | None,
+) -> Callable[[str], ContextManager[Any]]:
+    open_reader: Callable[[str], ContextManager[Any]]
+    if jobs > 1:
+        open_reader = functools.partial(open_csv_chunks, delimiter=delimiter)
+    else:
+        open_reader = functools.partial(
+            open_csv_reader, delimiter=delimiter, as_rows=True
         )
-        writer.writeheader()
-
-        for reader in readers:
-            for row in reader:
-                if filter_function(row) == keep:
-                    writer.writerow(row)
-
-    finally:
-        for input_fh in input_fhs:
-            input_fh.close()
-        if output_fh is not None:
-            output_fh.close()
+    if find_lookups is None:
+        return open_reader
+    return functools.partial(
+        _open_indexed,
+        open_reader=open_reader,
+        find_lookups=find_lookups,
+        delimiter=delimiter,
+        as_chunks=jobs > 1,
+    )
+
+
+@contextmanager
+def _open_indexed(
+    input_file: str,
+    open_reader: Callable[[str], ContextManager[Any]],
+    find_lookups: Callable[[], dict[str, frozenset[Any]]],
+    delimiter: str,
+    as_chunks: bool,
+) -> Iterator[Any]:
+    """
+    Open a reader of just the rows of input_file that could match the lookups,
+    if it has an up to date CsvIndex of one of the looked up fields,
+    and otherwise open a reader of the whole file with open_reader.
+
+    :param input_file: file to be read
+    :param open_reader: function opening a reader of the whole file
+    :param find_lookups: function returning the values each field must equal
+        one of, from filter_parser.equality_lookups,
+        only called once an index of input_file has been found
+    :param delimiter: column delimiter
+    :param as_chunks: open a CsvChunkReader rather than a CsvRowReader
+    :return: context manager yielding the reader
+    """
+    index = None if input_file == "-" else CsvIndex.load(input_file)
+    lookups = {} if index is None else find_lookups()
+    if (
+        index is None
+        or index.key_column not in lookups
+        or index.info["delimiter"] != delimiter
+    ):
+        with open_reader(input_file) as reader:
+            yield reader
+        return
+    offsets = _index_offsets(index, lookups[index.key_column])
+    logger.debug(
+        'reading %d of the %d rows of "%s" through its index',
+        len(offsets),
+        index.rows,
+        input_file,
+    )
+    encoding = index.info["encoding"]
+    with index.open_row_bytes(offsets) as fh:
+        if as_chunks:
+            yield CsvChunkReader(
+                fh, delimiter=delimiter, encoding=encoding, fieldnames=index.fieldnames
+            )
+        else:
+            text = io.TextIOWrapper(fh, encoding=encoding, newline="")
+            yield CsvRowReader(text, delimiter=delimiter, fieldnames=index.fieldnames)
+
+
+def _index_offsets(index: CsvIndex, values: frozenset[Any]) -> list[int]:
+    # numbers compare by value, e.g. 1 equals "01" and "1.0", and a row whose key
+    # is both a looked up string and number is only read once
+    offsets = set(
+        chain.from_iterable(
+            index.find_key(x) if isinstance(x, str) else index.find_number(x)
+            for x in values
+        )
+    )
+    return sorted(offsets)
+
+
+def _iter_readers(
+    input_files: list[str],
+    open_reader: Callable[[str], ContextManager[Any]],
+    stdin_reader: Any,
+) -> Generator[Any, None, None]:
+    # each file is only open while its reader is in use
+    for input_file in input_files:
+        if input_file == "-":
+            yield stdin_reader
+        else:
+            with open_reader(input_file) as reader:
+                yield reader
+
+
+@functools.cache
+def _compiled_filter(filter_expression: str) -> Callable[[Any], bool]:
+    from malcolm3utils.utils.filter_parser import create_filter
+
+    return create_filter(filter_expression)  # type: ignore[no-any-return]
+
+
+def _filter_chunk(
+    args: tuple[str, bool, list[str], list[str], str, str, bytes],
+) -> str:
+    """
+    Filter a chunk of whole rows of a CSV file in a worker process.
+
+    The filter expression is compiled the first time each worker sees it.
+
+    :param args: filter expression, keep, fieldnames of the file,
+        output fieldnames, delimiter, output delimiter, and the chunk
+    :return: the CSV text of the rows that are kept
+    """
+    output = io.StringIO()
+    csv.writer(output, delimiter=args[5]).writerows(_filter_chunk_rows(args))
+    return output.getvalue()
+
+
+def _filter_chunk_rows(
+    args: tuple[str, bool, list[str], list[str], str, str, bytes],
+) -> list[list[str]]:
+    """
+    Filter a chunk of whole rows of a CSV file in a worker process.
+
+    :param args: as for _filter_chunk
+    :return: the rows that are kept, with the output fieldnames
+    """
+    filter_expression, keep, fieldnames, output_fieldnames, delimiter, _, chunk = args
+    filter_function = _compiled_filter(filter_expression)
+    reader = CsvRowReader(
+        io.StringIO(chunk.decode(DEFAULT_ENCODING), newline=""),
+        delimiter=delimiter,
+        fieldnames=fieldnames,
+    )
+    project = reader.projector(output_fieldnames)
+    return [project(row) for row in reader if filter_function(row) == keep]
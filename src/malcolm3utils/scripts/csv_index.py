@@ -0,0 +1,81 @@
+import logging
+from pathlib import Path
+from typing import Optional, Tuple
+
+import click
+import click_logging
+
+from malcolm3utils.utils.csvindex import DEFAULT_INDEX_EVERY, CsvIndex
+from malcolm3utils.utils.csvio import DEFAULT_DELIMITER
+
+from .. import __version__, __version_message__
+
+logger = logging.getLogger(__name__)
+click_logging.basic_config(logger)
+
+
+@click.command(
+    "csv-index",
+    help="""
+Build a sidecar index of each of the specified CSV files (saved as
+csv_file.idx), so that ranges of rows, or the rows with a given key,
+can be read without reading the whole file.
+
+The byte offset of every Nth row is indexed (see --every), along with
+the offsets of the rows of each value of --key-column if one is given.
+
+An index is only used while the CSV file is unchanged, so re-run
+csv-index after changing a file. Compressed files can not be indexed.
+""",
+)
+@click_logging.simple_verbosity_option(logger)
+@click.option(
+    "-d",
+    "--delimiter",
+    type=str,
+    help="column delimiter",
+    default=DEFAULT_DELIMITER,
+    show_default=True,
+    envvar="DELIMITER",
+)
+@click.option(
+    "-n",
+    "--every",
+    type=click.IntRange(min=1),
+    default=DEFAULT_INDEX_EVERY,
+    show_default=True,
+    help="index the offset of every this many rows",
+)
+@click.option(
+    "-k",
+    "--key-column",
+    type=str,
+    help="header of a column to index the rows of each value of",
+)
+@click.version_option(__version__, message=__version_message__)
+@click.argument(
+    "csv_files",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    nargs=-1,
+    metavar="csv_file",
+    required=True,
+)
+def cli(
+    csv_files: Tuple[Path, ...],
+    delimiter: str = DEFAULT_DELIMITER,
+    every: int = DEFAULT_INDEX_EVERY,
+    key_column: Optional[str] = None,
+) -> None:
+    for csv_file in csv_files:
+        try:
+            index = CsvIndex.build(
+                csv_file, every=every, key_column=key_column, delimiter=delimiter
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e)) from None
+        index_path = index.save()
+        logger.info('indexed %d rows of "%s" in "%s"', index.rows, csv_file, index_path)
+
+
+if __name__ == "__main__":
+    cli()  # pragma: no cover
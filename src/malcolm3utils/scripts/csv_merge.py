@@ -1,12 +1,25 @@
-import csv
 import logging
-import sys
-from typing import Dict, Iterable, List, Optional, TextIO
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
 
 import click
 import click_logging
 
-from malcolm3utils.utils.csvio import DEFAULT_DELIMITER, csv_options
+from malcolm3utils.utils.csvio import (
+    DEFAULT_DELIMITER,
+    CsvRowReader,
+    csv_options,
+    open_csv_output,
+    open_csv_reader,
+)
+from malcolm3utils.utils.merge_store import (
+    KEEP_MODES,
+    NORMALIZE_MODES,
+    KeyedRow,
+    MergeStore,
+    key_function,
+    open_merge_store,
+)
 
 from .. import __version__, __version_message__
 
@@ -20,9 +33,16 @@ click_logging.basic_config(logger)
 Merge the specified delimited files with column headings, joining entries with
 the same key field value.
 
-The files do not need to be sorted on the key field as with join(1). This does
-require that all of the data be read into memory. If that is a problem, using
-the system join(1) command is recommended.
+The files do not need to be sorted on the key field as with join(1). By
+default this requires that all of the data be read into memory. If that is a
+problem, use --store sqlite to merge the data in a temporary SQLite database
+on disk instead, or the system join(1) command.
+
+With --store sqlite:PATH the database is kept at PATH, recording each file
+as it is merged, so an interrupted merge can be carried on by running the
+same command again, or further files merged into it later. Files already
+merged into the database are skipped, and the output includes all of the
+entries in the database.
 
 Rows will be printed in the order that the unique key values are encountered
 when reading through the input files.
@@ -35,6 +55,13 @@ header will be the header from the first file.
 If -k is used to specify alternative keys columns for subsequent files, but
 those files have a column with the same name as the output key column, that
 will be ignored.
+
+A composite key is specified by joining the key column identifiers with '+'
+(e.g. -k 'last+first'), and the output key columns will then be the first
+columns of the output file. Each file must have the same number of key
+columns. With --normalize the key values are normalized before they are
+matched, e.g. with '--normalize strip --normalize numeric' the keys ' 007'
+and '7' match. The output key values are those first read for each key.
 """,
 )
 @click_logging.simple_verbosity_option(logger)
@@ -54,13 +81,14 @@ will be ignored.
     "each new file will use the next identifier. "
     "the last identifier will be used for all remaining files, "
     'so just use "-k identifier" if the identifier is the same for all files. '
-    "The identifier can either be the header string or the one-based column index. "
+    "The identifier can either be the header string or the one-based column index, "
+    "or several of these joined with '+' for a composite key. "
     "(default=1 (i.e. the first column of each file))",
     default="1",
 )
 @click.option(
     "--keep",
-    type=click.Choice(["first", "last", "uniq", "all"], case_sensitive=False),
+    type=click.Choice(KEEP_MODES, case_sensitive=False),
     default="all",
     help="specifies how to handle multiple values for the same field with the same key",
 )
@@ -70,16 +98,40 @@ will be ignored.
     type=str,
     help="comma separated list of column identifiers to ignore",
 )
+@click.option(
+    "-N",
+    "--normalize",
+    type=click.Choice(NORMALIZE_MODES, case_sensitive=False),
+    multiple=True,
+    help="normalize the key values before matching them: strip surrounding "
+    "whitespace, casefold to ignore case, or numeric to match numbers by value "
+    "(e.g. 007 and 7.0 match 7). may be repeated",
+)
+@click.option(
+    "--store",
+    type=str,
+    default="memory",
+    show_default=True,
+    help="where to hold the merged entries: memory, sqlite (a temporary database) "
+    "or sqlite:PATH (a database kept at PATH)",
+)
 @click.version_option(__version__, message=__version_message__)
-@click.argument("files_to_read", nargs=-1, type=click.File("r"), required=False)
+@click.argument(
+    "files_to_read",
+    nargs=-1,
+    type=click.Path(exists=True, allow_dash=True, path_type=Path),
+    required=False,
+)
 def cli(
-    files_to_read: Iterable[TextIO] = (),
+    files_to_read: Iterable[Path] = (),
     key_column: str = "1",
     delimiter: str = DEFAULT_DELIMITER,
     output_delimiter: Optional[str] = None,
     keep: str = "all",
     all_delimiter: str = ";",
     ignore: str | None = None,
+    normalize: Iterable[str] = (),
+    store: str = "memory",
 ) -> None:
     if output_delimiter is None:
         output_delimiter = delimiter
@@ -88,106 +140,112 @@ def cli(
     if ignore is not None:
         ignore_set.update(ignore.split(DEFAULT_DELIMITER))
 
-    data: Dict[str, Dict[str, str]] = {}
-    output_key = None
-    data_field_list = []
-    for ifile, fh in enumerate(files_to_read):
-        logger.debug('processing file "%s"', fh.name)
-        if ifile >= len(key_column_list):
-            ifile = -1
-        key = key_column_list[ifile]
-        reader = csv.DictReader(fh, delimiter=delimiter)
+    try:
+        merge_store = open_merge_store(store, keep, all_delimiter, normalize)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    with merge_store:
+        for ifile, file_to_read in enumerate(files_to_read):
+            if ifile >= len(key_column_list):
+                ifile = -1
+            _merge_file(
+                merge_store,
+                file_to_read,
+                key_column_list[ifile],
+                delimiter,
+                ignore_set,
+            )
+
+        logger.debug("writing output")
+        data_field_list = merge_store.fields
+        with open_csv_output(delimiter=output_delimiter) as writer:
+            writer.writerow(data_field_list)
+            writer.writerows(
+                [entry.get(x, "") for x in data_field_list]
+                for entry in merge_store.entries()
+            )
+
+
+def _merge_file(
+    merge_store: MergeStore,
+    file_to_read: Path,
+    key: str,
+    delimiter: str,
+    ignore_set: Set[str],
+) -> None:
+    fname = str(file_to_read)
+    if merge_store.is_merged(fname):
+        logger.info('"%s" has already been merged, skipping file.', fname)
+        return
+    logger.debug('processing file "%s"', fname)
+    with open_csv_reader(file_to_read, delimiter=delimiter, as_rows=True) as reader:
         if reader.fieldnames is None:
-            logger.warning('No fieldnames found in file "%s", skipping file.', fh.name)
-            continue
+            logger.warning('No fieldnames found in file "%s", skipping file.', fname)
+            return
         this_data_field_list = [x for x in reader.fieldnames if x not in ignore_set]
-        if key.isnumeric():
-            key = this_data_field_list[int(key) - 1]
-        elif key not in this_data_field_list:
+        key_fields = _resolve_key(key, this_data_field_list, fname)
+        if key_fields is None:
+            return
+        output_keys = merge_store.output_keys or key_fields
+        if len(key_fields) != len(output_keys):
             logger.warning(
-                'Key "%s" not found in file "%s", skipping file.', key, fh.name
+                'Key "%s" of file "%s" has %d columns rather than %d, skipping file.',
+                key,
+                fname,
+                len(key_fields),
+                len(output_keys),
             )
-            continue
-        logger.debug('...using key "%s"', key)
-        this_data_field_list.remove(key)
-        if output_key is None:
-            output_key = key
-            data_field_list.append(output_key)
-        if output_key in this_data_field_list:
-            this_data_field_list.remove(output_key)
-        _process_rows(
-            reader,
-            fh.name,
-            key,
-            output_key,
-            keep,
-            all_delimiter,
+            return
+        logger.debug('...using key "%s"', "+".join(key_fields))
+        this_data_field_list = [
+            x
+            for x in this_data_field_list
+            if x not in key_fields and x not in output_keys
+        ]
+        data_field_list = merge_store.fields or list(output_keys)
+        merge_store.merge(
+            fname,
+            _iter_keyed_rows(
+                reader, fname, key_function(key_fields, merge_store.normalize)
+            ),
             this_data_field_list,
-            data,
-        )
-        data_field_list.extend(
-            [x for x in this_data_field_list if x not in data_field_list]
+            output_keys,
+            data_field_list
+            + [x for x in this_data_field_list if x not in data_field_list],
         )
 
-    logger.debug("writing output")
-    writer = csv.DictWriter(
-        sys.stdout, fieldnames=data_field_list, delimiter=output_delimiter
-    )
-    writer.writeheader()
-    writer.writerows(data.values())
 
+def _resolve_key(key: str, field_list: List[str], fname: str) -> Optional[List[str]]:
+    # a column whose name includes "+" is not taken as a composite key
+    key_fields = [key] if key in field_list else key.split("+")
+    for i, key_field in enumerate(key_fields):
+        if key_field.isnumeric():
+            key_fields[i] = field_list[int(key_field) - 1]
+        elif key_field not in field_list:
+            logger.warning(
+                'Key "%s" not found in file "%s", skipping file.', key_field, fname
+            )
+            return None
+    return key_fields
 
-def _process_rows(
-    reader: csv.DictReader,
+
+def _iter_keyed_rows(
+    reader: CsvRowReader,
     fname: str,
-    key: str,
-    output_key: str,
-    keep: str,
-    all_delimiter: str,
-    data_field_list: List[str],
-    data: Dict[str, Dict[str, str]],
-) -> None:
+    get_key: Callable[[Mapping[str, Optional[str]]], Tuple[str, str]],
+) -> Iterator[KeyedRow]:
     irow = 0
     for irow, row in enumerate(reader):
-        key_value = row.get(key, None)
-        if key_value is None or len(key_value) == 0:
+        key, key_values = get_key(row)
+        if not key:
             logger.warning(
                 'No key value found for line %d in file "%s", skipping line.',
                 irow + 2,
                 fname,
             )
             continue
-        if key_value not in data:
-            data[key_value] = {output_key: key_value}
-        entry = data[key_value]
-        _process_row(row, data_field_list, keep, all_delimiter, entry)
-
+        yield key, key_values, row
     logger.debug("...processed %d entries", irow + 1)
-    logger.debug("...total unique entries is now %d", len(data))
-
-
-def _process_row(
-    row: Dict[str, str],
-    data_field_list: List[str],
-    keep: str,
-    all_delimiter: str,
-    entry: Dict[str, str],
-) -> None:
-    for data_field in data_field_list:
-        data_value = row[data_field]
-        if data_value is None or len(data_value) == 0:
-            pass
-        elif data_field not in entry or keep == "last":
-            entry[data_field] = data_value
-        elif keep == "all":
-            entry[data_field] += all_delimiter
-            entry[data_field] += data_value
-        elif keep == "uniq":
-            if data_value not in entry[data_field].split(all_delimiter):
-                entry[data_field] += all_delimiter
-                entry[data_field] += data_value
-        else:  # keep == 'first' so ignore subsequent values
-            pass
 
 
 if __name__ == "__main__":
@@ -1,11 +1,15 @@
-import csv
-import sys
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Optional
 
 import click
 
-from malcolm3utils.utils.csvio import csv_options
+from malcolm3utils.utils.csvio import (
+    csv_options,
+    open_csv_output,
+    open_csv_reader,
+    parse_column_spec,
+    resolve_column_spec,
+)
 
 from .. import __version__, __version_message__
 
@@ -30,60 +34,18 @@ def cli(
 ) -> None:
     if output_delimiter is None:
         output_delimiter = delimiter
-    column_list, includes_headers = _parse_column_spec(column_spec)
-    writer = csv.writer(sys.stdout, delimiter=output_delimiter)
-    try:
-        fh = sys.stdin
-        if file_to_read is not None:
-            fh = open(file_to_read)
-        reader = csv.reader(fh, delimiter=delimiter)
-
+    column_list = parse_column_spec(column_spec)
+    if file_to_read is None:
+        file_to_read = Path("-")
+    with (
+        open_csv_reader(file_to_read, delimiter=delimiter) as reader,
+        open_csv_output(delimiter=output_delimiter) as writer,
+    ):
         for irow, row in enumerate(reader):
-            if irow == 0 and includes_headers:
-                column_list = _process_headers(column_list, row)
-            output_row = [row[int(i)] for i in column_list]
+            if irow == 0:
+                columns = resolve_column_spec(column_list, row)
+            output_row = [row[i] for i in columns]
             writer.writerow(output_row)
-    finally:
-        if fh is not None:
-            fh.close()
-
-
-def _parse_column_spec(column_spec: str) -> Tuple[List[str | int], bool]:
-    column_list: List[str | int] = []
-    includes_headers = False
-    for spec in column_spec.split(","):
-        if "-" in spec:
-            range_parts = spec.split("-", 1)
-            if (
-                len(range_parts) == 2
-                and range_parts[0].isnumeric()
-                and range_parts[1].isnumeric()
-            ):
-                column_list.extend(range(int(range_parts[0]) - 1, int(range_parts[1])))
-            else:
-                column_list.append(spec)
-                includes_headers = True
-        elif spec.isnumeric():
-            column_list.append(int(spec) - 1)
-        else:
-            column_list.append(spec)
-            includes_headers = True
-    return column_list, includes_headers
-
-
-def _process_headers(
-    column_list: List[str | int], headers: List[str]
-) -> List[str | int]:
-    updated_column_list: List[str | int] = []
-    for col in column_list:
-        if isinstance(col, str):
-            try:
-                updated_column_list.append(headers.index(col))
-            except ValueError:
-                pass
-        elif isinstance(col, int):
-            updated_column_list.append(col)
-    return updated_column_list
 
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+import contextlib
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import traceback
+from importlib import import_module
+from typing import Any
+
+import click
+import click_logging
+
+from .. import __version__, __version_message__
+from .client import EXIT_CODE, MAX_REQUEST_LENGTH, REQUEST_LENGTH, SOCKET_ENV, TOOLS
+
+logger = logging.getLogger(__name__)
+click_logging.basic_config(logger)
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(runtime_dir, f"malcolm3utils-{os.getuid()}.sock")
+
+
+class ToolRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        try:
+            received = receive_request(self.request)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring bad request: %s", e)
+            return
+        if received is None:
+            return
+        request, fds = received
+        exit_code = run_request(request, fds)
+        self.request.sendall(EXIT_CODE.pack(exit_code))
+
+
+class ToolServer(socketserver.UnixStreamServer):
+    """
+    Server running tool requests one at a time in the server process.
+
+    Only requests from processes of the same user are accepted.
+    """
+
+    def verify_request(self, request: Any, client_address: Any) -> bool:
+        if not hasattr(socket, "SO_PEERCRED"):  # pragma: no cover
+            return True
+        credentials = request.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        _, uid, _ = struct.unpack("3i", credentials)
+        if uid != os.getuid():
+            logger.warning("Refusing request from uid %d", uid)
+            return False
+        return True
+
+
+class ForkingToolServer(socketserver.ForkingMixIn, ToolServer):
+    """
+    Server running each tool request in a forked copy of the server process,
+    so requests run concurrently and can not affect each other.
+    """
+
+    def finish_request(
+        self, request: Any, client_address: Any
+    ) -> None:  # pragma: no cover (only called in the forked process)
+        # the tool should be interrupted or terminated like any other process,
+        # rather than the server's handlers exiting as if it had finished
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        super().finish_request(request, client_address)
+
+
+def receive_request(
+    sock: socket.socket,
+) -> tuple[dict[str, Any], list[int]] | None:
+    """
+    Receive a request sent by client.send_request.
+
+    :param sock: socket connected to the client
+    :return: the request and the file descriptors for stdin, stdout and stderr,
+        or None if the client closed the connection without sending anything
+        (e.g. when checking whether the server is running)
+    """
+    data, fds, _, _ = socket.recv_fds(sock, 65536, 3)
+    if not data and not fds:
+        return None
+    start = REQUEST_LENGTH.size
+    try:
+        data = _receive_at_least(sock, data, start)
+        (length,) = REQUEST_LENGTH.unpack_from(data)
+        if length > MAX_REQUEST_LENGTH:
+            raise ValueError(f"request length {length} is too long")
+        data = _receive_at_least(sock, data, start + length)
+        if len(fds) != 3:
+            raise ValueError(f"expected 3 file descriptors, received {len(fds)}")
+        request: dict[str, Any] = json.loads(data[start:])
+    except Exception:
+        for fd in fds:
+            os.close(fd)
+        raise
+    return request, fds
+
+
+def _receive_at_least(sock: socket.socket, data: bytes, size: int) -> bytes:
+    while len(data) < size:
+        received = sock.recv(size - len(data))
+        if not received:
+            raise ValueError("connection closed before the request was received")
+        data += received
+    return data
+
+
+def run_request(request: dict[str, Any], fds: list[int]) -> int:
+    """
+    Run a tool with the client's arguments, working directory, environment,
+    stdin, stdout and stderr, restoring those of the server afterwards.
+
+    The file descriptors are closed once the tool has finished.
+
+    :param request: the tool, its arguments, and the client's working directory
+        and environment
+    :param fds: file descriptors for stdin, stdout and stderr
+    :return: exit code of the tool
+    """
+    saved_streams = (sys.stdin, sys.stdout, sys.stderr)
+    saved_cwd = os.getcwd()
+    saved_environ = dict(os.environ)
+    sys.stdin = open(fds[0], "r")
+    sys.stdout = open(fds[1], "w")
+    sys.stderr = open(fds[2], "w", buffering=1)
+    try:
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        return _run_tool(request["tool"], request["argv"])
+    finally:
+        for stream in (sys.stdin, sys.stdout, sys.stderr):
+            with contextlib.suppress(OSError):
+                stream.close()
+        sys.stdin, sys.stdout, sys.stderr = saved_streams
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+
+
+def _run_tool(tool: str, argv: list[str]) -> int:
+    if tool not in TOOLS:
+        click.echo(f"Unknown tool '{tool}'", err=True)
+        return 2
+    try:
+        import_module(TOOLS[tool]).cli.main(args=argv, prog_name=tool)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0  # pragma: no cover (click always exits with SystemExit)
+
+
+def create_server(socket_path: str, fork: bool = True) -> ToolServer:
+    """
+    Create a server listening on socket_path, which only the current user can use.
+
+    A socket left behind by a server that is no longer running is replaced.
+
+    :param socket_path: path of the Unix socket to listen on
+    :param fork: run each request in a forked copy of the server process
+    :return: the server
+    """
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except OSError:
+                logger.debug('removing stale socket "%s"', socket_path)
+                os.unlink(socket_path)
+            else:
+                raise click.ClickException(
+                    f'A server is already listening on "{socket_path}"'
+                )
+    server_class = ForkingToolServer if fork else ToolServer
+    old_umask = os.umask(0o177)
+    try:
+        return server_class(socket_path, ToolRequestHandler)
+    finally:
+        os.umask(old_umask)
+
+
+def _warm_up() -> None:
+    # import everything the tools use, before any requests are forked
+    for module in TOOLS.values():
+        import_module(module)
+    from malcolm3utils.utils.filter_parser import create_filter
+
+    create_filter("True")
+
+
+def _terminate(signum: int, frame: Any) -> None:
+    sys.exit(0)
+
+
+@click.group(help="""
+Collection of utility scripts and packages.
+""")
+@click.version_option(__version__, message=__version_message__)
+def cli() -> None:
+    pass
+
+
+@cli.command(
+    "serve",
+    help=f"""
+    Run a server that runs the CSV tools ({", ".join(TOOLS)})
+    without the cost of starting a new Python process and importing
+    their dependencies for every invocation.
+
+    The server listens on a Unix socket that only the current user can use.
+    When the {SOCKET_ENV} environment variable is set to the path of the
+    socket, the tools are run by the server, with the arguments, working
+    directory, environment, stdin, stdout and stderr of the command.
+    If no server is listening the tools run as usual.
+
+    \b
+    For example:
+    malcolm3utils serve --socket /tmp/m3u.sock &
+    export {SOCKET_ENV}=/tmp/m3u.sock
+    for f in *.csv; do getcol 1 "$f"; done
+
+    The server runs until it is interrupted or terminated.
+    """,
+)
+@click.option(
+    "-s",
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    default=default_socket_path,
+    show_default="$XDG_RUNTIME_DIR/malcolm3utils-UID.sock",
+    envvar=SOCKET_ENV,
+    help=f"path of the Unix socket to listen on (or set {SOCKET_ENV})",
+)
+@click.option(
+    "--fork/--no-fork",
+    default=True,
+    help="run each request in a forked copy of the server (default=fork), "
+    "or one at a time in the server itself",
+)
+@click_logging.simple_verbosity_option(logger)
+def serve(socket_path: str, fork: bool) -> None:
+    _warm_up()
+    server = create_server(socket_path, fork=fork)
+    previous_handlers = {
+        signum: signal.signal(signum, _terminate)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+    click.echo(f'Listening on "{socket_path}"', err=True)
+    try:
+        server.serve_forever()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    cli()  # pragma: no cover
@@ -1,9 +1,13 @@
 #!/usr/bin/python
 
+import json
 import os
+import time
 from collections.abc import Iterable
+from dataclasses import asdict, dataclass, field
 from fnmatch import fnmatch
 from pathlib import Path
+from typing import Any
 
 import click
 
@@ -33,6 +37,11 @@ DEFAULT_IGNORE_GLOBS = ["*~", "*.pyc", "#*", ".*", "*.OLD", "OLD"]
 @click.option(
     "-n", "--no-default-ignore", is_flag=True, help="do not use default ignore globs"
 )
+@click.option(
+    "--report",
+    type=click.Choice(["json"], case_sensitive=False),
+    help="write a report of the walk (latest file, counters, per-path timing) to stdout",
+)
 @click.version_option(__version__, message=__version_message__)
 @click.argument("touch_file", type=str)
 @click.argument("paths_to_check", nargs=-1, type=click.Path(exists=True), required=True)
@@ -42,6 +51,7 @@ def touch_latest(
     ignore_patterns: Iterable[str] = (),
     ignore_pattern_files: Iterable[str | Path] = (),
     no_default_ignore: bool = False,
+    report: str | None = None,
 ) -> None:
     """
     Find the latest changed date of file under the specified PATHS_TO_CHECK
@@ -70,6 +80,7 @@ def touch_latest(
     :param ignore_patterns: glob patterns to ignore
     :param ignore_pattern_files: files of glob patterns to ignore
     :param no_default_ignore: if True do not include default glob patterns
+    :param report: if "json" write the walk report to stdout as JSON
 
     """
     all_ignore_patterns = IgnorePatterns()
@@ -81,21 +92,15 @@ def touch_latest(
             all_ignore_patterns.add_patterns(fh)
     all_ignore_patterns.add_patterns(ignore_patterns)
 
-    latest_timestamp = 0
+    walk_report = find_latest(paths_to_check, all_ignore_patterns)
+    latest_timestamp = walk_report.latest_timestamp
 
-    for path in paths_to_check:
-        apath = os.path.abspath(path)
-        for root, dirs, files in os.walk(apath):
-            dirs[:] = [dn for dn in dirs if not all_ignore_patterns.ignore(root, dn)]
-            for fn in files:
-                if not all_ignore_patterns.ignore(root, fn):
-                    statinfo = os.stat(os.path.join(root, fn))
-                    if statinfo.st_mtime > latest_timestamp:
-                        latest_timestamp = int(statinfo.st_mtime)
     if not os.path.exists(touch_file):
         with open(touch_file, "w"):
             pass
     os.utime(touch_file, (latest_timestamp, latest_timestamp))
+    if report == "json":
+        click.echo(json.dumps(walk_report.as_dict(), indent=2))
 
 
 class IgnorePatterns:
@@ -149,5 +154,67 @@ class IgnorePatterns:
         return False
 
 
+@dataclass
+class WalkReport:
+    """
+    Result of walking the paths to check for the latest changed file.
+
+    The path_elapsed dictionary gives the time in seconds spent walking
+    each of the top-level paths, keyed by the absolute path.
+    """
+
+    latest_timestamp: int = 0
+    latest_file: str | None = None
+    dirs_visited: int = 0
+    files_statted: int = 0
+    entries_ignored: int = 0
+    path_elapsed: dict[str, float] = field(default_factory=dict)
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def find_latest(
+    paths_to_check: Iterable[str | Path],
+    ignore_patterns: IgnorePatterns | None = None,
+) -> WalkReport:
+    """
+    Walk the specified paths and locate the file with the latest change date.
+
+    Directories which match an ignore pattern are not traversed and files
+    which match an ignore pattern are not statted.
+
+    :param paths_to_check: paths to search for the latest change date
+    :param ignore_patterns: glob patterns to ignore (default is to ignore nothing)
+    :return: the latest timestamp, the file that produced it and walk counters
+    """
+    if ignore_patterns is None:
+        ignore_patterns = IgnorePatterns()
+    walk_report = WalkReport()
+
+    for path in paths_to_check:
+        apath = os.path.abspath(path)
+        start_time = time.perf_counter()
+        for root, dirs, files in os.walk(apath):
+            walk_report.dirs_visited += 1
+            kept_dirs = [dn for dn in dirs if not ignore_patterns.ignore(root, dn)]
+            walk_report.entries_ignored += len(dirs) - len(kept_dirs)
+            dirs[:] = kept_dirs
+            for fn in files:
+                if ignore_patterns.ignore(root, fn):
+                    walk_report.entries_ignored += 1
+                    continue
+                file_path = os.path.join(root, fn)
+                statinfo = os.stat(file_path)
+                walk_report.files_statted += 1
+                if statinfo.st_mtime > walk_report.latest_timestamp:
+                    walk_report.latest_timestamp = int(statinfo.st_mtime)
+                    walk_report.latest_file = file_path
+        walk_report.path_elapsed[apath] = walk_report.path_elapsed.get(apath, 0.0) + (
+            time.perf_counter() - start_time
+        )
+    return walk_report
+
+
 if __name__ == "__main__":
     touch_latest()  # pragma: no cover
@@ -0,0 +1,292 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Mapping, NamedTuple, cast
+
+from malcolm3utils.utils.csvio import read_keyed_csv_data
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MEMO_MAXSIZE = 32
+
+
+class CsvCache:
+    """
+    On-disk cache of parsed CSV files.
+
+    Each parsed DataFrame is pickled into the cache directory under a name
+    derived from the absolute path, size and modification time of the CSV file
+    along with the options it was read with, so a changed file or different
+    read options will never return stale data.
+
+    Once the total size of the cache directory exceeds max_bytes the least
+    recently used entries are removed.
+
+    Reads with a callable skiprows are never cached as there is no
+    way to tell whether two callables are equivalent.
+
+    Only point the cache at a directory you trust, as loading an entry
+    unpickles it.
+    """
+
+    suffix = ".pkl"
+
+    def __init__(
+        self, cache_dir: str | Path, max_bytes: int = DEFAULT_CACHE_MAX_BYTES
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def cache_path(self, csv_file: Path, **options: Any) -> Path | None:
+        """
+        Locate the cache entry for the CSV file read with the specified options.
+
+        :param csv_file: CSV file to be read
+        :param options: options the CSV file is read with
+        :return: path of the cache entry, or None if the read can not be cached
+        """
+        if callable(options.get("skiprows")):
+            return None
+        statinfo = os.stat(csv_file)
+        key = repr(
+            (
+                os.path.abspath(csv_file),
+                statinfo.st_size,
+                statinfo.st_mtime_ns,
+                sorted(options.items()),
+            )
+        )
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.cache_dir / f"{digest}{self.suffix}"
+
+    def load(self, csv_file: Path, **options: Any) -> "pd.DataFrame | None":
+        """
+        Load the parsed CSV file from the cache.
+
+        :param csv_file: CSV file to be read
+        :param options: options the CSV file is read with
+        :return: the cached DataFrame or None if it is not in the cache
+        """
+        cache_path = self.cache_path(csv_file, **options)
+        if cache_path is None or not cache_path.exists():
+            return None
+        logger.debug('...............loading "%s" from cache', csv_file)
+        os.utime(cache_path)
+        import pandas as pd
+
+        pandas_csv_data: pd.DataFrame = pd.read_pickle(cache_path)
+        return pandas_csv_data
+
+    def store(
+        self, pandas_csv_data: "pd.DataFrame", csv_file: Path, **options: Any
+    ) -> None:
+        """
+        Store the parsed CSV file in the cache and evict old entries if needed.
+
+        :param pandas_csv_data: the parsed CSV file
+        :param csv_file: CSV file that was read
+        :param options: options the CSV file was read with
+        """
+        cache_path = self.cache_path(csv_file, **options)
+        if cache_path is None:
+            return
+        logger.debug('...............storing "%s" in cache', csv_file)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            pandas_csv_data.to_pickle(tmp_name)
+            os.replace(tmp_name, cache_path)
+        except BaseException:
+            # evict only counts complete entries, so would never remove it
+            os.unlink(tmp_name)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = [
+            (statinfo.st_mtime_ns, statinfo.st_size, x)
+            for x in self.cache_dir.glob(f"*{self.suffix}")
+            for statinfo in (x.stat(),)
+        ]
+        total_size = sum(x[1] for x in entries)
+        for _, size, cache_path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            logger.debug('...............evicting "%s" from cache', cache_path)
+            cache_path.unlink(missing_ok=True)
+            total_size -= size
+
+
+class KeyedCsvCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    reloads: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class KeyedCsvMemo:
+    """
+    In-process least recently used cache of read_keyed_csv_data results.
+
+    Results are shared between callers, so they are returned read-only:
+    the keyed dictionary and each row are wrapped in a MappingProxyType
+    and, if multiple is true, each list of rows is converted to a tuple.
+
+    The modification time and size of the file are checked on every call,
+    and the file is re-read if either has changed.
+
+    Files are read without holding the cache lock, so a slow read does not
+    block other callers, while callers wanting a result that is being read
+    wait for that read rather than reading the file again.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_MEMO_MAXSIZE) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[
+            tuple[Any, ...], tuple[tuple[int, int], Mapping[Any, Any]]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: dict[tuple[Any, ...], threading.Event] = {}
+        self._hits = 0
+        self._misses = 0
+        self._reloads = 0
+        self._evictions = 0
+
+    def read(
+        self,
+        csv_file: Path,
+        keyfield: str,
+        skiprows: list[int] | int | Callable[[Hashable], bool] | None = None,
+        multiple: bool = False,
+    ) -> Mapping[Any, Mapping[str, Any]] | Mapping[Any, tuple[Mapping[str, Any], ...]]:
+        """
+        Return the (possibly cached) read-only result of read_keyed_csv_data.
+
+        :param csv_file: CSV file to be read.
+        :param keyfield: Field to use as the key in the returned mapping.
+        :param skiprows: rows to skip (see read_keyed_csv_data)
+        :param multiple: indicates there may be multiple rows for each key
+        :return: read-only keyed mapping of each row of data.
+        """
+        path = os.path.abspath(csv_file)
+        if isinstance(skiprows, list):
+            memo_key: tuple[Any, ...] = (path, keyfield, tuple(skiprows), multiple)
+        else:
+            memo_key = (path, keyfield, skiprows, multiple)
+        statinfo = os.stat(path)
+        stamp = (statinfo.st_mtime_ns, statinfo.st_size)
+        while True:
+            with self._lock:
+                entry = self._entries.get(memo_key)
+                if entry is not None and entry[0] == stamp:
+                    self._hits += 1
+                    self._entries.move_to_end(memo_key)
+                    return entry[1]
+                loading = self._loading.get(memo_key)
+                if loading is None:
+                    self._misses += 1
+                    if entry is not None:
+                        logger.debug('...............reloading changed file "%s"', path)
+                        self._reloads += 1
+                    loading = self._loading[memo_key] = threading.Event()
+                    break
+            # another caller is reading the file, so wait for it and check again
+            loading.wait()
+        try:
+            data = cast(
+                dict[Any, Any],
+                read_keyed_csv_data(
+                    Path(path), keyfield, skiprows=skiprows, multiple=multiple
+                ),
+            )
+            result: Mapping[Any, Any]
+            if multiple:
+                result = MappingProxyType(
+                    {k: tuple(MappingProxyType(x) for x in v) for k, v in data.items()}
+                )
+            else:
+                result = MappingProxyType(
+                    {k: MappingProxyType(v) for k, v in data.items()}
+                )
+            with self._lock:
+                self._entries[memo_key] = (stamp, result)
+                self._entries.move_to_end(memo_key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+            return result
+        finally:
+            with self._lock:
+                del self._loading[memo_key]
+            loading.set()
+
+    def cache_info(self) -> KeyedCsvCacheInfo:
+        """
+        Report the cache statistics.
+
+        :return: hits, misses, reloads of changed files, evictions, maxsize and current size
+        """
+        with self._lock:
+            return KeyedCsvCacheInfo(
+                self._hits,
+                self._misses,
+                self._reloads,
+                self._evictions,
+                self.maxsize,
+                len(self._entries),
+            )
+
+    def invalidate(self, csv_file: Path | None = None) -> None:
+        """
+        Discard the cached results for the CSV file, or all results if no file is specified.
+
+        :param csv_file: CSV file whose results should be discarded (default=all files)
+        """
+        with self._lock:
+            if csv_file is None:
+                self._entries.clear()
+                return
+            path = os.path.abspath(csv_file)
+            for memo_key in [x for x in self._entries if x[0] == path]:
+                del self._entries[memo_key]
+
+
+keyed_csv_memo = KeyedCsvMemo()
+
+
+def cached_read_keyed_csv_data(
+    csv_file: Path,
+    keyfield: str,
+    skiprows: list[int] | int | Callable[[Hashable], bool] | None = None,
+    multiple: bool = False,
+) -> Mapping[Any, Mapping[str, Any]] | Mapping[Any, tuple[Mapping[str, Any], ...]]:
+    """
+    Memoized read_keyed_csv_data returning a shared read-only mapping.
+
+    The file is only re-read if its modification time or size has changed.
+    Use keyed_csv_memo.cache_info() for cache statistics and
+    keyed_csv_memo.invalidate() to discard cached results.
+
+    :param csv_file: CSV file to be read.
+    :param keyfield: Field to use as the key in the returned mapping.
+    :param skiprows: rows to skip (see read_keyed_csv_data)
+    :param multiple: indicates there may be multiple rows for each key
+    :return: read-only keyed mapping of each row of data.
+    """
+    return keyed_csv_memo.read(csv_file, keyfield, skiprows=skiprows, multiple=multiple)
@@ -0,0 +1,553 @@
+import bisect
+import csv
+import io
+import itertools
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import stat
+import struct
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Any, BinaryIO, Generator, Iterable, Iterator, Sequence, cast
+
+from malcolm3utils.utils.csvio import (
+    COMPRESSED_OPENERS,
+    DEFAULT_BUFFER_SIZE,
+    DEFAULT_DELIMITER,
+    DEFAULT_ENCODING,
+    CsvRow,
+    CsvRowReader,
+    csv_row_pattern,
+    open_csv_reader,
+)
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_INDEX_EVERY = 1000
+CSV_INDEX_SUFFIX = ".idx"
+
+# start of a CsvIndex file, followed by the length of its JSON header
+_CSV_INDEX_MAGIC = b"M3UCSVX2"
+_CSV_INDEX_LENGTH = struct.Struct("<I")
+
+
+def csv_index_path(csv_file: str | Path) -> Path:
+    """
+    :param csv_file: CSV file
+    :return: path of the sidecar index of the CSV file
+    """
+    return Path(f"{csv_file}{CSV_INDEX_SUFFIX}")
+
+
+def _iter_row_bytes(
+    fh: BinaryIO,
+    row_pattern: "re.Pattern[bytes]",
+    offset: int = 0,
+    read_bytes: int = io.DEFAULT_BUFFER_SIZE,
+) -> Iterator[tuple[int, bytes]]:
+    # the offset and bytes of each row from the current position, skipping
+    # empty lines as CsvRowReader does, with rows found by csv_row_pattern
+    data = b""
+    # a row with no end yet is read in doubling steps, so is only rescanned a few times
+    while block := fh.read(max(read_bytes, len(data))):
+        data += block
+        pos = 0
+        while match := row_pattern.match(data, pos):
+            row = match.group()
+            if len(row) > 2 or row.strip(b"\r\n"):
+                yield offset + pos, row
+            pos = match.end()
+        offset += pos
+        data = data[pos:]
+    if data.strip(b"\r\n"):
+        yield offset, data
+
+
+class CsvIndex:
+    """
+    Index of the byte offsets of the rows of a CSV file, for reading a range
+    of rows, or the rows with a given key, without reading the whole file.
+
+    The offset of every `every`th row is kept, so a row is read by seeking
+    to the indexed row before it and skipping at most every - 1 rows.
+    Optionally the offset of every row is kept for each value of a key column.
+    The offsets are held in arrays and the keys in a sorted list, along with
+    the keys that are numbers sorted by their value (so find_number can find
+    e.g. "1", "01" and "1.0" without checking every key). The index
+    stays compact for files with many rows, and is saved next to the CSV file
+    (see csv_index_path). A saved index is memory mapped when it is loaded,
+    with each key only decoded when a lookup reaches it, so loading an index
+    and looking up a key do not depend on the number of rows.
+
+    The index records the size and modification time of the CSV file,
+    so an index of a file that has since changed is never used.
+
+    As with csvio.CsvChunkReader rows are found as csv.reader finds them
+    (see csvio.csv_row_pattern), and only uncompressed files can be indexed.
+    """
+
+    def __init__(
+        self,
+        csv_file: str | Path,
+        info: dict[str, Any],
+        row_offsets: Sequence[int],
+        keys: Sequence[str] | None = None,
+        key_starts: Sequence[int] | None = None,
+        key_offsets: Sequence[int] | None = None,
+        numbers: Sequence[float] | None = None,
+        number_keys: Sequence[int] | None = None,
+    ) -> None:
+        self.csv_file = Path(csv_file)
+        self.info = info
+        self.fieldnames: list[str] = info["fieldnames"]
+        self.every: int = info["every"]
+        self.rows: int = info["rows"]
+        self.key_column: str | None = info["key_column"]
+        self.row_offsets = row_offsets
+        self.keys = keys or []
+        self.key_starts = key_starts if key_starts is not None else array("Q", [0])
+        self.key_offsets = key_offsets if key_offsets is not None else array("Q")
+        if numbers is None or number_keys is None:
+            numbers, number_keys = _sort_numbers(self.keys)
+        self.numbers = numbers
+        self.number_keys = number_keys
+        self.index = {x: i for i, x in enumerate(self.fieldnames)}
+
+    @classmethod
+    def build(
+        cls,
+        csv_file: str | Path,
+        every: int = DEFAULT_INDEX_EVERY,
+        key_column: str | None = None,
+        delimiter: str = DEFAULT_DELIMITER,
+        encoding: str = DEFAULT_ENCODING,
+    ) -> "CsvIndex":
+        """
+        Index a CSV file by reading it once.
+
+        :param csv_file: uncompressed CSV file to be indexed
+        :param every: index the offset of every this many rows
+        :param key_column: header of the column to index the rows of each value of
+        :param delimiter: column delimiter
+        :param encoding: text encoding of the file
+        :return: the index, which is not saved until save is called
+        """
+        if Path(csv_file).suffix.lower() in COMPRESSED_OPENERS:
+            raise ValueError(f'can not index compressed file "{csv_file}"')
+        row_offsets = array("Q")
+        keyed_offsets: list[tuple[str, int]] = []
+        with open(csv_file, "rb", buffering=0) as fh:
+            statinfo = os.fstat(fh.fileno())
+            row_pattern = csv_row_pattern(
+                delimiter.encode(encoding), '"'.encode(encoding)
+            )
+            rows = _iter_row_bytes(fh, row_pattern, read_bytes=DEFAULT_BUFFER_SIZE)
+            header = next(rows, (0, b""))[1]
+            fieldnames = cls._parse(header, delimiter, encoding) if header else []
+            if key_column is not None and key_column not in fieldnames:
+                raise ValueError(f'"{csv_file}" has no column "{key_column}"')
+            key = None if key_column is None else fieldnames.index(key_column)
+            row = -1
+            for row, (offset, data) in enumerate(rows):
+                if row % every == 0:
+                    row_offsets.append(offset)
+                if key is not None:
+                    cells = cls._parse(data, delimiter, encoding)
+                    keyed_offsets.append(
+                        (cells[key] if key < len(cells) else "", offset)
+                    )
+        info = {
+            "size": statinfo.st_size,
+            "mtime_ns": statinfo.st_mtime_ns,
+            "fieldnames": fieldnames,
+            "delimiter": delimiter,
+            "encoding": encoding,
+            "every": every,
+            "rows": row + 1,
+            "key_column": key_column,
+        }
+        if key_column is None:
+            return cls(csv_file, info, row_offsets)
+        # a stable sort, so the rows of each key stay in the order of the file
+        keyed_offsets.sort(key=lambda x: x[0])
+        keys: list[str] = []
+        key_starts = array("Q")
+        for i, (value, _) in enumerate(keyed_offsets):
+            if not keys or keys[-1] != value:
+                keys.append(value)
+                key_starts.append(i)
+        key_starts.append(len(keyed_offsets))
+        key_offsets = array("Q", (x[1] for x in keyed_offsets))
+        return cls(csv_file, info, row_offsets, keys, key_starts, key_offsets)
+
+    @staticmethod
+    def _parse(data: bytes, delimiter: str, encoding: str) -> list[str]:
+        text = data.decode(encoding)
+        if '"' not in text:
+            return text.rstrip("\r\n").split(delimiter)
+        return next(csv.reader(io.StringIO(text, newline=""), delimiter=delimiter), [])
+
+    def is_current(self) -> bool:
+        """
+        :return: whether the CSV file is unchanged since it was indexed
+        """
+        try:
+            statinfo = os.stat(self.csv_file)
+        except FileNotFoundError:
+            return False
+        return (statinfo.st_size, statinfo.st_mtime_ns) == (
+            self.info["size"],
+            self.info["mtime_ns"],
+        )
+
+    def save(self) -> Path:
+        """
+        Save the index next to the CSV file, replacing any previous index,
+        with the same read and write permissions as the CSV file.
+
+        The file holds a magic number, the length of a JSON header giving the
+        details of the index, the JSON header (padded to a multiple of 8 bytes),
+        the row offsets, the start of the offsets of each key in the key offsets,
+        the key offsets, the start of each key in the keys (all as little-endian
+        unsigned 64-bit integers), the sorted values of the keys that are numbers
+        (as little-endian doubles), the number of the key of each of those values,
+        and then the sorted UTF-8 encoded keys.
+
+        :return: path of the index file
+        """
+        encoded_keys = [x.encode() for x in self.keys]
+        key_text_starts = array("Q", [0])
+        key_text_starts.extend(itertools.accumulate(len(x) for x in encoded_keys))
+        info = dict(
+            self.info,
+            row_offsets=len(self.row_offsets),
+            keys=len(self.keys),
+            key_offsets=len(self.key_offsets),
+            numbers=len(self.numbers),
+        )
+        header = json.dumps(info).encode()
+        header += b" " * (
+            -(len(_CSV_INDEX_MAGIC) + _CSV_INDEX_LENGTH.size + len(header)) % 8
+        )
+        index_path = csv_index_path(self.csv_file)
+        fd, tmp_name = tempfile.mkstemp(dir=index_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(_CSV_INDEX_MAGIC + _CSV_INDEX_LENGTH.pack(len(header)) + header)
+            for typecode, values in (
+                ("Q", self.row_offsets),
+                ("Q", self.key_starts),
+                ("Q", self.key_offsets),
+                ("Q", key_text_starts),
+                ("d", self.numbers),
+                ("Q", self.number_keys),
+            ):
+                values = array(typecode, values)
+                if sys.byteorder == "big":  # pragma: no cover
+                    values.byteswap()
+                values.tofile(fh)
+            for encoded_key in encoded_keys:
+                fh.write(encoded_key)
+        # mkstemp only lets the owner read the file, but anyone who can read
+        # the CSV file should be able to use its index
+        os.chmod(tmp_name, stat.S_IMODE(os.stat(self.csv_file).st_mode) & 0o666)
+        os.replace(tmp_name, index_path)
+        return index_path
+
+    @classmethod
+    def load(cls, csv_file: str | Path) -> "CsvIndex | None":
+        """
+        Load the saved index of a CSV file.
+
+        :param csv_file: CSV file that was indexed
+        :return: the index, or None if the file has not been indexed, has
+            changed since it was indexed, or its index can not be read
+            (e.g. it is not a CsvIndex or was saved by another version)
+        """
+        index_path = csv_index_path(csv_file)
+        try:
+            with open(index_path, "rb") as fh:
+                data = memoryview(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+            index = cls._from_buffer(csv_file, data)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+            logger.warning('ignoring unreadable index "%s": %s', index_path, e)
+            return None
+        if not index.is_current():
+            logger.debug('ignoring out of date index "%s"', index_path)
+            return None
+        return index
+
+    @classmethod
+    def _from_buffer(cls, csv_file: str | Path, data: memoryview) -> "CsvIndex":
+        start = len(_CSV_INDEX_MAGIC) + _CSV_INDEX_LENGTH.size
+        if data[: len(_CSV_INDEX_MAGIC)] != _CSV_INDEX_MAGIC:
+            raise ValueError("not a CSV index")
+        (length,) = _CSV_INDEX_LENGTH.unpack_from(data, len(_CSV_INDEX_MAGIC))
+        end = start + length
+        info = json.loads(bytes(data[start:end]))
+        keys = info.pop("keys")
+        numbers = info.pop("numbers")
+        sections = (
+            ("Q", info.pop("row_offsets")),
+            ("Q", keys + 1),
+            ("Q", info.pop("key_offsets")),
+            ("Q", keys + 1),
+            ("d", numbers),
+            ("Q", numbers),
+        )
+        arrays = []
+        for typecode, count in sections:
+            start, end = end, end + count * 8
+            arrays.append(_array_view(data, start, end, typecode))
+        row_offsets, key_starts, key_offsets, key_text_starts = arrays[:4]
+        start, end = end, end + key_text_starts[-1]
+        if len(data) != end:
+            raise ValueError(f"expected {end} bytes, found {len(data)}")
+        key_text = _IndexKeys(key_text_starts, data[start:end])
+        return cls(
+            csv_file,
+            info,
+            row_offsets,
+            key_text,
+            key_starts,
+            key_offsets,
+            *arrays[4:],
+        )
+
+    def iter_rows(self, start: int = 0, stop: int | None = None) -> Iterator[CsvRow]:
+        """
+        Read the rows from start up to, but not including, stop.
+
+        :param start: zero-based number of the first row, not counting the header
+        :param stop: number of the row to stop before (default=the end of the file)
+        :return: iterator over the rows
+        """
+        if start >= self.rows or (stop is not None and stop <= start):
+            return
+        block = start // self.every
+        skip = start - block * self.every
+        with open(self.csv_file, "rb") as fh:
+            fh.seek(self.row_offsets[block])
+            reader = CsvRowReader(
+                io.TextIOWrapper(fh, encoding=self.info["encoding"], newline=""),
+                delimiter=self.info["delimiter"],
+                fieldnames=self.fieldnames,
+            )
+            yield from itertools.islice(
+                reader, skip, None if stop is None else skip + stop - start
+            )
+
+    def find_key(self, key: str) -> Sequence[int]:
+        """
+        :param key: value of the key column
+        :return: offsets of the rows with the key, in the order of the file
+        """
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return array("Q")
+        start, end = self.key_starts[i], self.key_starts[i + 1]
+        return self.key_offsets[start:end]
+
+    def find_number(self, number: int | float) -> list[int]:
+        """
+        :param number: value of the key column, compared as a number, so
+            e.g. 1 finds the keys "1", "01" and "1.0"
+        :return: offsets of the rows whose key equals number, in the order of the file
+        """
+        if number != number:  # NaN is not equal to anything
+            return []
+        value = _number_value(number)
+        low = bisect.bisect_left(self.numbers, value)
+        high = bisect.bisect_right(self.numbers, value, low)
+        offsets: list[int] = []
+        # keys with the same value as a double may still differ as integers
+        for i in self.number_keys[low:high]:
+            if _key_number(self.keys[i]) == number:
+                start, end = self.key_starts[i], self.key_starts[i + 1]
+                offsets.extend(self.key_offsets[start:end])
+        return sorted(offsets)
+
+    def iter_row_bytes(self, offsets: Iterable[int]) -> Generator[bytes, None, None]:
+        """
+        Read the rows at offsets, without reading any other rows.
+
+        :param offsets: offsets of rows, e.g. from find_key
+        :return: iterator over the bytes of each row, including its line ending
+        """
+        encoding = self.info["encoding"]
+        row_pattern = csv_row_pattern(
+            self.info["delimiter"].encode(encoding), '"'.encode(encoding)
+        )
+        with open(self.csv_file, "rb", buffering=0) as fh:
+            for offset in offsets:
+                fh.seek(offset)
+                yield next(_iter_row_bytes(fh, row_pattern, offset))[1]
+
+    def open_row_bytes(self, offsets: Iterable[int]) -> BinaryIO:
+        """
+        Open the rows at offsets as a binary file, without reading any other rows,
+        e.g. for a CsvChunkReader or CsvRowReader with the fieldnames of the index.
+
+        :param offsets: offsets of rows, e.g. from find_key
+        :return: binary file of the rows, which are read as the file is read
+        """
+        raw = _RowBytesStream(self.iter_row_bytes(offsets))
+        return cast(BinaryIO, io.BufferedReader(raw, DEFAULT_BUFFER_SIZE))
+
+    def iter_key_rows(self, key: str) -> Iterator[CsvRow]:
+        """
+        Read the rows with a key, without reading any other rows.
+
+        :param key: value of the key column
+        :return: iterator over the rows with the key, in the order of the file
+        """
+        for data in self.iter_row_bytes(self.find_key(key)):
+            cells = self._parse(data, self.info["delimiter"], self.info["encoding"])
+            yield CsvRow(cells, self.index)
+
+
+def _array_view(data: memoryview, start: int, end: int, typecode: str) -> Sequence[Any]:
+    # the little-endian unsigned 64-bit integers (or doubles) from start to end,
+    # without copying
+    if end > len(data):
+        raise ValueError(f"expected at least {end} bytes, found {len(data)}")
+    if sys.byteorder == "big":  # pragma: no cover
+        values = array(typecode)
+        values.frombytes(data[start:end])
+        values.byteswap()
+        return values
+    return cast(Sequence[Any], data[start:end].cast(typecode))  # type: ignore[call-overload]
+
+
+def _key_number(key: str) -> int | float | None:
+    # the number a key is compared as by filter_parser.to_number_or_string,
+    # which is not imported as filter_parser is slow to import
+    try:
+        return int(key)
+    except ValueError:
+        try:
+            return float(key)
+        except ValueError:
+            return None
+
+
+def _number_value(number: int | float) -> float:
+    # integers too large for a double sort with the infinities
+    try:
+        return float(number)
+    except OverflowError:
+        return math.inf if number > 0 else -math.inf
+
+
+def _sort_numbers(keys: Sequence[str]) -> tuple[array, array]:
+    # the values of the keys that are numbers, in order, and the number of each key
+    numbered = []
+    for i, key in enumerate(keys):
+        number = _key_number(key)
+        if number is not None and number == number:
+            numbered.append((_number_value(number), i))
+    numbered.sort()
+    return array("d", (x[0] for x in numbered)), array("Q", (x[1] for x in numbered))
+
+
+class _RowBytesStream(io.RawIOBase):
+    # a raw binary file reading from CsvIndex.iter_row_bytes
+    def __init__(self, rows: Generator[bytes, None, None]) -> None:
+        self.rows = rows
+        self.pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(view):
+            if not self.pending:
+                row = next(self.rows, None)
+                if row is None:
+                    break
+                self.pending = memoryview(row)
+            size = min(len(view) - filled, len(self.pending))
+            end = filled + size
+            view[filled:end] = self.pending[:size]
+            self.pending = self.pending[size:]
+            filled = end
+        return filled
+
+    def close(self) -> None:
+        self.rows.close()
+        super().close()
+
+
+class _IndexKeys(Sequence[str]):
+    # the sorted keys of a saved CsvIndex, each decoded only when it is used
+    def __init__(self, starts: Sequence[int], text: memoryview) -> None:
+        self.starts = starts
+        self.text = text
+
+    def __len__(self) -> int:
+        return len(self.starts) - 1
+
+    def __getitem__(self, i: int) -> str:  # type: ignore[override]
+        i = range(len(self))[i]
+        start, end = self.starts[i], self.starts[i + 1]
+        return str(self.text[start:end], "utf-8")
+
+
+def iter_csv_rows(
+    csv_file: str | Path,
+    start: int = 0,
+    stop: int | None = None,
+    delimiter: str = DEFAULT_DELIMITER,
+) -> Iterator[CsvRow]:
+    """
+    Read the rows from start up to, but not including, stop, using the saved
+    CsvIndex of the file if it is up to date, and otherwise reading from the
+    start of the file.
+
+    :param csv_file: file to be read
+    :param start: zero-based number of the first row, not counting the header
+    :param stop: number of the row to stop before (default=the end of the file)
+    :param delimiter: column delimiter, if the file has no index
+    :return: iterator over the rows
+    """
+    index = CsvIndex.load(csv_file)
+    if index is not None:
+        yield from index.iter_rows(start, stop)
+        return
+    with open_csv_reader(csv_file, delimiter=delimiter, as_rows=True) as reader:
+        yield from itertools.islice(reader, start, stop)
+
+
+def iter_csv_key_rows(
+    csv_file: str | Path,
+    key_column: str,
+    key: str,
+    delimiter: str = DEFAULT_DELIMITER,
+) -> Iterator[CsvRow]:
+    """
+    Read the rows whose key_column is key, using the saved CsvIndex of the
+    file if it is up to date and indexes key_column, and otherwise reading
+    the whole file.
+
+    :param csv_file: file to be read
+    :param key_column: header of the key column
+    :param key: value of the key column
+    :param delimiter: column delimiter, if the file has no index
+    :return: iterator over the rows with the key, in the order of the file
+    """
+    index = CsvIndex.load(csv_file)
+    if index is not None and index.key_column == key_column:
+        yield from index.iter_key_rows(key)
+        return
+    with open_csv_reader(csv_file, delimiter=delimiter, as_rows=True) as reader:
+        yield from (row for row in reader if row.get(key_column) == key)
@@ -1,16 +1,56 @@
+import bz2
+import contextlib
+import csv
 import functools
+import gzip
+import io
+import itertools
 import logging  # noqa: A005
+import lzma
 import os
+import re
+import sys
+import time
 from pathlib import Path
-from typing import Any, Callable, Hashable
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    Mapping,
+    TextIO,
+    cast,
+)
 
 import click
-import pandas as pd
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from malcolm3utils.utils.csvcache import CsvCache
 
 logger = logging.getLogger(__name__)
 
 
 DEFAULT_DELIMITER = os.environ.get("DELIMITER", ",")
+DEFAULT_CHUNKSIZE = 10000
+INFER_ONCE = "infer-once"
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+DEFAULT_ENCODING = "utf-8"
+DEFAULT_FLUSH_SECONDS = 1.0
+DEFAULT_BATCH_ROWS = 1000
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_ROW_BYTES = 64 * 1024 * 1024
+
+# pandas is only imported by the functions that use it, as importing it takes
+# longer than most of the scripts using this module take to run
+
+# dtypes inferred by pandas keyed by absolute path along with the (mtime, size)
+# of the file when they were inferred, see INFER_ONCE
+_inferred_dtypes: dict[str, tuple[tuple[int, int], dict[Hashable, Any]]] = {}
 
 
 def csv_options():  # type: ignore[no-untyped-def]
@@ -39,18 +79,558 @@ def csv_options():  # type: ignore[no-untyped-def]
     return inner
 
 
+def _open_zstd(csv_file: str | Path, mode: str) -> Any:  # pragma: no cover
+    try:
+        from compression import zstd  # type: ignore[import-not-found]
+
+        return zstd.open(csv_file, mode)
+    except ImportError:
+        pass
+    try:
+        import zstandard  # type: ignore[import-not-found]
+    except ImportError:
+        raise ValueError(
+            f'"{csv_file}" requires Python 3.14 or the zstandard package'
+        ) from None
+    return zstandard.open(csv_file, mode)
+
+
+# binary openers, taking the file and mode, for compressed files keyed by file extension
+COMPRESSED_OPENERS: dict[str, Callable[[str | Path, str], Any]] = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+    ".zst": _open_zstd,
+}
+
+
+@contextlib.contextmanager
+def open_csv_file(
+    csv_file: str | Path,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    encoding: str = DEFAULT_ENCODING,
+) -> Iterator[TextIO]:
+    """
+    Open a CSV file for reading with a large read buffer.
+
+    The file is read in binary through a buffer of buffer_size bytes
+    and decoded a block at a time, which is considerably faster for
+    large files than the default text buffering.
+
+    Files ending in .gz, .bz2, .xz or .zst are decompressed on the fly
+    (.zst requires Python 3.14 or the zstandard package).
+
+    If csv_file is '-' then stdin is read, and left open on exit.
+
+    :param csv_file: file to be read, or '-' for stdin
+    :param buffer_size: size of the read buffer in bytes
+    :param encoding: text encoding of the file
+    :return: context manager yielding the open text file
+    """
+    if str(csv_file) == "-" and not hasattr(sys.stdin, "buffer"):  # pragma: no cover
+        yield sys.stdin
+        return
+    with open_binary_input(csv_file, buffer_size=buffer_size) as binary_fh:
+        fh = io.TextIOWrapper(binary_fh, encoding=encoding, newline="")
+        try:
+            yield fh
+        finally:
+            # leave closing the binary file (but never stdin) to open_binary_input
+            fh.detach()
+
+
+@contextlib.contextmanager
+def open_binary_input(
+    csv_file: str | Path, buffer_size: int = DEFAULT_BUFFER_SIZE
+) -> Iterator[BinaryIO]:
+    """
+    Open a file for reading in binary with a large read buffer,
+    decompressing it on the fly as for open_csv_file.
+
+    If csv_file is '-' then stdin is read, and left open on exit.
+
+    :param csv_file: file to be read, or '-' for stdin
+    :param buffer_size: size of the read buffer in bytes
+    :return: context manager yielding the open binary file
+    """
+    if str(csv_file) == "-":
+        yield sys.stdin.buffer
+        return
+    opener = COMPRESSED_OPENERS.get(Path(csv_file).suffix.lower())
+    if opener is None:
+        binary_fh = open(csv_file, "rb", buffering=buffer_size)
+    else:
+        binary_fh = io.BufferedReader(opener(csv_file, "rb"), buffer_size)
+    with binary_fh:
+        yield binary_fh
+
+
+class CsvRow(Mapping[str, str | None]):
+    """
+    Read-only mapping view of one row of a CSV file.
+
+    The row holds the list of cells from csv.reader along with an
+    index of header to column number that is shared by every row of
+    the file, so no per-row dictionary is built.
+
+    As with csv.DictReader, columns missing from a short row are None.
+    """
+
+    __slots__ = ("cells", "index")
+
+    def __init__(self, cells: list[str], index: Mapping[str, int]) -> None:
+        self.cells = cells
+        self.index = index
+
+    def __getitem__(self, key: str) -> str | None:
+        i = self.index[key]
+        return self.cells[i] if i < len(self.cells) else None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({dict(self)!r})"
+
+
+class CsvRowReader:
+    """
+    Reader yielding a CsvRow for each row of a CSV file following the header row.
+
+    A lighter weight equivalent of csv.DictReader. Empty lines are skipped.
+    As with csv.DictReader, if fieldnames are specified then the first row
+    is not treated as the header row.
+    """
+
+    def __init__(
+        self,
+        fh: Iterable[str],
+        delimiter: str = DEFAULT_DELIMITER,
+        fieldnames: list[str] | None = None,
+    ) -> None:
+        self.reader = csv.reader(fh, delimiter=delimiter)
+        if fieldnames is None:
+            fieldnames = next(self.reader, None)
+        self.fieldnames: list[str] | None = fieldnames
+        self.index: dict[str, int] = {x: i for i, x in enumerate(fieldnames or [])}
+
+    @property
+    def line_num(self) -> int:
+        return self.reader.line_num
+
+    def __iter__(self) -> Iterator[CsvRow]:
+        index = self.index
+        for cells in self.reader:
+            if cells:
+                yield CsvRow(cells, index)
+
+    def projector(self, fieldnames: list[str]) -> Callable[[CsvRow], list[str]]:
+        """
+        Create a function giving the values of a row in the order of fieldnames.
+
+        Columns this file does not have, or that are missing from a short row,
+        are given as empty strings.
+
+        :param fieldnames: the output columns
+        :return: function converting a row of this file to a list of values
+        """
+        indexes = [self.index.get(x, -1) for x in fieldnames]
+        width = max(indexes, default=-1) + 1
+
+        def project(row: CsvRow) -> list[str]:
+            cells = row.cells
+            if len(cells) < width:
+                cells = cells + [""] * (width - len(cells))
+            return [cells[i] if i >= 0 else "" for i in indexes]
+
+        return project
+
+
+@contextlib.contextmanager
+def open_csv_reader(
+    csv_file: str | Path,
+    delimiter: str = DEFAULT_DELIMITER,
+    as_rows: bool = False,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    encoding: str = DEFAULT_ENCODING,
+) -> Iterator[Any]:
+    """
+    Open a CSV file with open_csv_file and return a reader over its rows.
+
+    :param csv_file: file to be read, or '-' for stdin
+    :param delimiter: column delimiter
+    :param as_rows: yield a CsvRow for each row following the header row
+        (a CsvRowReader) rather than a list for every row (a csv.reader)
+    :param buffer_size: size of the read buffer in bytes
+    :param encoding: text encoding of the file
+    :return: context manager yielding the reader
+    """
+    with open_csv_file(csv_file, buffer_size=buffer_size, encoding=encoding) as fh:
+        if as_rows:
+            yield CsvRowReader(fh, delimiter=delimiter)
+        else:
+            yield csv.reader(fh, delimiter=delimiter)
+
+
+def read_csv_header(
+    csv_file: str | Path,
+    delimiter: str = DEFAULT_DELIMITER,
+    encoding: str = DEFAULT_ENCODING,
+) -> list[str] | None:
+    """
+    Read just the header row of a CSV file, closing the file again.
+
+    A small read buffer is used, as only the start of the file is read.
+
+    :param csv_file: file to be read
+    :param delimiter: column delimiter
+    :param encoding: text encoding of the file
+    :return: the header row, or None if the file is empty
+    """
+    with open_csv_reader(
+        csv_file,
+        delimiter=delimiter,
+        buffer_size=io.DEFAULT_BUFFER_SIZE,
+        encoding=encoding,
+    ) as reader:
+        return next(reader, None)
+
+
+def parse_column_spec(column_spec: str) -> list[str | int]:
+    """
+    Parse a comma separated list of column headers, column indexes (one-based),
+    or column ranges (e.g. 4-6 for columns 4 through 6 inclusive).
+
+    :param column_spec: the column specification
+    :return: the column headers and zero-based column indexes, headers are
+        resolved to indexes with resolve_column_spec once the header row is read
+    """
+    column_list: list[str | int] = []
+    for spec in column_spec.split(","):
+        if "-" in spec:
+            range_parts = spec.split("-", 1)
+            if (
+                len(range_parts) == 2
+                and range_parts[0].isnumeric()
+                and range_parts[1].isnumeric()
+            ):
+                column_list.extend(range(int(range_parts[0]) - 1, int(range_parts[1])))
+            else:
+                column_list.append(spec)
+        elif spec.isnumeric():
+            column_list.append(int(spec) - 1)
+        else:
+            column_list.append(spec)
+    return column_list
+
+
+def resolve_column_spec(column_list: list[str | int], headers: list[str]) -> list[int]:
+    """
+    Replace the column headers from parse_column_spec with their indexes.
+
+    :param column_list: column headers and indexes from parse_column_spec
+    :param headers: the header row
+    :return: the column indexes, leaving out headers that are not in the header row
+    """
+    indexes: list[int] = []
+    for col in column_list:
+        if isinstance(col, str):
+            if col in headers:
+                indexes.append(headers.index(col))
+        else:
+            indexes.append(col)
+    return indexes
+
+
+class CsvChunkReader:
+    """
+    Reader that parses the header row of a binary CSV file and then
+    splits the remainder of the file into chunks of whole rows.
+
+    Each chunk is about chunk_bytes long, ending at a newline that is not
+    inside a quoted field, so chunks can be parsed independently,
+    e.g. in parallel by CsvRowReader with the fieldnames of this reader.
+
+    Rows are found with csv_row_pattern, so a quote character inside an
+    unquoted field is an ordinary character, as it is for csv.reader.
+    A row longer than max_row_bytes (e.g. after a quoted field that is never
+    closed) raises a ValueError rather than reading the rest of the file.
+
+    As with CsvRowReader, if fieldnames are specified then the first row
+    is not treated as the header row.
+    """
+
+    def __init__(
+        self,
+        fh: BinaryIO,
+        delimiter: str = DEFAULT_DELIMITER,
+        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+        encoding: str = DEFAULT_ENCODING,
+        quotechar: str = '"',
+        fieldnames: list[str] | None = None,
+        max_row_bytes: int = DEFAULT_MAX_ROW_BYTES,
+    ) -> None:
+        self.fh = fh
+        self.chunk_bytes = chunk_bytes
+        self.max_row_bytes = max_row_bytes
+        self.quotechar = quotechar.encode(encoding)
+        d, q = re.escape(delimiter.encode(encoding)), re.escape(self.quotechar)
+        self._row = csv_row_pattern(delimiter.encode(encoding), self.quotechar)
+        self._rows = re.compile(b"(?:%s)*+" % self._row.pattern)
+        # pairs of quotes, each opening at the start of a field
+        self._paired_quotes = re.compile(
+            b"(?:[^%s]*+(?<![^%s%s\n])%s[^%s]*+%s)*+[^%s]*+" % (q, d, q, q, q, q, q)
+        )
+        self._pending = b""
+        if fieldnames is None:
+            header, self._pending = self._read_header()
+            fieldnames = next(
+                csv.reader(io.StringIO(header.decode(encoding)), delimiter=delimiter),
+                None,
+            )
+        self.fieldnames: list[str] | None = fieldnames
+
+    def __iter__(self) -> Iterator[bytes]:
+        data, self._pending = self._pending, b""
+        size = self.chunk_bytes
+        while block := self.fh.read(max(size - len(data), 1)):
+            data += block
+            end = self._last_row_end(data)
+            if end:
+                yield data[:end]
+                data = data[end:]
+            size = self.chunk_bytes if end else self._grow(data)
+        if data:
+            yield data
+
+    def _read_header(self) -> tuple[bytes, bytes]:
+        data = b""
+        size = self.chunk_bytes
+        while (match := self._row.match(data)) is None:
+            block = self.fh.read(max(size - len(data), 1))
+            if not block:
+                return data, b""
+            data += block
+            size = self._grow(data)
+        end = match.end()
+        return data[:end], data[end:]
+
+    def _grow(self, data: bytes) -> int:
+        # data is the start of a row with no end yet, and reading as much again
+        # means a long row is only rescanned a few times
+        if len(data) > self.max_row_bytes:
+            raise ValueError(
+                f"no end of row in {len(data)} bytes, "
+                "is there a quoted field that is never closed?"
+            )
+        return max(self.chunk_bytes, 2 * len(data))
+
+    def _last_row_end(self, data: bytes) -> int:
+        # counting quotes finds rows as csv.reader does while each quoted field
+        # starts at the start of a field (as csv.writer writes them), which is
+        # much faster than csv_row_pattern, so that is only used from the first
+        # quote that does not, or that has no closing quote
+        end = cast("re.Match[bytes]", self._paired_quotes.match(data)).end()
+        pos = data.rfind(b"\n", 0, end)
+        quotes = data.count(self.quotechar, 0, pos + 1)
+        while pos >= 0 and quotes % 2:
+            prev = data.rfind(b"\n", 0, pos)
+            quotes -= data.count(self.quotechar, prev + 1, pos + 1)
+            pos = prev
+        if end == len(data):
+            return pos + 1
+        return cast("re.Match[bytes]", self._rows.match(data, pos + 1)).end()
+
+
+@functools.cache
+def csv_row_pattern(delimiter: bytes, quotechar: bytes) -> "re.Pattern[bytes]":
+    """
+    Compile a regular expression matching one row of a CSV file, up to and
+    including its newline, with the fields found as csv.reader finds them:
+    a field starting with quotechar is quoted up to the next quotechar that
+    is not doubled, and any other quotechar is an ordinary character.
+
+    A row ending inside a quoted field does not match until the rest of
+    the field (and the newline after it) is included.
+
+    :param delimiter: encoded column delimiter
+    :param quotechar: encoded quote character
+    :return: compiled pattern
+    """
+    d, q = re.escape(delimiter), re.escape(quotechar)
+    quoted = b"%s[^%s]*+(?:%s%s[^%s]*+)*+%s" % (q, q, q, q, q, q)
+    field = b"(?:%s|(?!%s))[^%s\n]*+" % (quoted, q, d)
+    # rows without quotes are matched without splitting them into fields
+    return re.compile(b"[^%s\n]*+\n|%s(?:%s%s)*+\n" % (q, field, d, field))
+
+
+@contextlib.contextmanager
+def open_csv_chunks(
+    csv_file: str | Path,
+    delimiter: str = DEFAULT_DELIMITER,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    encoding: str = DEFAULT_ENCODING,
+) -> Iterator[CsvChunkReader]:
+    """
+    Open a CSV file with open_binary_input and return a CsvChunkReader for it.
+
+    :param csv_file: file to be read, or '-' for stdin
+    :param delimiter: column delimiter
+    :param chunk_bytes: approximate size of each chunk in bytes
+    :param encoding: text encoding of the file
+    :return: context manager yielding the reader
+    """
+    with open_binary_input(csv_file) as fh:
+        yield CsvChunkReader(
+            fh, delimiter=delimiter, chunk_bytes=chunk_bytes, encoding=encoding
+        )
+
+
+class CsvBlockWriter:
+    """
+    CSV writer that accumulates rows into blocks of text, and writes each
+    block to a binary file in a single call.
+
+    A block is written once it reaches flush_bytes characters, or when a row
+    is written more than flush_seconds after the last block was written,
+    so a slow trickle of rows is not held back indefinitely.
+
+    Text that is not CSV (e.g. report lines) can be added with write,
+    which also allows the writer to be used as the file of a csv.DictWriter.
+    """
+
+    def __init__(
+        self,
+        fh: BinaryIO,
+        delimiter: str = DEFAULT_DELIMITER,
+        encoding: str = DEFAULT_ENCODING,
+        flush_bytes: int = DEFAULT_BUFFER_SIZE,
+        flush_seconds: float = DEFAULT_FLUSH_SECONDS,
+        batch_rows: int = DEFAULT_BATCH_ROWS,
+    ) -> None:
+        self.fh = fh
+        self.encoding = encoding
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.batch_rows = batch_rows
+        self._block = io.StringIO()
+        self._writer = csv.writer(self._block, delimiter=delimiter)
+        self._last_flush = time.monotonic()
+
+    def writerow(self, row: Iterable[Any]) -> None:
+        self._writer.writerow(row)
+        self._check_flush()
+
+    def writerows(self, rows: Iterable[Iterable[Any]]) -> None:
+        """
+        Write the rows, batch_rows at a time, so that rows from a
+        generator are not all held in memory before being written.
+
+        :param rows: rows to be written
+        """
+        rows = iter(rows)
+        while batch := list(itertools.islice(rows, self.batch_rows)):
+            self._writer.writerows(batch)
+            self._check_flush()
+
+    def write(self, text: str) -> None:
+        self._block.write(text)
+        self._check_flush()
+
+    def flush(self) -> None:
+        """
+        Write out the current block and flush the file.
+        """
+        text = self._block.getvalue()
+        if text:
+            self.fh.write(text.encode(self.encoding))
+            self._block.seek(0)
+            self._block.truncate()
+        self.fh.flush()
+        self._last_flush = time.monotonic()
+
+    def _check_flush(self) -> None:
+        if (
+            self._block.tell() >= self.flush_bytes
+            or time.monotonic() - self._last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+
+@contextlib.contextmanager
+def open_csv_output(
+    output_file: str | Path = "-",
+    delimiter: str = DEFAULT_DELIMITER,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    encoding: str = DEFAULT_ENCODING,
+    flush_seconds: float = DEFAULT_FLUSH_SECONDS,
+) -> Iterator[CsvBlockWriter]:
+    """
+    Open a CSV file for writing through a CsvBlockWriter.
+
+    Files ending in .gz, .bz2, .xz or .zst are compressed on the fly
+    (.zst requires Python 3.14 or the zstandard package).
+
+    If output_file is '-' then stdout is written, and left open on exit.
+    Any remaining block is written out on exit, even after an exception.
+
+    :param output_file: file to be written, or '-' for stdout
+    :param delimiter: column delimiter
+    :param buffer_size: size of the blocks and of the file's write buffer in bytes
+    :param encoding: text encoding of the file
+    :param flush_seconds: maximum time between blocks being written
+    :return: context manager yielding the writer
+    """
+    with contextlib.ExitStack() as stack:
+        if str(output_file) == "-":
+            sys.stdout.flush()
+            fh = sys.stdout.buffer
+        else:
+            opener = COMPRESSED_OPENERS.get(Path(output_file).suffix.lower())
+            if opener is None:
+                fh = open(output_file, "wb", buffering=buffer_size)
+            else:
+                fh = opener(output_file, "wb")
+            stack.enter_context(fh)
+        writer = CsvBlockWriter(
+            fh,
+            delimiter=delimiter,
+            encoding=encoding,
+            flush_bytes=buffer_size,
+            flush_seconds=flush_seconds,
+        )
+        stack.callback(writer.flush)
+        yield writer
+
+
 def read_keyed_csv_data(
     csv_file: Path,
     keyfield: str,
     skiprows: list[int] | int | Callable[[Hashable], bool] | None = None,
     multiple: bool = False,
-) -> dict[Any, dict[str, Any]] | dict[Any, list[dict[str, Any]]]:
+    usecols: list[str] | None = None,
+    as_frame: bool = False,
+    chunksize: int | None = DEFAULT_CHUNKSIZE,
+    dtype: Any = None,
+    cache: "CsvCache | None" = None,
+) -> "dict[Any, dict[str, Any]] | dict[Any, list[dict[str, Any]]] | pd.DataFrame":
     """
     Instead of using DictReader which imports all values as strings,
     we use pandas.read_csv which handles all of the data conversion
 
     Values are returned as a keyed dictionary rather than a list
     as we may need to be able to look up the entries by key.
+    The dictionary is built up chunksize rows at a time (see iter_csv_data)
+    so the full list of rows is never held in memory. Pandas infers the
+    types of each chunk separately, so to give the keys and values the same
+    types as when the file is read in one go, a column with integers in some
+    chunks and floats (or missing values) in others is converted to floats
+    once every chunk has been read, and if a column's types differ in any
+    other way (e.g. numbers in some chunks and strings in others) the file
+    is read a second time with the types that suit every chunk.
 
     Because MDBs do not support boolean values, we convert all
     boolean values to integer 0/1 fields.
@@ -64,27 +644,141 @@ def read_keyed_csv_data(
     If multiple is true, then the value of the nested dict will be a list
     with each row that matches the key being appended to that list.
 
+    If usecols is specified only those columns (and the keyfield) are read.
+
+    Dtype and cache are handled as for read_csv_data.
+    When a cache is used the file is read in one go, as it is if chunksize is None.
+
+    If as_frame is true, a pandas DataFrame indexed by the keyfield is returned
+    instead of a dictionary. Unless multiple is true only the last row for
+    each key is retained, as with the dictionary.
+
     :param csv_file: CSV file to be read.
     :param keyfield: Field to use as the key in the returned dictionary.
     :param skiprows: rows to skip
     :return: keyed dictionary of each row of data.
     :param multiple: indicates there may be multiple rows for each key
+    :param usecols: columns to be read (default=all columns)
+    :param as_frame: return a DataFrame indexed by keyfield rather than a dictionary
+    :param chunksize: number of rows to read per chunk (None=read in one go)
+    :param dtype: column types (see read_csv_data)
+    :param cache: on-disk cache of parsed CSV files (default=no cache)
     """
+    if usecols is not None and keyfield not in usecols:
+        usecols = [*usecols, keyfield]
+    if as_frame:
+        logger.debug('...............reading keyed CSV frame from "%s"', csv_file)
+        pandas_csv_data = _read_csv(
+            csv_file,
+            skiprows=skiprows,
+            usecols=usecols,
+            dtype=dtype,
+            cache=cache,
+            index_col=keyfield,
+        )
+        if not multiple:
+            pandas_csv_data = pandas_csv_data[
+                ~pandas_csv_data.index.duplicated(keep="last")
+            ]
+        return _convert_bool_columns(pandas_csv_data)
+    if cache is None and chunksize is not None:
+        return _read_keyed_chunks(
+            csv_file, keyfield, multiple, chunksize, skiprows, usecols, dtype
+        )
+    result: dict[Any, Any] = {}
+    _key_rows(
+        result,
+        read_csv_data(
+            csv_file, skiprows=skiprows, usecols=usecols, dtype=dtype, cache=cache
+        ),
+        keyfield,
+        multiple,
+    )
+    return result
+
+
+def _read_keyed_chunks(
+    csv_file: Path,
+    keyfield: str,
+    multiple: bool,
+    chunksize: int,
+    skiprows: list[int] | int | Callable[[Hashable], bool] | None,
+    usecols: list[str] | None,
+    dtype: Any,
+) -> dict[Any, Any]:
+    logger.debug('...............streaming keyed CSV data from "%s"', csv_file)
+    read_dtype, dtype_key = _resolve_dtype(csv_file, dtype)
+    options = {"skiprows": skiprows, "usecols": usecols, "chunksize": chunksize}
+    result, chunk_dtypes = _key_chunks(
+        csv_file, keyfield, multiple, dtype=read_dtype, **options
+    )
+    dtypes = {column: _common_dtype(list(x)) for column, x in chunk_dtypes.items()}
+    changed = [column for column, x in chunk_dtypes.items() if len(x) > 1]
+    if any(dtypes[column] != "float64" for column in changed):
+        # values already converted to e.g. numbers can't be turned back
+        # into the strings they were read from
+        del result
+        result, _ = _key_chunks(csv_file, keyfield, multiple, dtype=dtypes, **options)
+    elif changed:
+        result = _float_columns(result, changed, keyfield, multiple)
+    if dtype_key is not None and _reads_whole_file(skiprows, usecols):
+        _remember_dtypes(dtype_key, dtypes)
+    return result
+
+
+def _key_chunks(
+    csv_file: Path, keyfield: str, multiple: bool, **kwargs: Any
+) -> tuple[dict[Any, Any], dict[Hashable, dict[Any, None]]]:
+    # the keyed rows, and the types pandas inferred for each column of each chunk
+    import pandas as pd
+
+    result: dict[Any, Any] = {}
+    chunk_dtypes: dict[Hashable, dict[Any, None]] = {}
+    with pd.read_csv(str(csv_file), **kwargs) as reader:
+        for chunk in reader:
+            for column, column_dtype in chunk.dtypes.items():
+                chunk_dtypes.setdefault(column, {})[column_dtype] = None
+            rows = _convert_bool_columns(chunk).to_dict("records")
+            _key_rows(result, rows, keyfield, multiple)  # type: ignore[arg-type]
+    return result, chunk_dtypes
+
+
+def _key_rows(
+    result: dict[Any, Any],
+    rows: Iterable[dict[str, Any]],
+    keyfield: str,
+    multiple: bool,
+) -> None:
     if multiple:
-        result: dict[str, list[dict[str, Any]]] = {}
-        for entry in read_csv_data(csv_file, skiprows=skiprows):
-            key = entry[keyfield]
-            if key not in result:
-                result[key] = []
-            result[key].append(entry)
-        return result
+        for entry in rows:
+            result.setdefault(entry[keyfield], []).append(entry)
     else:
-        return {x[keyfield]: x for x in read_csv_data(csv_file)}
+        result.update((x[keyfield], x) for x in rows)
+
+
+def _float_columns(
+    result: dict[Any, Any], columns: list[Hashable], keyfield: str, multiple: bool
+) -> dict[Any, Any]:
+    # the columns pandas read as integers in some chunks, as it would
+    # have read them as floats from the whole file
+    rows = (
+        itertools.chain.from_iterable(result.values()) if multiple else result.values()
+    )
+    for row in rows:
+        for column in columns:
+            if isinstance(row[column], int):
+                row[column] = float(row[column])
+    if keyfield not in columns:
+        return result
+    return {float(k) if isinstance(k, int) else k: v for k, v in result.items()}
 
 
 def read_csv_data(
     csv_file: Path,
     skiprows: list[int] | int | Callable[[Hashable], bool] | None = None,
+    usecols: list[str] | None = None,
+    dtype: Any = None,
+    cache: "CsvCache | None" = None,
 ) -> list[dict[str, Any]]:
     """
     Use Pandas to read a CSV into a simple list of dictionaries.
@@ -97,13 +791,157 @@ def read_csv_data(
         - a callable that takes the line index and returns True to skip that line
         - None to skip no rows (default)
 
+    Columns can be filtered by specifying a usecols list of column names.
+
+    Dtype can be
+        - anything accepted as a dtype by pandas.read_csv, e.g. a dictionary
+          of column name to type, which avoids pandas type inference
+        - INFER_ONCE ("infer-once") to have pandas infer the types the first time
+          the whole file is read (without skiprows or usecols) and to reuse
+          those types until the file changes
+        - None to have pandas infer the types (default)
+
+    If a cache (a csvcache.CsvCache) is specified the parsed data is loaded
+    from the cache if present, and stored in the cache if not.
 
     :param csv_file: file to be read
     :param skiprows: rows to skip
+    :param usecols: columns to be read (default=all columns)
+    :param dtype: column types
+    :param cache: on-disk cache of parsed CSV files (default=no cache)
     :return: list of dictionary entries
     """
     logger.debug('...............reading CSV data from "%s"', csv_file)
-    pandas_csv_data = pd.read_csv(str(csv_file), skiprows=skiprows)
+    pandas_csv_data = _read_csv(
+        csv_file, skiprows=skiprows, usecols=usecols, dtype=dtype, cache=cache
+    )
+    return _convert_bool_columns(pandas_csv_data).to_dict("records")  # type: ignore[return-value]
+
+
+def iter_csv_data(
+    csv_file: Path,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    skiprows: list[int] | int | Callable[[Hashable], bool] | None = None,
+    usecols: list[str] | None = None,
+    dtype: Any = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Use Pandas to read a CSV a chunk at a time, yielding a dictionary for each row.
+
+    Only one chunk of the file is held in memory at a time, so this should
+    be used in preference to read_csv_data for large files.
+    Note that Pandas infers the column types separately for each chunk.
+    With INFER_ONCE the types are only remembered if they were the same for
+    every chunk.
+
+    Skiprows, usecols and dtype are handled as for read_csv_data.
+
+    :param csv_file: file to be read
+    :param chunksize: number of rows to read per chunk
+    :param skiprows: rows to skip
+    :param usecols: columns to be read (default=all columns)
+    :param dtype: column types
+    :return: iterator over the dictionary entries
+    """
+    import pandas as pd
+
+    logger.debug('...............streaming CSV data from "%s"', csv_file)
+    dtype, dtype_key = _resolve_dtype(csv_file, dtype)
+    if not _reads_whole_file(skiprows, usecols):
+        dtype_key = None
+    chunk_dtypes = None
+    with pd.read_csv(
+        str(csv_file),
+        skiprows=skiprows,
+        usecols=usecols,
+        dtype=dtype,
+        chunksize=chunksize,
+    ) as reader:
+        for chunk in reader:
+            if dtype_key is not None:
+                if chunk_dtypes is None:
+                    chunk_dtypes = chunk.dtypes.to_dict()
+                elif chunk_dtypes != chunk.dtypes.to_dict():
+                    dtype_key = None
+            yield from _convert_bool_columns(chunk).to_dict("records")  # type: ignore[misc]
+    if dtype_key is not None and chunk_dtypes is not None:
+        _remember_dtypes(dtype_key, chunk_dtypes)
+
+
+def _common_dtype(dtypes: list[Any]) -> Any:
+    from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+    if all(x == dtypes[0] for x in dtypes):
+        return dtypes[0]
+    if all(is_numeric_dtype(x) and not is_bool_dtype(x) for x in dtypes):
+        return "float64"
+    return "object"
+
+
+def _read_csv(
+    csv_file: Path,
+    dtype: Any = None,
+    cache: "CsvCache | None" = None,
+    **kwargs: Any,
+) -> "pd.DataFrame":
+    if cache is not None:
+        cached_csv_data = cache.load(csv_file, dtype=dtype, **kwargs)
+        if cached_csv_data is not None:
+            return cached_csv_data
+    import pandas as pd
+
+    read_dtype, dtype_key = _resolve_dtype(csv_file, dtype)
+    pandas_csv_data: pd.DataFrame = pd.read_csv(
+        str(csv_file), dtype=read_dtype, **kwargs
+    )
+    if dtype_key is not None and _reads_whole_file(
+        kwargs.get("skiprows"), kwargs.get("usecols")
+    ):
+        _remember_dtypes(dtype_key, pandas_csv_data.dtypes.to_dict())
+    if cache is not None:
+        cache.store(pandas_csv_data, csv_file, dtype=dtype, **kwargs)
+    return pandas_csv_data
+
+
+def _resolve_dtype(
+    csv_file: Path, dtype: Any
+) -> tuple[Any, tuple[str, int, int] | None]:
+    if isinstance(dtype, str) and dtype == INFER_ONCE:
+        dtype_key = _dtype_key(csv_file)
+        return _cached_dtypes(dtype_key), dtype_key
+    return dtype, None
+
+
+def _reads_whole_file(skiprows: Any, usecols: Any) -> bool:
+    # types inferred from only some of the rows or columns may not suit the others
+    return skiprows is None and usecols is None
+
+
+def _dtype_key(csv_file: Path) -> tuple[str, int, int]:
+    statinfo = os.stat(csv_file)
+    return os.path.abspath(csv_file), statinfo.st_mtime_ns, statinfo.st_size
+
+
+def _cached_dtypes(dtype_key: tuple[str, int, int]) -> dict[Hashable, Any] | None:
+    path, *stamp = dtype_key
+    entry = _inferred_dtypes.get(path)
+    if entry is None or list(entry[0]) != stamp:
+        return None
+    return entry[1]
+
+
+def _remember_dtypes(
+    dtype_key: tuple[str, int, int], dtypes: dict[Hashable, Any]
+) -> None:
+    path, mtime, size = dtype_key
+    cached_dtypes = _cached_dtypes(dtype_key)
+    if cached_dtypes is None:
+        _inferred_dtypes[path] = ((mtime, size), dict(dtypes))
+    else:
+        cached_dtypes.update(dtypes)
+
+
+def _convert_bool_columns(pandas_csv_data: "pd.DataFrame") -> "pd.DataFrame":
     for key in pandas_csv_data.select_dtypes("bool").keys():
         pandas_csv_data[key] = pandas_csv_data[key].astype(int)
-    return list(pandas_csv_data.transpose().to_dict().values())
+    return pandas_csv_data
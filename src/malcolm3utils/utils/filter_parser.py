@@ -1,7 +1,9 @@
+import functools
 import logging
-from typing import Any, Generator
+import re
+from typing import Any, Generator, Iterator, Mapping
 
-from lark import Lark, Transformer, v_args
+from lark import Lark, Transformer, Tree, v_args
 
 logger = logging.getLogger(__name__)
 
@@ -22,8 +24,16 @@ filter_grammar = """
          | sum ">=" sum     -> ge
          | sum "<" sum      -> lt
          | sum "<=" sum     -> le
+         | sum "in" literal_set       -> in_set
+         | sum "not" "in" literal_set -> not_in_set
+         | key "~" STRING_LITERAL     -> match
          | "(" comp ")"
 
+    literal_set: "(" literal ("," literal)* ")"
+    ?literal: NUMBER          -> number_literal
+            | "-" NUMBER      -> neg_number_literal
+            | STRING_LITERAL  -> string_literal
+
     ?sum: product
         | sum "+" product   -> add
         | sum "-" product   -> sub
@@ -67,7 +77,7 @@ def to_number_or_string(s: Any) -> float | int | str:
     return str(s)
 
 
-def applyall(d: dict[str, Any], *args) -> Generator[bool, None, None]:  # type: ignore[no-untyped-def]
+def applyall(d: Mapping[str, Any], *args) -> Generator[bool, None, None]:  # type: ignore[no-untyped-def]
     for a in args:
         yield a(d)
 
@@ -116,6 +126,36 @@ class FilterParser(Transformer):
         logger.debug("Le test: %s and %s", a, b)
         return lambda d: a(d) <= b(d)
 
+    # the literal set and the regular expression are built once, when the
+    # expression is parsed, rather than for every row
+
+    def in_set(self, a, values):  # type: ignore[no-untyped-def]
+        logger.debug("In test: %s and %s", a, values)
+        return lambda d: a(d) in values
+
+    def not_in_set(self, a, values):  # type: ignore[no-untyped-def]
+        logger.debug("Not in test: %s and %s", a, values)
+        return lambda d: a(d) not in values
+
+    def match(self, k, pattern):  # type: ignore[no-untyped-def]
+        logger.debug("Match test: %s and %s", k, pattern)
+        b = k.strip('"')
+        regex = re.compile(pattern[1:-1])
+        return lambda d: regex.search(str(d[b])) is not None
+
+    def literal_set(self, *values):  # type: ignore[no-untyped-def]
+        logger.debug("Literal set: %s", values)
+        return frozenset(values)
+
+    def number_literal(self, value):  # type: ignore[no-untyped-def]
+        return to_number_or_string(value)
+
+    def neg_number_literal(self, value):  # type: ignore[no-untyped-def]
+        return -to_number_or_string(value)  # type: ignore[operator]
+
+    def string_literal(self, v):  # type: ignore[no-untyped-def]
+        return v[1:-1]
+
     def add(self, a, b):  # type: ignore[no-untyped-def]
         logger.debug("add: %s and %s", a, b)
         return lambda d: a(d) + b(d)
@@ -167,11 +207,84 @@ class FilterParser(Transformer):
         return lambda d: False
 
 
-def create_filter(filter_spec: str):  # type: ignore[no-untyped-def]
+@functools.cache
+def _filter_parser() -> Lark:
+    # building the parser from the grammar is far slower than using it,
+    # so one parser is shared, producing trees that can be both turned into
+    # a filter function and analysed without parsing the expression again
+    return Lark(filter_grammar, parser="lalr")
+
+
+def parse_filter(filter_spec: str) -> Tree:
     """
-    Convert a expression string into a function that takes a dictionary as an argument
+    Parse an expression string into a tree, for create_filter and equality_lookups.
+    """
+    return _filter_parser().parse(filter_spec)
+
+
+def create_filter(filter_spec: str | Tree):  # type: ignore[no-untyped-def]
+    """
+    Convert a expression string (or its tree from parse_filter) into a function
+    that takes a mapping (e.g. a dictionary or csvio.CsvRow) as an argument
     and returns a boolean
     """
-    filter_parser = Lark(filter_grammar, parser="lalr", transformer=FilterParser())
-    filter_generator = filter_parser.parse
-    return filter_generator(filter_spec)
+    if isinstance(filter_spec, str):
+        filter_spec = parse_filter(filter_spec)
+    return FilterParser().transform(filter_spec)
+
+
+def equality_lookups(filter_spec: str | Tree) -> dict[str, frozenset[Any]]:
+    """
+    Find the fields an expression requires to equal one of a set of constants,
+    e.g. so that rows can be looked up in an index of the field.
+
+    Only comparisons that must hold for the whole expression to be true are
+    found, i.e. ``field == constant``, ``constant == field`` or
+    ``field in (...)`` making up the expression or one of its top-level
+    ``and`` terms. Values compare as they do in the expression, so a field
+    of '1.0' equals the constant 1.
+
+    :param filter_spec: the filter expression, or its tree from parse_filter
+    :return: the constants each field must equal one of, keyed by field name
+    """
+    if isinstance(filter_spec, str):
+        filter_spec = parse_filter(filter_spec)
+    lookups: dict[str, frozenset[Any]] = {}
+    for term in _and_terms(filter_spec):
+        equality = _equality(term)
+        if equality is not None:
+            field, values = equality
+            lookups[field] = lookups.get(field, values) & values
+    return lookups
+
+
+def _and_terms(tree: Tree) -> Iterator[Tree]:
+    # an or_test or and_test may have a single term, e.g. for "A == 1"
+    if tree.data == "and_test" or (tree.data == "or_test" and len(tree.children) == 1):
+        for child in tree.children:
+            yield from _and_terms(child)
+    else:
+        yield tree
+
+
+def _equality(term: Tree) -> tuple[str, frozenset[Any]] | None:
+    if term.data == "in_set":
+        field, values = term.children
+        if field.data == "key":
+            return _field_name(field), FilterParser().transform(values)
+    elif term.data == "eq":
+        for field, constant in (term.children, reversed(term.children)):
+            if field.data == "key" and not any(
+                x.data == "key" for x in constant.iter_subtrees()
+            ):
+                try:
+                    value = FilterParser().transform(constant)({})
+                except Exception:
+                    # left for the filter to report for every row
+                    return None
+                return _field_name(field), frozenset([value])
+    return None
+
+
+def _field_name(key: Tree) -> str:
+    return str(key.children[0]).strip('"')
@@ -0,0 +1,424 @@
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from types import TracebackType
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+KEEP_MODES = ("first", "last", "uniq", "all")
+
+# key normalizations, applied in this order
+NORMALIZE_MODES = ("strip", "casefold", "numeric")
+
+# separator between the values of the columns of a composite key
+KEY_SEPARATOR = "\x1f"
+
+# number of rows inserted into a SQLite store with each executemany
+DEFAULT_BATCH_ROWS = 10000
+
+# page cache of a SQLite store, bounding the memory it uses, the SQLite
+# default of 2MiB makes inserting keys in random order several times slower
+CACHE_KIB = 64 * 1024
+
+Row = Mapping[str, Optional[str]]
+
+# the key, the key column values as read and the row, as merged into a store
+KeyedRow = Tuple[str, str, Row]
+
+
+def canonical_number(value: str) -> str:
+    """
+    :param value: a value
+    :return: the value written the same way as any other value of the same number
+        (e.g. "7" for "007", "7.0" or "7e0"), or the value itself if not a number
+    """
+    try:
+        return str(int(value))
+    except ValueError:
+        pass
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return str(int(number)) if number.is_integer() else repr(number)
+
+
+_NORMALIZERS: Dict[str, Callable[[str], str]] = {
+    "strip": str.strip,
+    "casefold": str.casefold,
+    "numeric": canonical_number,
+}
+
+
+def key_function(
+    key_fields: Sequence[str], normalize: Iterable[str] = ()
+) -> Callable[[Row], Tuple[str, str]]:
+    """
+    Create a function computing the key of a row once, as a single string
+    which can be used as a dict key or stored compactly.
+
+    The values of the key columns are normalized and, for a composite key,
+    joined with KEY_SEPARATOR.
+
+    :param key_fields: the key columns
+    :param normalize: normalizations to apply to each key value, from NORMALIZE_MODES
+    :return: function returning the key of a row, which is empty if all of the
+        key values are empty, and the key values as read joined with KEY_SEPARATOR
+    """
+    normalizers = [_NORMALIZERS[x] for x in NORMALIZE_MODES if x in normalize]
+    if len(key_fields) == 1 and not normalizers:
+        (key_field,) = key_fields
+
+        def simple_key(row: Row) -> Tuple[str, str]:
+            value = row.get(key_field) or ""
+            return value, value
+
+        return simple_key
+
+    def normalized_key(row: Row) -> Tuple[str, str]:
+        values = [row.get(x) or "" for x in key_fields]
+        parts = values
+        for normalizer in normalizers:
+            parts = [normalizer(x) for x in parts]
+        key = KEY_SEPARATOR.join(parts) if any(parts) else ""
+        return key, KEY_SEPARATOR.join(values)
+
+    return normalized_key
+
+
+def split_key_values(key_values: str, output_keys: Sequence[str]) -> Dict[str, str]:
+    """
+    :param key_values: key values as returned by a key_function
+    :param output_keys: names of the key columns
+    :return: the value of each key column
+    """
+    if len(output_keys) == 1:
+        return {output_keys[0]: key_values}
+    return dict(zip(output_keys, key_values.split(KEY_SEPARATOR)))
+
+
+def merge_value(old: Optional[str], new: str, keep: str, all_delimiter: str) -> str:
+    """
+    Merge a new value for a field into the value already kept for it.
+
+    :param old: value already kept, or None if there is none yet
+    :param new: the new non-empty value
+    :param keep: one of KEEP_MODES
+    :param all_delimiter: delimiter between values when keep is "all" or "uniq"
+    :return: the value to keep
+    """
+    if old is None or keep == "last":
+        return new
+    if keep == "all" or (keep == "uniq" and new not in old.split(all_delimiter)):
+        return old + all_delimiter + new
+    return old
+
+
+class MergeStore:
+    """
+    Store of the entries merged by csv-merge, keyed by the merge key value,
+    held in memory.
+
+    Each entry holds the key column values first read for its key, under
+    the names of the output key columns, and the merged values of its fields.
+    The output key columns and the list of output fields are kept with the
+    entries, so that a store which persists them can carry on a previous merge.
+    """
+
+    def __init__(
+        self, keep: str, all_delimiter: str, normalize: Iterable[str] = ()
+    ) -> None:
+        """
+        :param keep: how to handle multiple values for the same field, one of KEEP_MODES
+        :param all_delimiter: delimiter between values when keep is "all" or "uniq"
+        :param normalize: normalizations applied to the keys, from NORMALIZE_MODES
+        """
+        self.keep = keep
+        self.all_delimiter = all_delimiter
+        self.normalize = [x for x in NORMALIZE_MODES if x in normalize]
+        self.output_keys: List[str] = []
+        self.fields: List[str] = []
+        self._data: Dict[str, Dict[str, str]] = {}
+
+    def __enter__(self) -> "MergeStore":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        pass
+
+    def is_merged(self, fname: str) -> bool:
+        """
+        :param fname: name of an input file
+        :return: True if the file was merged into the store by a previous run
+            (a file merged since the store was opened is merged again if repeated)
+        """
+        return False
+
+    def merge(
+        self,
+        fname: str,
+        rows: Iterable[KeyedRow],
+        data_field_list: List[str],
+        output_keys: List[str],
+        fields: List[str],
+    ) -> None:
+        """
+        Merge the rows of a file into the store.
+
+        :param fname: name of the file the rows are read from
+        :param rows: key, key values and row of each row of the file
+        :param data_field_list: fields of the rows to merge
+        :param output_keys: names of the output key columns
+        :param fields: output fields once the file is merged
+        """
+        self.output_keys = output_keys
+        for key, key_values, row in rows:
+            entry = self._data.get(key)
+            if entry is None:
+                entry = self._data[key] = split_key_values(key_values, output_keys)
+            for data_field in data_field_list:
+                data_value = row[data_field]
+                if data_value:
+                    entry[data_field] = merge_value(
+                        entry.get(data_field), data_value, self.keep, self.all_delimiter
+                    )
+        self.fields = fields
+        logger.debug("...total unique entries is now %d", len(self._data))
+
+    def entries(self) -> Iterator[Mapping[str, str]]:
+        """
+        :return: iterator over the key column values and fields of each entry,
+            in the order the keys were first merged
+        """
+        return iter(self._data.values())
+
+
+class SqliteMergeStore(MergeStore):
+    """
+    Store of the entries merged by csv-merge held in a SQLite database,
+    so that merges need not fit in memory.
+
+    Rows are inserted in batches, with each value merged into the value
+    already kept by an UPSERT, and each file is merged in a single
+    transaction which also records the file as merged. A merge into a
+    database that is kept can so be carried on after it is interrupted,
+    or with further files, with the files already merged skipped
+    (except stdin, which is merged every time).
+    """
+
+    def __init__(
+        self,
+        keep: str,
+        all_delimiter: str,
+        normalize: Iterable[str] = (),
+        path: Optional[str] = None,
+        batch_rows: int = DEFAULT_BATCH_ROWS,
+    ) -> None:
+        """
+        :param keep: how to handle multiple values for the same field, one of KEEP_MODES
+        :param all_delimiter: delimiter between values when keep is "all" or "uniq"
+        :param normalize: normalizations applied to the keys, from NORMALIZE_MODES
+        :param path: path of the database, if None a temporary database is used
+            which is deleted when the store is closed
+        :param batch_rows: number of rows to insert at a time
+        :raises ValueError: if the database holds a merge with different
+            keep, all_delimiter or normalize settings
+        """
+        super().__init__(keep, all_delimiter, normalize)
+        self.batch_rows = batch_rows
+        self._tmpdir: Optional[tempfile.TemporaryDirectory[str]] = None
+        if path is None:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix="csv-merge-")
+            path = os.path.join(self._tmpdir.name, "merge.sqlite")
+        self.path = path
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.create_function(
+            "merge_uniq",
+            2,
+            lambda old, new: merge_value(old, new, "uniq", all_delimiter),
+            deterministic=True,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"PRAGMA cache_size=-{CACHE_KIB}")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS keys (
+                seq INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, key_values TEXT
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT, field TEXT, value TEXT, PRIMARY KEY (key, field)
+            ) WITHOUT ROWID;
+            """)
+        try:
+            self._load_meta()
+        except ValueError:
+            self.close()
+            raise
+
+    def _load_meta(self) -> None:
+        meta = {
+            name: json.loads(value)
+            for name, value in self._db.execute("SELECT name, value FROM meta")
+        }
+        self._merged = {name for (name,) in self._db.execute("SELECT name FROM files")}
+        if not meta:
+            return
+        settings = (meta["keep"], meta["all_delimiter"], meta["normalize"])
+        if settings != (self.keep, self.all_delimiter, self.normalize):
+            raise ValueError(
+                f'"{self.path}" holds a merge with keep={settings[0]!r}, '
+                f"all_delimiter={settings[1]!r} and normalize={settings[2]!r}"
+            )
+        self.output_keys = meta["output_keys"]
+        self.fields = meta["fields"]
+        logger.info(
+            'continuing the merge in "%s" of %d files', self.path, len(self._merged)
+        )
+
+    def close(self) -> None:
+        self._db.close()
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+
+    def is_merged(self, fname: str) -> bool:
+        return fname != "-" and os.path.abspath(fname) in self._merged
+
+    def _upsert_sql(self) -> str:
+        update = {
+            "first": "NOTHING",
+            "last": "UPDATE SET value = excluded.value",
+            "all": "UPDATE SET value = value || ? || excluded.value",
+            "uniq": "UPDATE SET value = merge_uniq(value, excluded.value)",
+        }[self.keep]
+        return (
+            "INSERT INTO entries (key, field, value) VALUES (?, ?, ?) "
+            f"ON CONFLICT (key, field) DO {update}"
+        )
+
+    def merge(
+        self,
+        fname: str,
+        rows: Iterable[KeyedRow],
+        data_field_list: List[str],
+        output_keys: List[str],
+        fields: List[str],
+    ) -> None:
+        upsert = self._upsert_sql()
+        extra = (self.all_delimiter,) if self.keep == "all" else ()
+        self._db.execute("BEGIN")
+        try:
+            for batch in _batched(rows, self.batch_rows):
+                # the key values are only kept when they differ from the key
+                self._db.executemany(
+                    "INSERT INTO keys (key, key_values) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO NOTHING",
+                    (
+                        (key, None if key_values == key else key_values)
+                        for key, key_values, _ in batch
+                    ),
+                )
+                self._db.executemany(
+                    upsert,
+                    (
+                        (key, data_field, row[data_field]) + extra
+                        for key, _, row in batch
+                        for data_field in data_field_list
+                        if row[data_field]
+                    ),
+                )
+            if fname != "-":
+                self._db.execute(
+                    "INSERT OR IGNORE INTO files (name) VALUES (?)",
+                    (os.path.abspath(fname),),
+                )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                (
+                    (name, json.dumps(value))
+                    for name, value in (
+                        ("keep", self.keep),
+                        ("all_delimiter", self.all_delimiter),
+                        ("normalize", self.normalize),
+                        ("output_keys", output_keys),
+                        ("fields", fields),
+                    )
+                ),
+            )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self.output_keys = output_keys
+        self.fields = fields
+        # counting the keys scans the table, so is skipped unless it is logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "...total unique entries is now %d",
+                self._db.execute("SELECT count(*) FROM keys").fetchone()[0],
+            )
+
+    def entries(self) -> Iterator[Mapping[str, str]]:
+        cursor = self._db.execute("""
+            SELECT keys.seq, coalesce(keys.key_values, keys.key),
+                entries.field, entries.value
+            FROM keys LEFT JOIN entries ON entries.key = keys.key
+            ORDER BY keys.seq
+            """)
+        for _, group in itertools.groupby(cursor, lambda x: x[0]):
+            rows = list(group)
+            entry = split_key_values(rows[0][1], self.output_keys)
+            entry.update((field, value) for _, _, field, value in rows if field)
+            yield entry
+
+
+def _batched(rows: Iterable[KeyedRow], size: int) -> Iterator[List[KeyedRow]]:
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def open_merge_store(
+    store: str, keep: str, all_delimiter: str, normalize: Iterable[str] = ()
+) -> MergeStore:
+    """
+    Open the store for a csv-merge.
+
+    :param store: "memory", "sqlite" for a temporary SQLite database,
+        or "sqlite:PATH" for a SQLite database kept at PATH
+    :param keep: how to handle multiple values for the same field, one of KEEP_MODES
+    :param all_delimiter: delimiter between values when keep is "all" or "uniq"
+    :param normalize: normalizations applied to the keys, from NORMALIZE_MODES
+    :return: the store, which should be closed once the merge is written
+    :raises ValueError: if the store is not recognised, or a kept database
+        holds a merge with different settings
+    """
+    kind, _, path = store.partition(":")
+    if kind == "memory" and not path:
+        return MergeStore(keep, all_delimiter, normalize)
+    if kind == "sqlite":
+        return SqliteMergeStore(keep, all_delimiter, normalize, path=path or None)
+    raise ValueError(f'unknown store "{store}", expected memory, sqlite or sqlite:PATH')
@@ -0,0 +1,62 @@
+import logging
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Generator, Iterable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def ordered_map(
+    func: Callable[[T], R],
+    iterable: Iterable[T],
+    jobs: int = 1,
+    initializer: Callable[..., None] | None = None,
+    initargs: tuple[Any, ...] = (),
+    window: int | None = None,
+) -> Generator[R, None, None]:
+    """
+    Apply func to each item using a pool of worker processes,
+    yielding the results in the same order as the items.
+
+    Unlike Executor.map, items are only taken from the iterable as
+    results are consumed, with at most window items in flight at once,
+    so a large or streaming iterable is never held in memory in full.
+
+    If jobs is 1 the items are processed in this process without a pool,
+    and the initializer (which is only run in worker processes) is not called.
+
+    :param func: function to apply, must be picklable (i.e. defined at module level)
+    :param iterable: items to apply the function to
+    :param jobs: number of worker processes
+    :param initializer: function called at the start of each worker process
+    :param initargs: arguments for the initializer
+    :param window: maximum number of items in flight (default=2*jobs)
+    :return: generator of the results, closing it shuts down the worker processes
+    """
+    if jobs <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    # imported here as it pulls in multiprocessing, which is slow to import
+    from concurrent.futures import ProcessPoolExecutor
+
+    if window is None:
+        window = 2 * jobs
+    logger.debug("starting %d worker processes", jobs)
+    executor = ProcessPoolExecutor(
+        max_workers=jobs, initializer=initializer, initargs=initargs
+    )
+    try:
+        futures: deque[Future[R]] = deque()
+        for item in iterable:
+            if len(futures) >= window:
+                yield futures.popleft().result()
+            futures.append(executor.submit(func, item))
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
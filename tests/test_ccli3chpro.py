@@ -1,9 +1,13 @@
+import json
 import logging
 import os
 
+import pytest
 from click.testing import CliRunner
 
-from malcolm3utils.scripts.ccli2chpro import cli
+from malcolm3utils.scripts.ccli2chpro import WordCache, cli, convert_lyric_line
+
+from .conftest import example_ccli
 
 logger = logging.getLogger()
 logging.basicConfig(level=logging.DEBUG)
@@ -17,16 +21,35 @@ EXPECTED_HELP = """Usage: ccli2chpro [OPTIONS] input_file
   through to your CCLI license number. Paste this into a text file and run this
   command using that file as the input_file.
 
-  The output is written to that file with the extension changed to chordpro.
+  The output is written to that file with the extension changed to chordpro, in
+  the same directory as the input file unless --output-dir is specified. If the
+  input_file is '-' then stdin is converted and written to stdout.
+
+  Use --jobs to convert a large number of files in parallel. When converting
+  more than one file a summary is written to stderr.
+
+  Use --word-cache to keep the dictionary checks of lyric words between runs,
+  which speeds up large batch conversions.
+
+  Use --split to convert input files containing many songs one after the other.
+  Each song runs from its 'SongSelect logo' line through to its 'CCLI License #'
+  line and is written to a separate file with the song number appended to the
+  name, e.g. songs-001.chordpro (or song-001.chordpro when reading from stdin).
 
   This script attempts to 'fix' everything, but inevitably there will be things
   it gets wrong, so plan on checking the output for correctness. No guarantees
   are given or implied.
 
 Options:
-  --version            Show the version and exit.
-  -v, --verbosity LVL  Either CRITICAL, ERROR, WARNING, INFO or DEBUG.
-  --help               Show this message and exit.
+  -j, --jobs INTEGER RANGE  number of files (or songs with --split) to convert
+                            in parallel  [default: 1; x>=1]
+  --split                   split input files containing multiple songs into one
+                            output file per song
+  --output-dir DIRECTORY    directory to write the output files to
+  --word-cache FILE         file to load dictionary checks from and save them to
+  --version                 Show the version and exit.
+  -v, --verbosity LVL       Either CRITICAL, ERROR, WARNING, INFO or DEBUG.
+  --help                    Show this message and exit.
 """
 
 EXPECTED_OUTPUT = """{title: Build My Life}
@@ -115,3 +138,132 @@ def test_ccli2chrpo_cli(tmp_ccli_files):
             result.stdout
             == f"Exception '{EXPECTED_ERROR[i]}' encountered processing {bad_input_file.name}: skipping file.\n"
         )
+        assert not bad_input_file.with_suffix(".chordpro").exists()
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_ccli2chrpo_cli_batch(tmp_ccli_files, jobs):
+    tmpdir, input_file, *bad_input_files = tmp_ccli_files
+    output_dir = tmpdir / "output"
+    word_cache_file = tmpdir / "words.json"
+    os.chdir(str(tmpdir))
+    runner = CliRunner()
+
+    input_names = [input_file.name, *[x.name for x in bad_input_files]]
+    result = runner.invoke(
+        cli,
+        [
+            "--jobs",
+            jobs,
+            "--output-dir",
+            output_dir.name,
+            "--word-cache",
+            word_cache_file.name,
+            *input_names,
+        ],
+    )
+    assert result.exit_code == 0
+    assert not input_file.with_suffix(".chordpro").exists()
+    with (output_dir / "ccli.chordpro").open("r") as fh:
+        assert fh.read() == EXPECTED_OUTPUT
+    assert result.stdout == "".join(
+        f"Exception '{error}' encountered processing {bad_input_file.name}: skipping file.\n"
+        for error, bad_input_file in zip(EXPECTED_ERROR, bad_input_files)
+    )
+    assert "Converted 1 files (6 failed)" in result.stderr
+    with word_cache_file.open() as fh:
+        words = json.load(fh)
+    assert words["song"] is True
+    assert words["bove"] is False
+
+
+def test_ccli2chrpo_cli_stdin(tmp_ccli_files):
+    tmpdir, input_file, *bad_input_files = tmp_ccli_files
+    os.chdir(str(tmpdir))
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ["--jobs", "2", "-"], input=example_ccli)
+    assert result.exit_code == 0
+    assert result.stdout == EXPECTED_OUTPUT
+
+    result = runner.invoke(cli, ["-"], input=bad_input_files[0].read_text())
+    assert result.exit_code == 0
+    assert result.stdout == ""
+    assert result.stderr == (
+        f"Exception '{EXPECTED_ERROR[0]}' encountered processing -: skipping file.\n"
+    )
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_ccli2chrpo_cli_split(tmp_ccli_files, jobs):
+    tmpdir, input_file, *bad_input_files = tmp_ccli_files
+    output_dir = tmpdir / "output"
+    songs_file = tmpdir / "songs.txt"
+    bad_song = bad_input_files[4].read_text()
+    unfinished_song = bad_input_files[5].read_text()
+    songs_file.write_text(
+        f"preamble\n{example_ccli}\n{bad_song}\n{example_ccli}{example_ccli}"
+        f"{unfinished_song}"
+    )
+    os.chdir(str(tmpdir))
+    runner = CliRunner()
+
+    result = runner.invoke(
+        cli,
+        ["--split", "--jobs", jobs, "--output-dir", output_dir.name, songs_file.name],
+    )
+    assert result.exit_code == 0
+    assert result.stdout == (
+        f"Exception '{EXPECTED_ERROR[4]}' encountered processing "
+        f"song 2 of {songs_file.name}: skipping song.\n"
+        f"Exception '{EXPECTED_ERROR[5]}' encountered processing "
+        f"song 5 of {songs_file.name}: skipping song.\n"
+    )
+    assert "Converted 3 songs (2 failed)" in result.stderr
+    assert sorted(x.name for x in output_dir.iterdir()) == [
+        "songs-001.chordpro",
+        "songs-003.chordpro",
+        "songs-004.chordpro",
+    ]
+    for output_file in output_dir.iterdir():
+        assert output_file.read_text() == EXPECTED_OUTPUT
+
+    result = runner.invoke(cli, ["--split", "-"], input=example_ccli)
+    assert result.exit_code == 0
+    assert result.stdout == ""
+    assert (tmpdir / "song-001.chordpro").read_text() == EXPECTED_OUTPUT
+
+
+@pytest.mark.parametrize(
+    "line,expected",
+    [
+        ("Cmaj7Holy | Fmaj7", "[Cmaj7]Holy [|] [Fmaj7]"),
+        ("G/BAll Am7  Dsus4", "[G/B]All [Am7]  [Dsus4]"),
+        ("Bbm7 bove", "[Bbm7] bove"),
+        ("Ebove", "[Eb]ove"),
+        ("And/F#", "And/[F#]"),
+    ],
+)
+def test_convert_lyric_line(line, expected):
+    assert convert_lyric_line(line) == expected
+
+
+def test_word_cache(tmp_path):
+    word_cache = WordCache(maxsize=2)
+    assert word_cache.check("song")
+    assert not word_cache.check("bove")
+    assert word_cache.check("song")
+    assert word_cache.pop_new_words() == {"song": True, "bove": False}
+    assert word_cache.pop_new_words() == {}
+    assert word_cache.check("breath")
+    assert list(word_cache.words) == ["song", "breath"]
+
+    word_cache_file = tmp_path / "words.json"
+    word_cache.save(word_cache_file)
+    word_cache = WordCache()
+    word_cache.load(tmp_path / "missing.json")
+    assert not word_cache.words
+    word_cache.load(word_cache_file)
+    assert word_cache.words == {"song": True, "breath": True}
+    assert word_cache.check("song")
+    assert word_cache.new_words == {}
@@ -1,6 +1,44 @@
+import bz2
+import csv
+import gzip
+import io
+import lzma
 import os
+import stat
+import threading
 
-from malcolm3utils.utils.csvio import read_csv_data, read_keyed_csv_data
+import pytest
+
+from malcolm3utils.utils.csvcache import (
+    DEFAULT_CACHE_MAX_BYTES,
+    CsvCache,
+    KeyedCsvCacheInfo,
+    KeyedCsvMemo,
+    cached_read_keyed_csv_data,
+    keyed_csv_memo,
+)
+from malcolm3utils.utils.csvindex import (
+    CsvIndex,
+    csv_index_path,
+    iter_csv_key_rows,
+    iter_csv_rows,
+)
+from malcolm3utils.utils.csvio import (
+    INFER_ONCE,
+    CsvBlockWriter,
+    CsvChunkReader,
+    CsvRow,
+    CsvRowReader,
+    _cached_dtypes,
+    _dtype_key,
+    iter_csv_data,
+    open_csv_output,
+    open_csv_reader,
+    parse_column_spec,
+    read_csv_data,
+    read_keyed_csv_data,
+    resolve_column_spec,
+)
 
 
 def test_csv(tmp_csv_files):
@@ -21,3 +59,624 @@ def test_csv(tmp_csv_files):
     assert data2 is not None
     assert len(data2) == 2
     assert data2[111][0]["A"] == 111
+
+
+@pytest.mark.parametrize(
+    "suffix,compress",
+    [
+        ("", lambda x: x),
+        (".gz", gzip.compress),
+        (".bz2", bz2.compress),
+        (".xz", lzma.compress),
+    ],
+)
+def test_open_csv_reader(tmp_csv_files, tmp_path, suffix, compress):
+    csv_file = tmp_path / f"test.csv{suffix}"
+    csv_file.write_bytes(compress(tmp_csv_files[0].read_bytes()))
+
+    with open_csv_reader(csv_file) as reader:
+        rows = list(reader)
+    assert rows[0] == ["A", "B", "C and D", "E", "S", "X"]
+    assert rows[2] == ["121", "122", "123", "124", "b", "False"]
+
+    with open_csv_reader(csv_file, as_rows=True, buffer_size=16) as reader:
+        rows = list(reader)
+    assert len(rows) == 2
+    assert rows[1]["C and D"] == "123"
+
+
+def test_csv_row_reader(tmp_path):
+    csv_file = tmp_path / "test.csv"
+    csv_file.write_text("A,B,C\n1,2,3\n\n4,5\n")
+
+    with open_csv_reader(csv_file, as_rows=True) as reader:
+        assert reader.fieldnames == ["A", "B", "C"]
+        rows = list(reader)
+        assert reader.line_num == 4
+        project = reader.projector(["C", "X", "A"])
+    assert len(rows) == 2
+    assert isinstance(rows[0], CsvRow)
+    assert list(rows[0]) == ["A", "B", "C"]
+    assert len(rows[0]) == 3
+    assert rows[0] == {"A": "1", "B": "2", "C": "3"}
+    assert rows[1]["C"] is None
+    assert rows[1].get("X") is None
+    assert repr(rows[1]) == "CsvRow({'A': '4', 'B': '5', 'C': None})"
+    assert project(rows[0]) == ["3", "", "1"]
+    assert project(rows[1]) == ["", "", "4"]
+    with pytest.raises(AttributeError):
+        rows[0].extra = 1
+
+
+def test_column_spec():
+    column_list = parse_column_spec("2,C,4-5,X-Y,Z")
+    assert column_list == [1, "C", 3, 4, "X-Y", "Z"]
+    assert resolve_column_spec(column_list, ["A", "B", "C", "X-Y"]) == [
+        1,
+        2,
+        3,
+        4,
+        3,
+    ]
+
+
+def test_csv_chunk_reader():
+    rows = ["1,plain", '2,"quoted, with ""quotes"""', '3,"multi\nline"', "4,last"]
+    header = 'A,"B\nheader"\n'
+    data = (header + "\n".join(rows)).encode()
+
+    for chunk_bytes in [1, 5, 12, 1000]:
+        reader = CsvChunkReader(io.BytesIO(data), chunk_bytes=chunk_bytes)
+        assert reader.fieldnames == ["A", "B\nheader"]
+        chunks = list(reader)
+        assert b"".join(chunks) == "\n".join(rows).encode()
+        parsed = [
+            row
+            for chunk in chunks
+            for row in CsvRowReader(
+                io.StringIO(chunk.decode(), newline=""), fieldnames=reader.fieldnames
+            )
+        ]
+        assert [x["A"] for x in parsed] == ["1", "2", "3", "4"]
+        assert parsed[2]["B\nheader"] == "multi\nline"
+        if chunk_bytes == 1000:
+            assert len(chunks) == 1
+
+    reader = CsvChunkReader(io.BytesIO(b"A,B"))
+    assert reader.fieldnames == ["A", "B"]
+    assert list(reader) == []
+    reader = CsvChunkReader(io.BytesIO(b""))
+    assert reader.fieldnames is None
+
+
+@pytest.mark.parametrize("chunk_bytes", [1, 16, 1000])
+def test_csv_chunk_reader_stray_quotes(chunk_bytes):
+    # a quote inside an unquoted field is an ordinary character for csv.reader
+    text = (
+        "id,name,n\n"
+        + "".join(f"{i},n{i},{i}\n" for i in range(5))
+        + '5,pipe 12" long,7\n6,"a ""b"" c"x",8\n7,"multi\nline",9\n'
+        + "".join(f"{i},n{i},{i}\n" for i in range(8, 40))
+    )
+    reader = CsvChunkReader(io.BytesIO(text.encode()), chunk_bytes=chunk_bytes)
+    chunks = list(reader)
+    assert max(len(x) for x in chunks) < chunk_bytes + 40
+    parsed = [
+        row
+        for chunk in chunks
+        for row in csv.reader(io.StringIO(chunk.decode(), newline=""))
+    ]
+    assert parsed == list(csv.reader(io.StringIO(text, newline="")))[1:]
+
+
+def test_csv_chunk_reader_long_rows():
+    long_field = "x" * 5000
+    data = f'A,B\n1,"{long_field}\n{long_field}"\n2,z\n'.encode()
+    chunks = list(CsvChunkReader(io.BytesIO(data), chunk_bytes=100))
+    assert b"".join(chunks) == data[4:]
+    assert chunks[0].startswith(data[4:-4])
+    header = f'"{long_field}",B\n1,2\n'.encode()
+    reader = CsvChunkReader(io.BytesIO(header), chunk_bytes=100)
+    assert reader.fieldnames == [long_field, "B"]
+
+    # a quoted field that is never closed
+    unclosed = b'A,B\n1,"open\n' + b"2,z\n" * 1000
+    reader = CsvChunkReader(io.BytesIO(unclosed), chunk_bytes=100, max_row_bytes=500)
+    with pytest.raises(ValueError, match="never closed"):
+        list(reader)
+    with pytest.raises(ValueError, match="never closed"):
+        CsvChunkReader(io.BytesIO(unclosed[4:]), chunk_bytes=100, max_row_bytes=500)
+
+
+class CountingBytesIO(io.BytesIO):
+    writes = 0
+
+    def write(self, data):  # type: ignore[no-untyped-def]
+        self.writes += 1
+        return super().write(data)
+
+
+INDEX_TEST_INPUT = (
+    "K,V,W\r\n"
+    + "".join(
+        f'k{i % 4},"{i}\n{i}",x\r\n' if i % 5 == 0 else f"k{i % 4},{i},x\r\n"
+        for i in range(23)
+    )
+    + "\r\nk1,short\r\n"
+)
+
+
+@pytest.fixture
+def index_csv(tmp_path):
+    csv_file = tmp_path / "index.csv"
+    csv_file.write_bytes(INDEX_TEST_INPUT.encode())
+    return csv_file
+
+
+def test_csv_index(index_csv):
+    with open_csv_reader(index_csv, as_rows=True) as reader:
+        all_rows = [dict(x) for x in reader]
+    assert len(all_rows) == 24
+
+    index = CsvIndex.build(index_csv, every=5, key_column="K")
+    assert index.rows == 24
+    assert index.fieldnames == ["K", "V", "W"]
+    assert len(index.row_offsets) == 5
+    assert index.keys == ["k0", "k1", "k2", "k3"]
+    assert CsvIndex.load(index_csv) is None
+    assert index.save() == csv_index_path(index_csv)
+    assert index_csv.with_name("index.csv.idx").exists()
+
+    loaded = CsvIndex.load(index_csv)
+    assert loaded is not None
+    assert loaded.info == index.info
+    assert loaded.row_offsets == index.row_offsets
+    assert list(loaded.keys) == index.keys
+    assert loaded.keys[-1] == "k3"
+    assert loaded.key_starts == index.key_starts
+    assert loaded.key_offsets == index.key_offsets
+    for start, stop in [(0, None), (3, 4), (5, 12), (9, 100), (23, None)]:
+        rows = [dict(x) for x in loaded.iter_rows(start, stop)]
+        assert rows == all_rows[start:stop], (start, stop)
+    assert list(loaded.iter_rows(24)) == []
+    assert list(loaded.iter_rows(7, 7)) == []
+
+    for key in ["k0", "k1", "k2", "k3"]:
+        rows = [dict(x) for x in loaded.iter_key_rows(key)]
+        assert rows == [x for x in all_rows if x["K"] == key]
+    assert [dict(x) for x in loaded.iter_key_rows("k1")][-1] == {
+        "K": "k1",
+        "V": "short",
+        "W": None,
+    }
+    assert list(loaded.iter_key_rows("k")) == []
+    assert list(loaded.iter_key_rows("k9")) == []
+
+    # changing the file makes the index out of date
+    with index_csv.open("ab") as fh:
+        fh.write(b"k5,5,x\r\n")
+    assert CsvIndex.load(index_csv) is None
+    index_csv.unlink()
+    assert not loaded.is_current()
+
+
+def test_csv_index_without_key(index_csv, tmp_path):
+    index = CsvIndex.build(index_csv, every=100)
+    assert index.key_column is None
+    assert list(index.iter_key_rows("k1")) == []
+    index.save()
+    loaded = CsvIndex.load(index_csv)
+    assert loaded is not None
+    assert list(loaded.keys) == []
+    assert len(list(loaded.iter_rows())) == 24
+
+    empty_csv = tmp_path / "empty.csv"
+    empty_csv.write_bytes(b"")
+    index = CsvIndex.build(empty_csv)
+    assert (index.fieldnames, index.rows) == ([], 0)
+    assert list(index.iter_rows()) == []
+
+    # a quoted field left open at the end of the file is still a row
+    unterminated_csv = tmp_path / "unterminated.csv"
+    unterminated_csv.write_bytes(b'A,B\n1,"2\n')
+    index = CsvIndex.build(unterminated_csv, key_column="B")
+    assert index.keys == ["2\n"]
+
+
+def test_csv_index_errors(index_csv, tmp_path):
+    with pytest.raises(ValueError, match="no column"):
+        CsvIndex.build(index_csv, key_column="X")
+    compressed_csv = tmp_path / "index.csv.gz"
+    compressed_csv.write_bytes(gzip.compress(INDEX_TEST_INPUT.encode()))
+    with pytest.raises(ValueError, match="compressed"):
+        CsvIndex.build(compressed_csv)
+
+
+@pytest.mark.parametrize("mode", [0o644, 0o640, 0o755])
+def test_csv_index_mode(index_csv, mode):
+    index_csv.chmod(mode)
+    index_path = CsvIndex.build(index_csv).save()
+    assert stat.S_IMODE(index_path.stat().st_mode) == mode & 0o666
+
+
+def test_csv_index_stray_quote(tmp_path):
+    # rows are found as csv.reader finds them, even with a quote in an unquoted field
+    csv_file = tmp_path / "stray.csv"
+    csv_file.write_text(
+        "id,name,n\n"
+        + "".join(f"{i},n{i},{i}\n" for i in range(5))
+        + '5,pipe 12" long,7\n6,"multi\nline ""q""",8\n'
+        + "".join(f"{i},n{i},{i}\n" for i in range(7, 3000))
+    )
+    with open_csv_reader(csv_file, as_rows=True) as reader:
+        all_rows = [dict(x) for x in reader]
+    index = CsvIndex.build(csv_file, every=7, key_column="id")
+    assert index.rows == len(all_rows) == 3000
+    assert [dict(x) for x in index.iter_rows()] == all_rows
+    for key in ["4", "5", "6", "2999"]:
+        assert [dict(x) for x in index.iter_key_rows(key)] == [all_rows[int(key)]]
+
+
+@pytest.mark.parametrize("truncate", [None, 20, -100, -1])
+def test_csv_index_unreadable(index_csv, truncate, caplog):
+    index_path = CsvIndex.build(index_csv, key_column="K").save()
+    data = index_path.read_bytes()
+    # a file from another tool, or a damaged index, is ignored like a stale one
+    index_path.write_bytes(b"not an index" if truncate is None else data[:truncate])
+    assert CsvIndex.load(index_csv) is None
+    assert "ignoring unreadable index" in caplog.text
+    with open_csv_reader(index_csv, as_rows=True) as reader:
+        expected = [dict(x) for x in reader if x["K"] == "k3"]
+    assert [dict(x) for x in iter_csv_key_rows(index_csv, "K", "k3")] == expected
+    index_path.write_bytes(b"")
+    assert CsvIndex.load(index_csv) is None
+
+
+def test_csv_index_numbers(tmp_path):
+    keys = ["1", "01", "1.0", "a", "nan", "0", "-0.0", "1e999", "9" * 400]
+    keys += ["12345678901234567891", "12345678901234567890", "2"]
+    csv_file = tmp_path / "numbers.csv"
+    csv_file.write_text("K,V\n" + "".join(f"{x},{i}\n" for i, x in enumerate(keys)))
+    index = CsvIndex.build(csv_file, key_column="K")
+    index.save()
+    loaded = CsvIndex.load(csv_file)
+    assert loaded is not None
+    assert list(loaded.numbers) == list(index.numbers)
+    assert list(loaded.number_keys) == list(index.number_keys)
+    for number, expected in [
+        (1, ["1", "01", "1.0"]),
+        (1.0, ["1", "01", "1.0"]),
+        (0, ["0", "-0.0"]),
+        (12345678901234567891, ["12345678901234567891"]),
+        (float("inf"), ["1e999"]),
+        (int("9" * 400), ["9" * 400]),
+        (-int("9" * 400), []),
+        (float("nan"), []),
+        (3, []),
+    ]:
+        for found in (index, loaded):
+            with found.open_row_bytes(found.find_number(number)) as fh:
+                rows = fh.read().decode().splitlines()
+            assert [x.split(",")[0] for x in rows] == expected, number
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+def test_iter_csv_rows(index_csv, indexed):
+    if indexed:
+        CsvIndex.build(index_csv, every=4, key_column="K").save()
+    rows = [x["V"] for x in iter_csv_rows(index_csv, 2, 6)]
+    assert rows == ["2", "3", "4", "5\n5"]
+    rows = [x["V"] for x in iter_csv_key_rows(index_csv, "K", "k2")]
+    assert rows == ["2", "6", "10\n10", "14", "18", "22"]
+    rows = [x["K"] for x in iter_csv_key_rows(index_csv, "V", "short")]
+    assert rows == ["k1"]
+
+
+def test_csv_block_writer():
+    fh = CountingBytesIO()
+    writer = CsvBlockWriter(fh, delimiter="|", flush_bytes=20, batch_rows=2)
+    writer.writerows([i, i * 2] for i in range(10))
+    assert fh.writes == 2
+    writer.write("done\n")
+    writer.flush()
+    assert fh.writes == 3
+    writer.flush()
+    assert fh.writes == 3
+    assert fh.getvalue().decode().splitlines()[-2:] == ["9|18", "done"]
+
+    fh = CountingBytesIO()
+    writer = CsvBlockWriter(fh, flush_seconds=0)
+    writer.writerow(["a", "b c"])
+    writer.writerow(["d", "e,f"])
+    assert fh.writes == 2
+    assert fh.getvalue() == b'a,b c\r\nd,"e,f"\r\n'
+
+
+@pytest.mark.parametrize("suffix", ["", ".gz", ".xz"])
+def test_open_csv_output(tmp_path, suffix):
+    csv_file = tmp_path / f"test.csv{suffix}"
+    rows = [["A", "B"]] + [[str(i), str(-i)] for i in range(100)]
+    with open_csv_output(csv_file, buffer_size=64) as writer:
+        writer.writerows(rows)
+    with open_csv_reader(csv_file) as reader:
+        assert list(reader) == rows
+
+
+def test_iter_csv_data(tmp_csv_files):
+    data = list(iter_csv_data(tmp_csv_files[0], chunksize=1))
+    assert data == read_csv_data(tmp_csv_files[0])
+    assert data[0]["X"] == 1
+    assert data[1]["X"] == 0
+
+    data = list(iter_csv_data(tmp_csv_files[2], skiprows=[1]))
+    assert len(data) == 1
+    assert data[0]["A"] == 321.1
+
+
+def test_read_keyed_csv_data_options(tmp_csv_files):
+    data = read_keyed_csv_data(tmp_csv_files[0], "A", skiprows=[1])
+    assert list(data) == [121]
+
+    data = read_keyed_csv_data(tmp_csv_files[0], "A", skiprows=[1], multiple=True)
+    assert list(data) == [121]
+
+    data = read_keyed_csv_data(tmp_csv_files[0], "S", usecols=["B"], chunksize=1)
+    assert data == {"a": {"B": 112, "S": "a"}, "b": {"B": 122, "S": "b"}}
+
+    frame = read_keyed_csv_data(tmp_csv_files[0], "A", as_frame=True)
+    assert frame.loc[121, "S"] == "b"
+    assert frame.loc[121, "X"] == 0
+
+    frame = read_keyed_csv_data(
+        tmp_csv_files[0], "X", usecols=["S"], as_frame=True, multiple=True
+    )
+    assert list(frame.columns) == ["S"]
+    assert frame.loc[True, "S"] == "a"
+
+
+def test_read_keyed_csv_data_duplicates(tmp_path):
+    csv_file = tmp_path / "dups.csv"
+    csv_file.write_text("K,V\n1,a\n2,b\n1,c\n")
+
+    data = read_keyed_csv_data(csv_file, "K", chunksize=1)
+    assert data == {1: {"K": 1, "V": "c"}, 2: {"K": 2, "V": "b"}}
+
+    data = read_keyed_csv_data(csv_file, "K", multiple=True, chunksize=1)
+    assert [x["V"] for x in data[1]] == ["a", "c"]
+
+    frame = read_keyed_csv_data(csv_file, "K", as_frame=True)
+    assert len(frame) == 2
+    assert frame.loc[1, "V"] == "c"
+
+
+def test_read_keyed_csv_data_chunk_types(tmp_path):
+    csv_file = tmp_path / "types.csv"
+    csv_file.write_text(
+        "K,V,W\n" + "".join(f"{x},{x},{x}\n" for x in range(5)) + "7,,5\nx,3,0.5\n"
+    )
+
+    data = read_keyed_csv_data(csv_file, "K", chunksize=3)
+    # the same types as reading in one go (compared by repr as V is nan for 7)
+    assert repr(data) == repr(read_keyed_csv_data(csv_file, "K", chunksize=None))
+    assert repr(data) == repr(read_keyed_csv_data(csv_file, "K"))
+    assert set(data) == {"0", "1", "2", "3", "4", "7", "x"}
+    assert [type(x["V"]) for x in data.values()] == [float] * 7
+    assert [type(x["W"]) for x in data.values()] == [float] * 7
+
+    data = read_keyed_csv_data(csv_file, "K", chunksize=3, dtype=INFER_ONCE)
+    assert set(data) == {"0", "1", "2", "3", "4", "7", "x"}
+    assert str(_cached_dtypes(_dtype_key(csv_file))["K"]) == "object"
+    data = read_keyed_csv_data(csv_file, "K", chunksize=3, dtype=INFER_ONCE)
+    assert data["7"]["V"] != data["7"]["V"]
+
+
+@pytest.mark.parametrize("multiple", [False, True])
+def test_read_keyed_csv_data_chunk_floats(tmp_path, multiple):
+    csv_file = tmp_path / "floats.csv"
+    csv_file.write_text(
+        "K,V,S\n" + "".join(f"{x},{x},s{x}\n" for x in range(5)) + "5.5,,t\n"
+    )
+
+    # integers in the first chunks only become floats without reading again
+    data = read_keyed_csv_data(csv_file, "K", multiple=multiple, chunksize=2)
+    expected = read_keyed_csv_data(csv_file, "K", multiple=multiple, chunksize=None)
+    assert repr(data) == repr(expected)
+    assert [type(x) for x in data] == [float] * 6
+    rows = [x[0] for x in data.values()] if multiple else list(data.values())
+    assert [type(x["V"]) for x in rows] == [float] * 6
+    assert rows[0]["S"] == "s0"
+
+    data = read_keyed_csv_data(csv_file, "S", multiple=multiple, chunksize=2)
+    expected = read_keyed_csv_data(csv_file, "S", multiple=multiple, chunksize=None)
+    assert repr(data) == repr(expected)
+
+
+def test_csv_dtype(tmp_csv_files):
+    data = read_csv_data(tmp_csv_files[0], usecols=["A", "X"], dtype={"A": str})
+    assert data == [{"A": "111", "X": 1}, {"A": "121", "X": 0}]
+
+    data = read_keyed_csv_data(tmp_csv_files[0], "A", usecols=["B"], dtype={"B": str})
+    assert data[111] == {"A": 111, "B": "112"}
+
+
+def test_csv_dtype_infer_once(tmp_csv_files):
+    csv_file = tmp_csv_files[2]
+    first = read_csv_data(csv_file, dtype=INFER_ONCE)
+    dtypes = _cached_dtypes(_dtype_key(csv_file))
+    assert str(dtypes["A"]) == "float64"
+    assert str(dtypes["X"]) == "bool"
+    assert read_csv_data(csv_file, dtype=INFER_ONCE) == first
+
+    # chunks can't change the types once they have been inferred
+    data = list(iter_csv_data(csv_file, chunksize=1, dtype=INFER_ONCE))
+    assert data[0]["A"] == 311.0
+    assert isinstance(data[0]["A"], float)
+
+    frame = read_keyed_csv_data(csv_file, "S", dtype=INFER_ONCE, as_frame=True)
+    assert frame.loc["f", "A"] == 321.1
+
+    # changing the file discards the previously inferred types
+    with csv_file.open("a") as fh:
+        fh.write("331,332,333,334,g,True\n")
+    os.utime(csv_file, ns=(0, os.stat(csv_file).st_mtime_ns + 1))
+    list(iter_csv_data(csv_file, chunksize=1, dtype=INFER_ONCE))
+    assert _cached_dtypes(_dtype_key(csv_file)) is None
+
+    list(iter_csv_data(csv_file, dtype=INFER_ONCE))
+    assert str(_cached_dtypes(_dtype_key(csv_file))["A"]) == "float64"
+
+
+def test_csv_dtype_infer_once_restricted(tmp_path):
+    csv_file = tmp_path / "types.csv"
+    csv_file.write_text("K,V\n1,1\n2,2\n3,x\n")
+
+    # types inferred without the last row would not suit it
+    assert read_csv_data(csv_file, skiprows=[3], dtype=INFER_ONCE)[1]["V"] == 2
+    list(iter_csv_data(csv_file, usecols=["V"], dtype=INFER_ONCE))
+    assert _cached_dtypes(_dtype_key(csv_file)) is None
+    assert read_csv_data(csv_file, dtype=INFER_ONCE)[2]["V"] == "x"
+    assert str(_cached_dtypes(_dtype_key(csv_file))["V"]) in ("object", "str")
+
+
+def test_csv_cache(tmp_csv_files, tmp_path):
+    cache = CsvCache(tmp_path / "cache")
+    csv_file = tmp_csv_files[0]
+    data = read_csv_data(csv_file, cache=cache)
+    cache_path = cache.cache_path(csv_file, dtype=None, skiprows=None, usecols=None)
+    assert cache_path is not None
+    assert cache_path.exists()
+    assert read_csv_data(csv_file, cache=cache) == data
+
+    # different read options are cached separately
+    data = read_keyed_csv_data(csv_file, "A", usecols=["S"], cache=cache)
+    assert data == {111: {"A": 111, "S": "a"}, 121: {"A": 121, "S": "b"}}
+    assert read_keyed_csv_data(csv_file, "A", usecols=["S"], cache=cache) == data
+    assert len(list(cache.cache_dir.glob("*.pkl"))) == 2
+
+    frame = read_keyed_csv_data(csv_file, "A", as_frame=True, cache=cache)
+    frame = read_keyed_csv_data(csv_file, "A", as_frame=True, cache=cache)
+    assert frame.loc[121, "X"] == 0
+
+    # a callable skiprows is never cached
+    data = read_csv_data(csv_file, skiprows=lambda x: x == 1, cache=cache)
+    assert len(data) == 1
+    assert len(list(cache.cache_dir.glob("*.pkl"))) == 3
+
+    # a changed file is not loaded from the cache
+    with csv_file.open("a") as fh:
+        fh.write("131,132,133,134,c,True\n")
+    os.utime(csv_file, ns=(0, os.stat(csv_file).st_mtime_ns + 1))
+    assert len(read_csv_data(csv_file, cache=cache)) == 3
+
+
+def test_csv_cache_store_failure(tmp_csv_files, tmp_path, monkeypatch):
+    import pandas as pd
+
+    def fail_to_pickle(*args, **kwargs):  # type: ignore[no-untyped-def]
+        raise OSError("No space left on device")
+
+    cache = CsvCache(tmp_path / "cache")
+    monkeypatch.setattr(pd.DataFrame, "to_pickle", fail_to_pickle)
+    with pytest.raises(OSError):
+        read_csv_data(tmp_csv_files[0], cache=cache)
+    assert list(cache.cache_dir.iterdir()) == []
+
+
+def test_csv_cache_eviction(tmp_csv_files, tmp_path):
+    cache = CsvCache(tmp_path / "cache", max_bytes=0)
+    read_csv_data(tmp_csv_files[0], cache=cache)
+    assert list(cache.cache_dir.glob("*.pkl")) == []
+
+    cache.max_bytes = DEFAULT_CACHE_MAX_BYTES
+    for csv_file in tmp_csv_files:
+        read_csv_data(csv_file, cache=cache)
+    cache_paths = [
+        cache.cache_path(x, dtype=None, skiprows=None, usecols=None)
+        for x in tmp_csv_files
+    ]
+    os.utime(cache_paths[0], ns=(0, 1))
+    cache.max_bytes = sum(x.stat().st_size for x in cache_paths[1:])
+    cache.evict()
+    assert [x.exists() for x in cache_paths] == [False, True, True]
+
+
+def test_cached_read_keyed_csv_data(tmp_csv_files):
+    csv_file = tmp_csv_files[0]
+    keyed_csv_memo.invalidate()
+    start_info = keyed_csv_memo.cache_info()
+
+    data = cached_read_keyed_csv_data(csv_file, "A")
+    assert data[111]["S"] == "a"
+    assert cached_read_keyed_csv_data(csv_file, "A") is data
+    with pytest.raises(TypeError):
+        data[111]["S"] = "z"
+
+    multiple_data = cached_read_keyed_csv_data(
+        csv_file, "X", skiprows=[1], multiple=True
+    )
+    assert [x["A"] for x in multiple_data[0]] == [121]
+    assert isinstance(multiple_data[0], tuple)
+
+    info = keyed_csv_memo.cache_info()
+    assert info.hits - start_info.hits == 1
+    assert info.misses - start_info.misses == 2
+    assert info.currsize == 2
+
+    # a changed file is re-read
+    with csv_file.open("a") as fh:
+        fh.write("131,132,133,134,c,True\n")
+    os.utime(csv_file, ns=(0, os.stat(csv_file).st_mtime_ns + 1))
+    data = cached_read_keyed_csv_data(csv_file, "A")
+    assert data[131]["S"] == "c"
+    assert keyed_csv_memo.cache_info().reloads - start_info.reloads == 1
+
+    keyed_csv_memo.invalidate(csv_file)
+    assert keyed_csv_memo.cache_info().currsize == 0
+
+
+def test_keyed_csv_memo_eviction(tmp_csv_files):
+    memo = KeyedCsvMemo(maxsize=2)
+    for csv_file in tmp_csv_files:
+        memo.read(csv_file, "A")
+    memo.read(tmp_csv_files[2], "A")
+    assert memo.cache_info() == KeyedCsvCacheInfo(1, 3, 0, 1, 2, 2)
+
+
+def test_keyed_csv_memo_concurrent(tmp_csv_files, monkeypatch):
+    import malcolm3utils.utils.csvcache as csvcache
+
+    memo = KeyedCsvMemo()
+    slow_file, other_file = tmp_csv_files[0], tmp_csv_files[1]
+    other_data = memo.read(other_file, "A")
+
+    started = threading.Event()
+    release = threading.Event()
+    reads = []
+    real_read_keyed_csv_data = csvcache.read_keyed_csv_data
+
+    def slow_read_keyed_csv_data(csv_file, *args, **kwargs):  # type: ignore[no-untyped-def]
+        reads.append(csv_file)
+        started.set()
+        release.wait(10)
+        return real_read_keyed_csv_data(csv_file, *args, **kwargs)
+
+    monkeypatch.setattr(csvcache, "read_keyed_csv_data", slow_read_keyed_csv_data)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(memo.read(slow_file, "A")))
+        for _ in range(3)
+    ]
+    threads[0].start()
+    assert started.wait(10)
+    for thread in threads[1:]:
+        thread.start()
+    # other files are still returned while the slow file is being read
+    assert memo.read(other_file, "A") is other_data
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(reads) == 1
+    assert len(results) == 3
+    assert all(x is results[0] for x in results)
+    assert memo.cache_info() == KeyedCsvCacheInfo(3, 2, 0, 0, memo.maxsize, 2)
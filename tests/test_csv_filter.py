@@ -1,11 +1,15 @@
 import logging
 import os
+import resource
 from csv import DictReader
 
+import pytest
 from click.testing import CliRunner
 
-from malcolm3utils.scripts.csv_filter import cli
-from malcolm3utils.utils.filter_parser import create_filter
+from malcolm3utils.scripts.csv_filter import _filter_chunk, cli
+from malcolm3utils.utils import filter_parser
+from malcolm3utils.utils.csvindex import CsvIndex
+from malcolm3utils.utils.filter_parser import create_filter, equality_lookups
 
 logger = logging.getLogger()
 logging.basicConfig(level=logging.DEBUG)
@@ -23,22 +27,60 @@ EXPECTED_HELP = """Usage: csv-filter [OPTIONS] FILTER_EXPRESSION csv_file
 
   Available operators are:
   +, -, *, /, %, //, ==, !=, <, <=, >, >=, not, and, or
+  in and not in, e.g. S in ('a', 'b', 3) checks S is one of the values
+  ~ matches a field against a regular expression, e.g. S ~ '^[ab]'
   String literals can be specified using single quotes.
   Field names with spaces should be surrounded by double quotes.
 
-  If no csv_files are specified, read from stdin.
+  If no csv_files are specified, or a csv_file is '-', read from stdin.
 
   If no --output specified, write to stdout.
 
-  Input files do not all have to have the same columns. The output will have all
-  columns. To achieve this all csv_files are opened at program initiation. This
-  may cause problems with your system's open file limit if you are attempting to
-  filter a large number of files at once.
+  With --columns only the given columns are written, using the same column_spec
+  as getcol (a comma separated list of column headers, column indexes (one-
+  based) or column ranges such as 4-6), with the indexes referring to the
+  columns of all the files.
+
+  Input files do not all have to have the same columns. The output has the
+  columns of all the files, or just those selected with --columns, left empty
+  for the rows of files without them. To achieve this the header of every
+  csv_file is read first, and then each csv_file is opened in turn as it is
+  filtered, so any number of files can be filtered at once.
+
+  If a csv_file has an index built by csv-index --key-column, and the expression
+  requires that column to equal one of some values (e.g. "id == 42" or "id in
+  ('a', 'b') and age > 4"), only the rows with those values are read from it
+  rather than the whole file.
+
+  With --jobs greater than 1 each file is split into chunks of whole rows which
+  are filtered in parallel by that many worker processes, with the output rows
+  kept in their original order.
+
+  To look at just some of the matching rows:
+  --limit N      stop reading the inputs once N rows have been written
+  --sample P     write each matching row with probability P
+  --sample-n N   write N matching rows chosen at random, in their
+                 original order (this has to read all the inputs)
+  --count        print the number of matching rows instead of the rows
+  --seed makes the sampling repeatable.
 
 Options:
   --keep / --discard           keep or discard entries for which the expression
                                is true (default=keep)
-  --output PATH                output file name
+  --output PATH                output file name (compressed if it ends in .gz,
+                               .bz2, .xz or .zst)
+  -c, --columns COLUMN_SPEC    columns to write (default=all)
+  -j, --jobs INTEGER RANGE     number of worker processes to filter with
+                               [default: 1; x>=1]
+  --limit INTEGER RANGE        stop once this many rows have been written
+                               [x>=0]
+  --sample FLOAT RANGE         probability of writing each matching row
+                               [0<=x<=1]
+  --sample-n INTEGER RANGE     number of matching rows to choose at random
+                               [x>=0]
+  --seed INTEGER               seed for the random sampling
+  --count                      print the number of matching rows instead of the
+                               rows
   -d, --delimiter TEXT         column delimiter  [default: ,]
   -o, --output-delimiter TEXT  output column delimiter (default=input delimiter)
   --version                    Show the version and exit.
@@ -212,6 +254,36 @@ EXPRESSION_TESTS = [
         "filter_expression": "1.5 + 1.5 == 3",
         "expected_result": True,
     },
+    {
+        "title": "testing in",
+        "filter_expression": "S in ('b', 'a') and A in (-1, 1.0, 'x')",
+        "expected_result": True,
+    },
+    {
+        "title": "testing in with an expression",
+        "filter_expression": "A + B in (3)",
+        "expected_result": True,
+    },
+    {
+        "title": "testing not in",
+        "filter_expression": "S not in ('b', 'c') and not A not in (1)",
+        "expected_result": True,
+    },
+    {
+        "title": "testing not in when in the set",
+        "filter_expression": "E not in (3, 4)",
+        "expected_result": False,
+    },
+    {
+        "title": "testing regular expression match",
+        "filter_expression": r"""S ~ '^[a-c]$' and "C and D" ~ '\d'""",
+        "expected_result": True,
+    },
+    {
+        "title": "testing regular expression mismatch",
+        "filter_expression": "S ~ 'b'",
+        "expected_result": False,
+    },
 ]
 
 
@@ -228,6 +300,34 @@ def test_filter_parser():
         ), f"{expression_test['title']}: failed"
 
 
+@pytest.mark.parametrize(
+    "filter_expression,expected",
+    [
+        ("A == 1", {"A": {1}}),
+        ("'x' == S and B in (1, -2, 'y')", {"S": {"x"}, "B": {1, -2, "y"}}),
+        ('(A in (1, 2) and "C and D" == 2 + 1) and A == 2', {"A": {2}, "C and D": {3}}),
+        ("A == 1 and A == 2", {"A": set()}),
+        ("(A == 1)", {"A": {1}}),
+        ("(A == 1 or B == 1) and C == 1", {"C": {1}}),
+        ("A == 1 or B == 2", {}),
+        ("not A == 1", {}),
+        ("A == B", {}),
+        ("A + 1 == 2", {}),
+        ("A == 1 / 0", {}),
+        ("S ~ 'x' and A != 1", {}),
+    ],
+)
+def test_equality_lookups(filter_expression, expected):
+    assert equality_lookups(filter_expression) == expected
+
+
+def test_filter_parser_large_set():
+    values = [f"'v{i}'" for i in range(200)]
+    filter_function = create_filter(f"S in ({', '.join(values)})")
+    assert filter_function({"S": "v199"})
+    assert not filter_function({"S": "v200"})
+
+
 def test_filter_cli(tmp_csv_files):
     tmpdir = tmp_csv_files[0].parent
     filenames = [x.name for x in tmp_csv_files]
@@ -257,3 +357,247 @@ def test_filter_cli(tmp_csv_files):
     assert data[0]["A"] == "111"
     assert data[1]["A"] == "211"
     assert data[2]["A"] == "311"
+
+
+@pytest.mark.parametrize("keep", ["--keep", "--discard"])
+def test_filter_cli_jobs(tmp_csv_files, keep):
+    tmpdir = tmp_csv_files[0].parent
+    quoted_csv = tmpdir.joinpath("quoted.csv")
+    quoted_csv.write_text(
+        'A,"multi\nline",S\n'
+        + "".join(f'{i},"{i}\n""{i}""",{i % 3}\n' for i in range(500))
+    )
+    filenames = [str(x) for x in tmp_csv_files] + [str(quoted_csv)]
+
+    runner = CliRunner()
+    outputs = []
+    for jobs in ["1", "2"]:
+        output_csv = tmpdir.joinpath(f"output{jobs}.csv")
+        result = runner.invoke(
+            cli,
+            ["--jobs", jobs, keep, "--output", str(output_csv), "A % 2 == 1"]
+            + filenames,
+        )
+        assert result.exit_code == 0
+        outputs.append(output_csv.read_text())
+    assert outputs[0] == outputs[1]
+    with open(tmpdir.joinpath("output2.csv"), newline="") as fh:
+        data = list(DictReader(fh))
+    assert len(data) == (5 + 250 if keep == "--keep" else 1 + 250)
+    assert list(data[0]) == ["A", "B", "C and D", "E", "S", "X", "F", "multi\nline"]
+
+
+def test_filter_chunk():
+    text = _filter_chunk(
+        ("A > 1", True, ["A", "B"], ["B", "C", "A"], ",", "|", b'1,x\n2,"y\nz"\n3')
+    )
+    assert text == '"y\nz"||2\r\n||3\r\n'
+
+
+def test_filter_cli_many_files(tmp_path):
+    csv_files = []
+    for i in range(300):
+        csv_file = tmp_path / f"shard{i}.csv"
+        csv_file.write_text(f"A,B{i % 3}\n{i},x\n")
+        csv_files.append(str(csv_file))
+    output_csv = tmp_path / "output.csv"
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(128, hard), hard))
+    try:
+        result = CliRunner().invoke(
+            cli, ["--output", str(output_csv), "A % 100 == 0"] + csv_files
+        )
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert result.exit_code == 0
+    assert output_csv.read_text().splitlines() == [
+        "A,B0,B1,B2",
+        "0,x,,",
+        "100,,x,",
+        "200,,,x",
+    ]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_filter_cli_stdin_and_files(tmp_csv_files, jobs):
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ["--jobs", jobs, "B % 100 == 22", str(tmp_csv_files[0]), "-"],
+        input=tmp_csv_files[2].read_text(),
+    )
+    assert result.exit_code == 0
+    assert result.stdout.splitlines() == [
+        "A,B,C and D,E,S,X,F",
+        "121,122,123,124,b,False,",
+        "321.1,322,323,,f,False,324",
+    ]
+
+
+@pytest.fixture
+def numbers_csv(tmp_path):
+    numbers_csv = tmp_path / "numbers.csv"
+    numbers_csv.write_text("A,B\n" + "".join(f"{i},{i % 3}\n" for i in range(500)))
+    return numbers_csv
+
+
+def run_filter(*args: str) -> list[str]:
+    result = CliRunner().invoke(cli, list(args))
+    assert result.exit_code == 0, result.output
+    return result.stdout.splitlines()
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_filter_cli_limit(numbers_csv, jobs):
+    lines = run_filter("--jobs", jobs, "--limit", "3", "B == 1", str(numbers_csv))
+    assert lines == ["A,B", "1,1", "4,1", "7,1"]
+    lines = run_filter("--jobs", jobs, "--limit", "0", "B == 1", str(numbers_csv))
+    assert lines == ["A,B"]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_filter_cli_count(numbers_csv, jobs):
+    assert run_filter("--jobs", jobs, "--count", "B == 1", str(numbers_csv)) == ["167"]
+    assert run_filter(
+        "--jobs", jobs, "--count", "--limit", "10", "B == 1", str(numbers_csv)
+    ) == ["10"]
+    assert run_filter(
+        "--jobs", jobs, "--count", "--discard", "B == 1", str(numbers_csv)
+    ) == ["333"]
+
+
+@pytest.mark.parametrize("sample_option", ["--sample", "--sample-n"])
+def test_filter_cli_sample(numbers_csv, sample_option):
+    sample_value = "0.1" if sample_option == "--sample" else "20"
+    outputs = [
+        run_filter(
+            "--jobs",
+            jobs,
+            sample_option,
+            sample_value,
+            "--seed",
+            "42",
+            "B != 2",
+            str(numbers_csv),
+        )
+        for jobs in ["1", "2"]
+    ]
+    assert outputs[0] == outputs[1]
+    lines = outputs[0]
+    assert lines[0] == "A,B"
+    values = [int(x.split(",")[0]) for x in lines[1:]]
+    assert values == sorted(values)
+    assert all(x % 3 != 2 for x in values)
+    if sample_option == "--sample-n":
+        assert len(values) == 20
+    else:
+        assert 0 < len(values) < 100
+    assert (
+        run_filter(
+            sample_option, sample_value, "--seed", "7", "B != 2", str(numbers_csv)
+        )
+        != lines
+    )
+
+
+def test_filter_cli_sample_all_or_none(numbers_csv):
+    everything = run_filter("B == 0", str(numbers_csv))
+    assert run_filter("--sample", "1", "B == 0", str(numbers_csv)) == everything
+    assert run_filter("--sample-n", "1000", "B == 0", str(numbers_csv)) == everything
+    assert run_filter("--sample", "0", "B == 0", str(numbers_csv)) == ["A,B"]
+    assert run_filter("--sample-n", "0", "B == 0", str(numbers_csv)) == ["A,B"]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [["--sample", "0.5", "--sample-n", "5"], ["--count", "--output", "out.csv"]],
+)
+def test_filter_cli_conflicting_options(numbers_csv, options):
+    result = CliRunner().invoke(cli, options + ["B == 0", str(numbers_csv)])
+    assert result.exit_code == 2
+    assert "can not be used together" in result.stderr
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_filter_cli_columns(tmp_csv_files, jobs):
+    lines = run_filter(
+        "--jobs",
+        jobs,
+        "--columns",
+        "F,1,S,missing,6-7,0",
+        "B % 100 == 12",
+        *[str(x) for x in tmp_csv_files],
+    )
+    assert lines == [
+        "F,A,S,X,F",
+        ",111,a,True,",
+        ",211,c,True,",
+        "314,311,e,True,314",
+    ]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_filter_cli_indexed(tmp_path, jobs, caplog):
+    indexed_csv = tmp_path / "indexed.csv"
+    indexed_csv.write_text(
+        "K,V\n"
+        + "".join(f'{i % 7},"{i}\n"\n' for i in range(50))
+        + "1.0,x\n01,y\na,z\n"
+    )
+    plain_csv = tmp_path / "plain.csv"
+    plain_csv.write_text(indexed_csv.read_text())
+    CsvIndex.build(indexed_csv, every=8, key_column="K").save()
+
+    for filter_args, uses_index in [
+        (["K == 1"], True),
+        (["K in (3, 'a') and V != 'z'"], True),
+        (["K == 'a'"], True),
+        (["K == 8"], True),
+        (["--discard", "K == 1"], False),
+        (["V == 'x'"], False),
+    ]:
+        expected = run_filter(*filter_args, str(plain_csv))
+        caplog.clear()
+        result = CliRunner().invoke(
+            cli, ["--jobs", jobs, "-v", "DEBUG", *filter_args, str(indexed_csv)]
+        )
+        assert result.exit_code == 0
+        assert result.stdout.splitlines() == expected, filter_args
+        assert ("through its index" in caplog.text) == uses_index, filter_args
+    assert run_filter("K == 1", str(indexed_csv))[-2:] == ["1.0,x", "01,y"]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_filter_cli_indexed_stray_quote(tmp_path, jobs, caplog):
+    # a quote inside an unquoted field must not throw the index out of step
+    lines = [f"{i},n{i},{i % 7}\n" for i in range(300)]
+    lines[5] = '5,pipe 12" long,7\n'
+    lines[9] = '9,"multi\nline",2\n'
+    plain_csv = tmp_path / "plain.csv"
+    plain_csv.write_text("id,name,n\n" + "".join(lines))
+    indexed_csv = tmp_path / "indexed.csv"
+    indexed_csv.write_text(plain_csv.read_text())
+    CsvIndex.build(indexed_csv, every=16, key_column="id").save()
+
+    for expression in ["id == 100", "id == 5", "id in (4, 9, 299)", "id == 9.0"]:
+        caplog.clear()
+        result = CliRunner().invoke(
+            cli, ["--jobs", jobs, "-v", "DEBUG", expression, str(indexed_csv)]
+        )
+        assert result.exit_code == 0
+        assert "through its index" in caplog.text
+        expected = run_filter(expression, str(plain_csv))
+        assert len(expected) > 1
+        assert result.stdout.splitlines() == expected, expression
+
+
+def test_filter_cli_unindexed_lookups(tmp_csv_files, monkeypatch):
+    # the expression is only analysed for lookups once an input has an index
+    def fail(filter_spec):
+        raise AssertionError("equality_lookups called")
+
+    monkeypatch.setattr(filter_parser, "equality_lookups", fail)
+    assert run_filter("A == 111", *[str(x) for x in tmp_csv_files])[1:] == [
+        "111,112,113,114,a,True,"
+    ]
@@ -0,0 +1,36 @@
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from malcolm3utils.scripts.csv_index import cli
+from malcolm3utils.utils.csvindex import CsvIndex, csv_index_path, iter_csv_key_rows
+
+from .conftest import TEST_INPUT
+
+
+def test_csv_index(tmp_path: Path) -> None:
+    csv_files = [tmp_path / "a.csv", tmp_path / "b.csv"]
+    for csv_file in csv_files:
+        csv_file.write_text(TEST_INPUT)
+
+    result = CliRunner().invoke(
+        cli, ["--every", "10", "--key-column", "B"] + [str(x) for x in csv_files]
+    )
+    assert result.exit_code == 0
+    for csv_file in csv_files:
+        assert csv_index_path(csv_file).exists()
+        index = CsvIndex.load(csv_file)
+        assert index is not None
+        assert (index.every, index.rows, index.key_column) == (10, 1, "B")
+        assert [dict(x) for x in iter_csv_key_rows(csv_file, "B", "2")] == [
+            {"A": "1", "B": "2", "C": "3", "D": "4"}
+        ]
+
+
+def test_csv_index_errors(tmp_path: Path) -> None:
+    csv_file = tmp_path / "a.csv"
+    csv_file.write_text(TEST_INPUT)
+    result = CliRunner().invoke(cli, ["--key-column", "X", str(csv_file)])
+    assert result.exit_code == 1
+    assert 'has no column "X"' in result.stderr
+    assert not csv_index_path(csv_file).exists()
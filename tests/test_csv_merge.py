@@ -1,4 +1,5 @@
 import logging
+import os
 from datetime import datetime
 from pathlib import Path
 from typing import List, TypedDict
@@ -7,6 +8,12 @@ import pytest
 from click.testing import CliRunner
 
 from malcolm3utils.scripts.csv_merge import cli
+from malcolm3utils.utils.csvio import open_csv_reader
+from malcolm3utils.utils.merge_store import (
+    SqliteMergeStore,
+    canonical_number,
+    key_function,
+)
 
 from .utils import os_independent_text_equals
 
@@ -25,9 +32,16 @@ EXPECTED_HELP = """Usage: csv-merge [OPTIONS] [FILES_TO_READ]...
   Merge the specified delimited files with column headings, joining entries with
   the same key field value.
 
-  The files do not need to be sorted on the key field as with join(1). This does
-  require that all of the data be read into memory. If that is a problem, using
-  the system join(1) command is recommended.
+  The files do not need to be sorted on the key field as with join(1). By
+  default this requires that all of the data be read into memory. If that is a
+  problem, use --store sqlite to merge the data in a temporary SQLite database
+  on disk instead, or the system join(1) command.
+
+  With --store sqlite:PATH the database is kept at PATH, recording each file as
+  it is merged, so an interrupted merge can be carried on by running the same
+  command again, or further files merged into it later. Files already merged
+  into the database are skipped, and the output includes all of the entries in
+  the database.
 
   Rows will be printed in the order that the unique key values are encountered
   when reading through the input files.
@@ -41,28 +55,47 @@ EXPECTED_HELP = """Usage: csv-merge [OPTIONS] [FILES_TO_READ]...
   those files have a column with the same name as the output key column, that
   will be ignored.
 
+  A composite key is specified by joining the key column identifiers with '+'
+  (e.g. -k 'last+first'), and the output key columns will then be the first
+  columns of the output file. Each file must have the same number of key
+  columns. With --normalize the key values are normalized before they are
+  matched, e.g. with '--normalize strip --normalize numeric' the keys ' 007' and
+  '7' match. The output key values are those first read for each key.
+
 Options:
-  -v, --verbosity LVL           Either CRITICAL, ERROR, WARNING, INFO or DEBUG.
-  -d, --delimiter TEXT          column delimiter  [default: ,]
-  -o, --output-delimiter TEXT   output column delimiter (default=input
-                                delimiter)
-  --all-delimiter TEXT          when keep=="all" this will be the delimiter
-                                between entries where there are multiple
-                                (default=";")
-  -k, --key-column TEXT         comma separated list of key column identifiers.
-                                each new file will use the next identifier. the
-                                last identifier will be used for all remaining
-                                files, so just use "-k identifier" if the
-                                identifier is the same for all files. The
-                                identifier can either be the header string or
-                                the one-based column index. (default=1 (i.e. the
-                                first column of each file))
-  --keep [first|last|uniq|all]  specifies how to handle multiple values for the
-                                same field with the same key
-  -I, --ignore TEXT             comma separated list of column identifiers to
-                                ignore
-  --version                     Show the version and exit.
-  --help                        Show this message and exit.
+  -v, --verbosity LVL             Either CRITICAL, ERROR, WARNING, INFO or
+                                  DEBUG.
+  -d, --delimiter TEXT            column delimiter  [default: ,]
+  -o, --output-delimiter TEXT     output column delimiter (default=input
+                                  delimiter)
+  --all-delimiter TEXT            when keep=="all" this will be the delimiter
+                                  between entries where there are multiple
+                                  (default=";")
+  -k, --key-column TEXT           comma separated list of key column
+                                  identifiers. each new file will use the next
+                                  identifier. the last identifier will be used
+                                  for all remaining files, so just use "-k
+                                  identifier" if the identifier is the same for
+                                  all files. The identifier can either be the
+                                  header string or the one-based column index,
+                                  or several of these joined with '+' for a
+                                  composite key. (default=1 (i.e. the first
+                                  column of each file))
+  --keep [first|last|uniq|all]    specifies how to handle multiple values for
+                                  the same field with the same key
+  -I, --ignore TEXT               comma separated list of column identifiers to
+                                  ignore
+  -N, --normalize [strip|casefold|numeric]
+                                  normalize the key values before matching them:
+                                  strip surrounding whitespace, casefold to
+                                  ignore case, or numeric to match numbers by
+                                  value (e.g. 007 and 7.0 match 7). may be
+                                  repeated
+  --store TEXT                    where to hold the merged entries: memory,
+                                  sqlite (a temporary database) or sqlite:PATH
+                                  (a database kept at PATH)  [default: memory]
+  --version                       Show the version and exit.
+  --help                          Show this message and exit.
 """
 
 FILE1 = """Key,F1,F2
@@ -324,3 +357,214 @@ def test_merge(tmp_files: List[Path]) -> None:
     )
     assert result.exit_code == 0
     assert os_independent_text_equals(result.output, EXPECTED_UNIQ)
+
+
+@pytest.mark.parametrize(
+    "args,expected",
+    [
+        (["-k", "Key"], EXPECTED_ALL),
+        (["-k", "Key", "--keep", "first"], EXPECTED_FIRST),
+        (["-k", "Key", "--keep", "last"], EXPECTED_LAST),
+        (["-k", "Key,AltKey"], EXPECTED_ALL_ALTKEY),
+        (["-k", "Key", "-I", "F1,AltKey"], EXPECTED_ALL_IGNORE),
+    ],
+)
+def test_merge_sqlite(tmp_files: List[Path], args: List[str], expected: str) -> None:
+    result = CliRunner().invoke(
+        cli, ["--store", "sqlite", *args, str(tmp_files[0]), str(tmp_files[1])]
+    )
+    assert result.exit_code == 0
+    assert os_independent_text_equals(result.output, expected)
+
+
+def test_merge_sqlite_uniq(tmp_files: List[Path]) -> None:
+    file3 = str(tmp_files[2])
+    file5 = str(tmp_files[4])
+    result = CliRunner().invoke(
+        cli, ["--store", "sqlite", "-k", "X", "--keep", "uniq", file3, file3, file5]
+    )
+    assert result.exit_code == 0
+    assert os_independent_text_equals(result.output, EXPECTED_UNIQ)
+
+
+def test_merge_sqlite_batches(tmp_files: List[Path], tmp_path: Path, caplog) -> None:
+    caplog.set_level(logging.DEBUG, logger="malcolm3utils.utils.merge_store")
+    store = SqliteMergeStore("all", ";", batch_rows=2)
+    with store:
+        with open_csv_reader(tmp_files[0], as_rows=True) as reader:
+            store.merge(
+                "file1",
+                ((row["Key"], row["Key"], row) for row in reader),
+                ["F1", "F2"],
+                ["Key"],
+                ["Key", "F1", "F2"],
+            )
+        assert list(store.entries()) == [
+            {"Key": "a", "F1": "1af1", "F2": "1af2"},
+            {"Key": "b", "F1": "1bf1", "F2": "1bf2"},
+            {"Key": "c", "F1": "1cf1"},
+            {"Key": "d", "F2": "1df2"},
+        ]
+        assert "total unique entries is now 4" in caplog.text
+        with pytest.raises(KeyError):
+            store.merge("file3", [("x", "x", {})], ["F1"], ["Key"], ["Key", "F1"])
+        assert len(list(store.entries())) == 4
+    assert not os.path.exists(store.path)
+
+
+def test_merge_sqlite_resume(tmp_files: List[Path], tmp_path: Path, caplog) -> None:
+    runner = CliRunner()
+    file1 = str(tmp_files[0])
+    file2 = str(tmp_files[1])
+    store = f"sqlite:{tmp_path / 'merge.sqlite'}"
+
+    result = runner.invoke(cli, ["--store", store, "-k", "Key", file1])
+    assert result.exit_code == 0
+    assert os_independent_text_equals(result.output, FILE1)
+
+    # file1 is skipped, so is not merged twice
+    with caplog.at_level(logging.INFO):
+        result = runner.invoke(
+            cli, ["--store", store, "-k", "Key", file1, "-"], input=FILE2
+        )
+    assert result.exit_code == 0
+    assert "continuing the merge" in caplog.messages[0]
+    assert caplog.messages[1].startswith(f'"{file1}" has already been merged')
+    # info messages are echoed to stdout
+    stdout = result.stdout.split("\n", 1)[1]
+    assert os_independent_text_equals(stdout, EXPECTED_ALL)
+
+    result = runner.invoke(cli, ["--store", store, "--keep", "last", file2])
+    assert result.exit_code == 1
+    assert "holds a merge with keep='all'" in result.output
+
+
+def test_merge_bad_store(tmp_files: List[Path]) -> None:
+    for store in ["disk", "memory:x"]:
+        result = CliRunner().invoke(cli, ["--store", store, str(tmp_files[0])])
+        assert result.exit_code == 1
+        assert f'unknown store "{store}"' in result.output
+
+
+PEOPLE1 = """last,first,age
+Smith,John,40
+smith ,Jane,31
+Jones,John,22
+"""
+
+PEOPLE2 = """surname,given,id,town
+SMITH,john,007,Leeds
+Jones,john,12,York
+Smith,Jane,,Hull
+Brown,Bob,1,Bath
+,,2,Nowhere
+"""
+
+PEOPLE3 = """code,a+b,value
+7.0,x,1
+7,y,2
+"""
+
+EXPECTED_COMPOSITE = """last,first,age,id,town
+Smith,John,40,,
+smith ,Jane,31,,
+Jones,John,22,,
+SMITH,john,,007,Leeds
+Jones,john,,12,York
+Smith,Jane,,,Hull
+Brown,Bob,,1,Bath
+"""
+
+EXPECTED_NORMALIZED = """last,first,age,id,town
+Smith,John,40,007,Leeds
+smith ,Jane,31,,Hull
+Jones,John,22,12,York
+Brown,Bob,,1,Bath
+"""
+
+
+@pytest.mark.parametrize("store", ["memory", "sqlite"])
+@pytest.mark.parametrize(
+    "normalize,expected",
+    [
+        ([], EXPECTED_COMPOSITE),
+        (["-N", "strip", "-N", "casefold"], EXPECTED_NORMALIZED),
+    ],
+)
+def test_merge_composite_key(
+    tmp_path: Path, store: str, normalize: List[str], expected: str
+) -> None:
+    people1 = tmp_path / "people1.csv"
+    people1.write_text(PEOPLE1)
+    people2 = tmp_path / "people2.csv"
+    people2.write_text(PEOPLE2)
+    result = CliRunner().invoke(
+        cli,
+        [
+            "--store",
+            store,
+            "-k",
+            "last+2,surname+given",
+            *normalize,
+            str(people1),
+            str(people2),
+        ],
+    )
+    assert result.exit_code == 0
+    output_lines = result.output.split("\n")
+    assert output_lines.pop(0).startswith("warning: No key value found for line 6")
+    assert os_independent_text_equals("\n".join(output_lines), expected)
+
+
+def test_merge_key_columns(tmp_path: Path) -> None:
+    people1 = tmp_path / "people1.csv"
+    people1.write_text(PEOPLE1)
+    people3 = tmp_path / "people3.csv"
+    people3.write_text(PEOPLE3)
+    runner = CliRunner()
+
+    # a column named with a "+" is a single key column
+    result = runner.invoke(cli, ["-k", "a+b", str(people3)])
+    assert result.exit_code == 0
+    assert os_independent_text_equals(result.output, "a+b,code,value\nx,7.0,1\ny,7,2\n")
+
+    result = runner.invoke(cli, ["-k", "code", "-N", "numeric", str(people3)])
+    assert result.exit_code == 0
+    assert os_independent_text_equals(result.output, "code,a+b,value\n7.0,x;y,1;2\n")
+
+    result = runner.invoke(cli, ["-k", "last+first,code", str(people1), str(people3)])
+    assert result.exit_code == 0
+    output_lines = result.output.split("\n")
+    assert output_lines.pop(0).startswith(
+        'warning: Key "code" of file "' + str(people3) + '" has 1 columns rather than 2'
+    )
+    assert os_independent_text_equals("\n".join(output_lines), PEOPLE1)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("007", "7"),
+        ("-0", "0"),
+        ("7.0", "7"),
+        ("7e0", "7"),
+        ("0.50", "0.5"),
+        ("12345678901234567890", "12345678901234567890"),
+        ("seven", "seven"),
+        ("", ""),
+    ],
+)
+def test_canonical_number(value: str, expected: str) -> None:
+    assert canonical_number(value) == expected
+
+
+def test_key_function() -> None:
+    row = {"a": " A ", "b": "007", "c": None}
+    assert key_function(["a"])(row) == (" A ", " A ")
+    assert key_function(["c"])(row) == ("", "")
+    assert key_function(["a", "b"], ["casefold", "strip"])(row) == (
+        "a\x1f007",
+        " A \x1f007",
+    )
+    assert key_function(["b", "c"], ["numeric"])(row) == ("7\x1f", "007\x1f")
+    assert key_function(["c", "c"], ["strip"])(row) == ("", "\x1f")
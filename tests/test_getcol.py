@@ -1,3 +1,4 @@
+import gzip
 from pathlib import Path
 
 from click.testing import CliRunner
@@ -52,3 +53,14 @@ def test_getcol(tmp_file: Path) -> None:
     )
     assert result.exit_code == 0
     assert os_independent_text_equals(result.output, "B|D\n2|4\n")
+
+
+def test_getcol_compressed(tmp_path: Path) -> None:
+    gz_file = tmp_path.joinpath("test.csv.gz")
+    gz_file.write_bytes(gzip.compress(TEST_INPUT.encode()))
+    runner = CliRunner()
+
+    # noinspection PyTypeChecker
+    result = runner.invoke(cli, ["B,4", str(gz_file)])
+    assert result.exit_code == 0
+    assert os_independent_text_equals(result.output, "B,D\n2,4\n")
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import malcolm3utils
+
+SCRIPT_MODULES = [
+    "malcolm3utils.scripts.ccli2chpro",
+    "malcolm3utils.scripts.client",
+    "malcolm3utils.scripts.csv_diff",
+    "malcolm3utils.scripts.csv_filter",
+    "malcolm3utils.scripts.csv_index",
+    "malcolm3utils.scripts.csv_merge",
+    "malcolm3utils.scripts.getcol",
+    "malcolm3utils.scripts.serve",
+    "malcolm3utils.scripts.touch_latest",
+]
+
+# dependencies that are slow to import, and so should only be imported
+# by the code paths that use them
+HEAVY_MODULES = ["pandas", "numpy", "lark", "enchant", "multiprocessing"]
+
+
+def imported_modules(module: str) -> dict[str, int]:
+    """
+    Import the module in a fresh interpreter with -X importtime.
+
+    :param module: module to import
+    :return: cumulative import time in microseconds keyed by each module imported
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = str(Path(malcolm3utils.__file__).parent.parent)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            modules[parts[2].strip()] = int(parts[1])
+    return modules
+
+
+@pytest.mark.parametrize("module", SCRIPT_MODULES)
+def test_script_import_time(module):
+    modules = imported_modules(module)
+    assert module in modules
+    heavy = [x for x in modules if x.split(".")[0] in HEAVY_MODULES]
+    assert heavy == [], f"{module} imports {heavy} taking {modules[module]}us"
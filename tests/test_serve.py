@@ -0,0 +1,259 @@
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import click
+import pytest
+from click.testing import CliRunner
+
+import malcolm3utils
+from malcolm3utils.scripts.client import (
+    REQUEST_LENGTH,
+    SOCKET_ENV,
+    csv_diff,
+    csv_filter,
+    csv_merge,
+    forward,
+    getcol,
+    receive_exit_code,
+    run_tool,
+    send_request,
+)
+from malcolm3utils.scripts.serve import (
+    cli,
+    create_server,
+    default_socket_path,
+    receive_request,
+)
+
+from .conftest import TEST_INPUT
+
+# requests, and whether they are sent with file descriptors
+BAD_REQUESTS = [
+    (b"xx", False),
+    (REQUEST_LENGTH.pack(1 << 30), True),
+    (REQUEST_LENGTH.pack(2) + b"{}", False),
+    (REQUEST_LENGTH.pack(100000) + b" " * 100000, False),
+]
+
+
+def wait_for(socket_path: Path) -> None:
+    for _ in range(200):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(str(socket_path))
+                return
+            except OSError:
+                time.sleep(0.05)
+    raise TimeoutError(f"no server listening on {socket_path}")
+
+
+def run_forwarded(socket_path: Path, tmp_path: Path, tool: str, *argv: str):  # type: ignore[no-untyped-def]
+    stdin_path = tmp_path / "stdin"
+    stdin_path.write_text(TEST_INPUT)
+    with (
+        open(stdin_path) as stdin,
+        open(tmp_path / "stdout", "w") as stdout,
+        open(tmp_path / "stderr", "w") as stderr,
+    ):
+        exit_code = forward(
+            str(socket_path),
+            tool,
+            argv,
+            fds=(stdin.fileno(), stdout.fileno(), stderr.fileno()),
+        )
+    return (
+        exit_code,
+        (tmp_path / "stdout").read_bytes().decode(),
+        (tmp_path / "stderr").read_text(),
+    )
+
+
+def test_serve(tmp_file, tmp_path, monkeypatch, capfd):
+    socket_path = tmp_path / "test.sock"
+    # a socket left behind by a server that is no longer running
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(str(socket_path))
+    os.chdir(tmp_file.parent)
+
+    results = {}
+
+    def client() -> None:
+        try:
+            wait_for(socket_path)
+            assert (socket_path.stat().st_mode & 0o777) == 0o600
+            results["getcol"] = run_forwarded(
+                socket_path, tmp_path, "getcol", "2,D", tmp_file.name
+            )
+            results["stdin"] = run_forwarded(
+                socket_path, tmp_path, "csv-filter", "A == 1"
+            )
+            results["bad filter"] = run_forwarded(
+                socket_path, tmp_path, "csv-filter", "A =="
+            )
+            results["bad option"] = run_forwarded(socket_path, tmp_path, "getcol")
+            results["unknown"] = run_forwarded(socket_path, tmp_path, "ls")
+            for request, with_fds in BAD_REQUESTS:
+                with (
+                    socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock,
+                    open(os.devnull) as devnull,
+                ):
+                    sock.connect(str(socket_path))
+                    if with_fds:
+                        socket.send_fds(sock, [request], [devnull.fileno()] * 3)
+                    else:
+                        sock.sendall(request)
+                    sock.shutdown(socket.SHUT_WR)
+                    assert sock.recv(4) == b""
+            with pytest.raises(click.ClickException):
+                create_server(str(socket_path))
+            monkeypatch.setattr(sys, "argv", ["getcol", "1"])
+            monkeypatch.setenv(SOCKET_ENV, str(socket_path))
+            with pytest.raises(SystemExit) as exit_info:
+                getcol()
+            results["run_tool"] = exit_info.value.code
+        finally:
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    client_thread = threading.Thread(target=client)
+    client_thread.start()
+    result = CliRunner().invoke(
+        cli, ["serve", "--no-fork", "--socket", str(socket_path)]
+    )
+    client_thread.join()
+
+    assert result.exit_code == 0
+    assert result.stderr == f'Listening on "{socket_path}"\n'
+    assert result.stdout.count("Ignoring bad request") == len(BAD_REQUESTS)
+    assert not socket_path.exists()
+    assert os.getcwd() == str(tmp_file.parent)
+
+    assert results["getcol"] == (0, "B,D\r\n2,4\r\n", "")
+    assert results["stdin"] == (0, "A,B,C,D\r\n1,2,3,4\r\n", "")
+    exit_code, _, stderr = results["bad filter"]
+    assert exit_code == 1
+    assert "Traceback" in stderr
+    exit_code, _, stderr = results["bad option"]
+    assert exit_code == 2
+    assert "Missing argument" in stderr
+    assert results["unknown"] == (2, "", "Unknown tool 'ls'\n")
+    assert results["run_tool"] == 0
+
+
+def test_serve_refuses_other_users(tmp_path):
+    class OtherUserSocket:
+        def getsockopt(self, *args):  # type: ignore[no-untyped-def]
+            return struct.pack("3i", 1, os.getuid() + 1, 0)
+
+    server = create_server(str(tmp_path / "test.sock"), fork=False)
+    try:
+        assert not server.verify_request(OtherUserSocket(), None)
+    finally:
+        server.server_close()
+
+
+def test_run_tool_without_server(tmp_file, tmp_path, monkeypatch, capfd):
+    monkeypatch.setattr(sys, "argv", ["getcol", "2", str(tmp_file)])
+    monkeypatch.setenv(SOCKET_ENV, str(tmp_path / "missing.sock"))
+    with pytest.raises(SystemExit) as exit_info:
+        run_tool("getcol")
+    assert exit_info.value.code == 0
+    assert capfd.readouterr().out == "B\r\n2\r\n"
+
+
+@pytest.mark.parametrize(
+    "shim,prog_name",
+    [
+        (getcol, "getcol"),
+        (csv_filter, "csv-filter"),
+        (csv_merge, "csv-merge"),
+        (csv_diff, "csv-diff"),
+    ],
+)
+def test_client_shims(shim, prog_name, monkeypatch, capfd):
+    monkeypatch.setattr(sys, "argv", [prog_name, "--version"])
+    monkeypatch.delenv(SOCKET_ENV, raising=False)
+    with pytest.raises(SystemExit) as exit_info:
+        shim()
+    assert exit_info.value.code == 0
+    assert capfd.readouterr().out.startswith(f"{prog_name}, malcolm3utils version")
+
+
+@pytest.mark.parametrize("read_request", [True, False])
+def test_client_connection_closed(read_request, capfd):
+    client_sock, server_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client_sock, open(os.devnull) as devnull:
+        send_request(
+            client_sock, {"tool": "getcol", "argv": []}, [devnull.fileno()] * 3
+        )
+        if read_request:
+            _, fds, _, _ = socket.recv_fds(server_sock, 65536, 3)
+            for fd in fds:
+                os.close(fd)
+        server_sock.close()
+        assert receive_exit_code(client_sock) == 1
+    assert "closed the connection" in capfd.readouterr().err
+
+
+def test_default_socket_path(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert default_socket_path() == str(tmp_path / f"malcolm3utils-{os.getuid()}.sock")
+
+
+def test_serve_forking(tmp_file, tmp_path):
+    socket_path = tmp_path / "test.sock"
+    env = dict(os.environ)
+    env["PYTHONPATH"] = str(Path(malcolm3utils.__file__).parent.parent)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "malcolm3utils.scripts.serve", "serve"],
+        env=dict(env, **{SOCKET_ENV: str(socket_path)}),
+        stderr=subprocess.PIPE,
+    )
+    try:
+        wait_for(socket_path)
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "from malcolm3utils.scripts.client import csv_filter; csv_filter()",
+                "--discard",
+                "B == 2",
+            ],
+            env=dict(env, **{SOCKET_ENV: str(socket_path)}),
+            input=TEST_INPUT,
+            capture_output=True,
+            text=True,
+            cwd=tmp_path,
+        )
+        assert result.returncode == 0
+        assert result.stdout == "A,B,C,D\n"
+    finally:
+        server.terminate()
+        assert server.wait(timeout=10) == 0
+    assert not socket_path.exists()
+
+
+def test_send_request_in_parts(monkeypatch):
+    real_send_fds = socket.send_fds
+
+    def send_fds_partially(sock, buffers, fds):  # type: ignore[no-untyped-def]
+        return real_send_fds(sock, [buffers[0][:10]], fds)
+
+    monkeypatch.setattr(socket, "send_fds", send_fds_partially)
+    client_sock, server_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client_sock, server_sock, open(os.devnull) as devnull:
+        send_request(
+            client_sock, {"tool": "getcol", "argv": ["1"]}, [devnull.fileno()] * 3
+        )
+        client_sock.shutdown(socket.SHUT_WR)
+        request, fds = receive_request(server_sock)
+        for fd in fds:
+            os.close(fd)
+    assert request["tool"] == "getcol"
+    assert request["argv"] == ["1"]
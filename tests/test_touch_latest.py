@@ -1,3 +1,4 @@
+import json
 import os
 from datetime import datetime
 from pathlib import Path
@@ -6,7 +7,7 @@ from typing import TypedDict
 import pytest
 from click.testing import CliRunner
 
-from malcolm3utils.scripts.touch_latest import touch_latest
+from malcolm3utils.scripts.touch_latest import IgnorePatterns, find_latest, touch_latest
 
 now = int(datetime.now().timestamp())
 
@@ -58,3 +59,44 @@ def test_touch_latest(tmp_tree: Path) -> None:
     assert result.output == ""
     touch_file_stat = touch_file.stat()
     assert touch_file_stat.st_mtime == tmp_tree_files[2]["mtime"]
+
+
+def test_touch_latest_report(tmp_tree: Path) -> None:
+    runner = CliRunner()
+    search_dir = tmp_tree / "sub"
+    touch_file = tmp_tree / "latest"
+    ignore_file = tmp_tree / "ignore"
+    # noinspection PyTypeChecker
+    result = runner.invoke(
+        touch_latest,
+        [
+            "--report",
+            "json",
+            "-i",
+            "*.JUNK",
+            "-f",
+            str(ignore_file),
+            str(touch_file),
+            str(search_dir),
+        ],
+    )
+    assert result.exit_code == 0
+    report = json.loads(result.output)
+    assert report["latest_timestamp"] == tmp_tree_files[2]["mtime"]
+    assert report["latest_file"] == str(search_dir / tmp_tree_files[2]["name"])
+    assert report["dirs_visited"] == 2
+    assert report["files_statted"] == 3
+    assert report["entries_ignored"] == 4
+    assert list(report["path_elapsed"]) == [str(search_dir)]
+
+
+def test_find_latest(tmp_tree: Path) -> None:
+    search_dir = tmp_tree / "sub"
+    walk_report = find_latest([search_dir])
+    assert walk_report.latest_timestamp >= now
+    assert walk_report.files_statted == 7
+    assert walk_report.entries_ignored == 0
+
+    walk_report = find_latest([search_dir], IgnorePatterns(["ignore.*"]))
+    assert walk_report.latest_timestamp == tmp_tree_files[2]["mtime"]
+    assert walk_report.entries_ignored == 4